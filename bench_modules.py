@@ -0,0 +1,112 @@
+"""
+Measures how the cost of the modules grows with the number of users and keyspaces.
+
+Every scenario runs the main function of a module against the in-memory cluster of fake_cassandra.py and
+records the wall time, the connections that were opened and the queries that were sent. The results are
+printed as a table followed by a chart of the time per managed object:
+
+    python bench_modules.py
+    python bench_modules.py --sizes 10 100 1000 --output bench_output.txt
+"""
+
+import argparse
+import math
+
+from fake_cassandra import FakeCassandra, run_module
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+CHART_WIDTH = 50
+
+
+def users_scenario(count):
+    """A quarter of the users is new, a quarter changes the superuser flag, the rest is unchanged."""
+    cassandra = FakeCassandra()
+    existing = count - count // 4
+    cassandra.add_users(existing)
+    users = [dict(user='user{0}'.format(index), superuser=index < count // 4, update_password='on_create')
+             for index in range(existing)]
+    users += [dict(user='new{0}'.format(index), password='password') for index in range(count // 4)]
+    return run_module('cassandra_user', cassandra, dict(users=users))
+
+
+def single_user_scenario(count):
+    """Looks up one unchanged user among count users."""
+    cassandra = FakeCassandra()
+    cassandra.add_users(count)
+    return run_module('cassandra_user', cassandra, dict(user='user0', password='password',
+                                                         update_password='on_create'))
+
+
+def keyspaces_scenario(count):
+    """A quarter of the keyspaces is new, a quarter changes the replication factor, the rest is unchanged."""
+    cassandra = FakeCassandra()
+    existing = count - count // 4
+    cassandra.add_keyspaces(existing)
+    keyspaces = [dict(name='keyspace{0}'.format(index), replication_factor=3 if index < count // 4 else 2)
+                 for index in range(existing)]
+    keyspaces += [dict(name='new{0}'.format(index)) for index in range(count // 4)]
+    return run_module('cassandra_keyspace', cassandra, dict(keyspaces=keyspaces))
+
+
+def facts_scenario(count):
+    cassandra = FakeCassandra()
+    cassandra.add_users(count)
+    cassandra.add_keyspaces(count)
+    return run_module('cassandra_facts', cassandra, dict())
+
+
+SCENARIOS = [
+    ('users', users_scenario),
+    ('single user', single_user_scenario),
+    ('keyspaces', keyspaces_scenario),
+    ('facts', facts_scenario)
+]
+
+
+def run(sizes):
+    measurements = []
+    for name, scenario in SCENARIOS:
+        for size in sizes:
+            result, cost = scenario(size)
+            if result.get('failed'):
+                raise RuntimeError('{0} with {1} objects failed: {2}'.format(name, size, result.get('msg')))
+            measurements.append(dict(scenario=name, size=size, **cost))
+    return measurements
+
+
+def report(measurements):
+    lines = ['{0:<12} {1:>8} {2:>10} {3:>12} {4:>9} {5:>14}'.format(
+        'scenario', 'objects', 'seconds', 'connections', 'queries', 'ms per object')]
+    for measurement in measurements:
+        lines.append('{0:<12} {1:>8} {2:>10.3f} {3:>12} {4:>9} {5:>14.4f}'.format(
+            measurement['scenario'], measurement['size'], measurement['seconds'], measurement['connections'],
+            measurement['queries'], 1000 * measurement['seconds'] / measurement['size']))
+
+    lines.append('')
+    lines.append('seconds per run, logarithmic')
+    lowest = min(measurement['seconds'] for measurement in measurements)
+    highest = max(measurement['seconds'] for measurement in measurements)
+    span = max(math.log10(highest) - math.log10(lowest), 1e-9)
+    for measurement in measurements:
+        width = 1 + int((CHART_WIDTH - 1) * (math.log10(measurement['seconds']) - math.log10(lowest)) / span)
+        lines.append('{0:<12} {1:>8} {2} {3:.3f}s'.format(measurement['scenario'], measurement['size'],
+                                                          '#' * width, measurement['seconds']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='the numbers of users and keyspaces to measure')
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+
+    output = report(run(args.sizes))
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
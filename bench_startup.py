@@ -0,0 +1,136 @@
+"""
+Measures how long the modules take to import their client and to connect, with the DataStax driver and with the
+native client of module_utils/cassandra_native.py.
+
+The import is measured in fresh Python processes, the way every module run starts. The native client connects to
+the fake cluster of fake_cassandra.py served over the native protocol. With --host both clients also connect to
+a real cluster, the driver is not measured against the fake server because it needs more of the protocol:
+
+    python bench_startup.py
+    python bench_startup.py --host 192.168.33.120 --user cassandra --password cassandra --runs 20
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from fake_cassandra import REPO_DIR, FakeCassandra, FakeNativeServer
+
+from ansible.module_utils import cassandra_common
+from ansible.module_utils.cassandra_native import NativeSession
+
+# Runs in a fresh process and prints the seconds it took to import the client. Ansible's own module_utils are
+# imported first, every module needs them whichever client it uses.
+IMPORT_SCRIPT = '''
+import json, sys, time
+import ansible.module_utils
+sys.path.insert(0, {repo_dir!r})
+ansible.module_utils.__path__.append({module_utils!r})
+from ansible.module_utils import basic
+start = time.time()
+from ansible.module_utils import cassandra_common
+if {driver!r} == 'datastax':
+    cassandra_common.load_driver()
+print(json.dumps(dict(seconds=time.time() - start, driver_loaded='cassandra.cluster' in sys.modules)))
+'''
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def import_seconds(driver, runs):
+    script = IMPORT_SCRIPT.format(repo_dir=REPO_DIR, module_utils=os.path.join(REPO_DIR, 'module_utils'),
+                                  driver=driver)
+    measurements = []
+    for run in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', script])
+        result = json.loads(output.decode('utf-8').strip().split('\n')[-1])
+        if result['driver_loaded'] != (driver == 'datastax'):
+            raise RuntimeError('the {0} client imported the wrong modules'.format(driver))
+        measurements.append(result['seconds'])
+    return median(measurements)
+
+
+def native_connect_seconds(host, port, username, password, runs):
+    measurements = []
+    for run in range(runs):
+        start = time.time()
+        session = NativeSession(host, port, username=username, password=password)
+        session.execute("SELECT release_version FROM system.local WHERE key = 'local'")
+        measurements.append(time.time() - start)
+        session.shutdown()
+    return median(measurements)
+
+
+def driver_connect_seconds(host, port, username, password, runs):
+    class Module(object):
+        params = dict(db_host=host, db_port=port, db_user=username, db_password=password, protocol_version=4,
+                      consistency='QUORUM')
+
+    measurements = []
+    for run in range(runs):
+        start = time.time()
+        cluster = cassandra_common.create_cluster(Module())
+        session = cluster.connect()
+        session.execute("SELECT release_version FROM system.local WHERE key = 'local'")
+        measurements.append(time.time() - start)
+        cluster.shutdown()
+    return median(measurements)
+
+
+def run(args):
+    measurements = [('import', 'native', import_seconds('native', args.runs))]
+    if cassandra_common.cassandra_driver_found:
+        measurements.append(('import', 'datastax', import_seconds('datastax', args.runs)))
+
+    if args.host is None:
+        server = FakeNativeServer(FakeCassandra())
+        try:
+            measurements.append(('connect fake', 'native',
+                                 native_connect_seconds('127.0.0.1', server.port, 'cassandra', 'cassandra', args.runs)))
+        finally:
+            server.stop()
+    else:
+        measurements.append(('connect', 'native',
+                             native_connect_seconds(args.host, args.port, args.user, args.password, args.runs)))
+        if cassandra_common.cassandra_driver_found:
+            measurements.append(('connect', 'datastax',
+                                 driver_connect_seconds(args.host, args.port, args.user, args.password, args.runs)))
+    return measurements
+
+
+def report(measurements, runs):
+    lines = ['median of {0} runs'.format(runs),
+             '{0:<14} {1:<10} {2:>12}'.format('step', 'client', 'milliseconds')]
+    for step, client, seconds in measurements:
+        lines.append('{0:<14} {1:<10} {2:>12.1f}'.format(step, client, 1000 * seconds))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--runs', type=int, default=10, help='the number of measurements per step')
+    parser.add_argument('--host', help='also connect to this node of a real cluster')
+    parser.add_argument('--port', type=int, default=9042)
+    parser.add_argument('--user', default='cassandra')
+    parser.add_argument('--password', default='cassandra')
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+
+    output = report(run(args), args.runs)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/python
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.cassandra_common import (cassandra_argument_spec, check_driver, connect, read_keyspaces,
+                                                   read_users)
+
+DOCUMENTATION = '''
+---
+module: cassandra_facts
+short_description: gathers facts about the keyspaces and users of Cassandra databases
+description:
+- Returns the keyspaces with their replication settings, the users and roles with their superuser flag and the
+  version of the cluster as Ansible facts.
+- The facts are read with as few queries as possible, later tasks can use them in 'when' conditions instead of
+  connecting to the cluster again.
+- cassandra_cluster contains the name of the cluster, its release_version, the native_protocol_version of the
+  server and the protocol_version of the connection.
+- cassandra_keyspaces maps every keyspace to the short name of its replication 'class', the 'replication'
+  options and 'durable_writes'.
+- cassandra_users maps every user or role to its 'superuser' and 'can_login' flags. Users of Cassandra versions
+  before 2.2 can always login.
+- options:
+    db_user:
+        description:
+            - The username used to connect to the Cassandra database
+        required: False
+        default: cassandra
+    db_password:
+        description:
+            - The password used with the username to connect to the Cassandra database
+        required: False
+        default: cassandra
+    db_host:
+        description:
+            - The host that should be used to connect to the Cassandra cluster. Should be one member of the cluster.
+        required: False
+        default: localhost
+    db_hosts:
+        description:
+            - Several members of the cluster to connect to instead of db_host. The module connects to all of them at
+              the same time and uses the first one that accepted the credentials, so a node that is down, restarting
+              or paused does not hold up the task.
+            - The result contains the 'connection' with the 'host' that was used and the 'seconds' connecting took.
+              With C(broker) the hosts race when the broker starts and the result has no 'connection'.
+        required: False
+        default: None
+    connect_timeout:
+        description:
+            - The number of seconds to wait for a host to accept the connection.
+            - Defaults to 2 seconds with C(db_hosts) and to the timeout of the client otherwise.
+        required: False
+        default: None
+    db_port:
+        description:
+            - The port that will be used to connect to the cluster.
+            - This is only required if Cassandra is configured to run on something else than the default port.
+        required: False
+        default: 9042
+    protocol_version:
+        description:
+            - The protocol the Cassandra cluster speaks.
+            - For Cassandra version 1.2 you should set 1
+            - For version 2.0 take 1 or 2
+            - For version 2.1 take 1,2 or 3
+            - Beginning with version 2.2 you can also use 4.
+        required: False
+        default: 3
+    broker:
+        description:
+            - Keep the authenticated session open in a local broker process and reuse it in later tasks,
+              similar to ssh's ControlPersist.
+            - The first task starts the broker. It serves one combination of connection options on a unix socket
+              and exits after it was not used for C(broker_ttl) seconds.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    broker_ttl:
+        description:
+            - The number of idle seconds after which the broker closes the session and exits.
+        required: False
+        default: 60
+    broker_socket_dir:
+        description:
+            - The directory for the sockets of the brokers. It is created with permissions only for the current user.
+        required: False
+        default: ~/.ansible/cp
+    driver:
+        description:
+            - The client used to talk to Cassandra. 'datastax' is the DataStax cassandra-driver, 'native' the small
+              client for the native protocol versions 3 and 4 in module_utils that needs nothing but Python and
+              starts much faster. 'auto' uses cassandra-driver if it is installed and the native client otherwise.
+            - The native client only connects to db_host, ignores local_dc and does not support
+              speculative_execution_delay or traces.
+        required: False
+        default: auto
+        choices: ['auto', 'datastax', 'native']
+    profile:
+        description:
+            - Add a 'timings' section to the result with the seconds it took to connect, to authenticate, to run
+              every statement and to wait for schema agreement, together with the number of statements by type.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    trace:
+        description:
+            - Together with C(profile), request a server side trace of every statement and add it to the timings.
+            - Tracing adds load to the cluster and should only be used to analyse slow runs.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    consistency:
+        description:
+            - The consistency level of all statements. In clusters with several data centers LOCAL_QUORUM or
+              LOCAL_ONE avoid waiting for replicas in remote data centers.
+        required: False
+        default: QUORUM
+        choices: ['ONE', 'TWO', 'THREE', 'QUORUM', 'ALL', 'LOCAL_QUORUM', 'EACH_QUORUM', 'LOCAL_ONE']
+    local_dc:
+        description:
+            - The data center whose nodes receive the requests. Without it all requests go to db_host.
+            - The driver then connects to every node of that data center instead of only to db_host.
+        required: False
+        default: None
+    request_timeout:
+        description:
+            - The number of seconds after which a statement fails if no response arrived. Defaults to the driver's
+              timeout.
+        required: False
+        default: None
+    speculative_execution_delay:
+        description:
+            - Send reads that got no response after this many seconds to another node of the data center as well and
+              use the first response. This keeps a slow node from slowing down the module.
+            - Only reads are executed speculatively, changes are sent once.
+        required: False
+        default: None
+    speculative_executions:
+        description:
+            - The maximum number of additional nodes a read is sent to when C(speculative_execution_delay) is set.
+        required: False
+        default: 2
+    gather:
+        description:
+            - The facts that should be gathered. Every group that is left out saves a query.
+        required: False
+        default: ['cluster', 'keyspaces', 'users']
+        choices: ['cluster', 'keyspaces', 'users']
+- notes:
+    - Requires cassandra-driver for python to be installed on the remote host, unless driver is native.
+    - @See U(https://datastax.github.io/python-driver) for more information on how to install this driver
+    - The version of the cluster is also read when only keyspaces are gathered since it tells where the keyspaces
+      are stored.
+    - This module should usually be configured with the 'run_once' option in Ansible since all hosts would
+      return the same facts.
+requirements: ['cassandra-driver']
+author: "Patrick Kranz"
+'''
+
+EXAMPLES = '''
+# Gather all facts and only create the keyspace if it is missing:
+- cassandra_facts: db_user=cassandra db_password=cassandra
+  run_once: true
+
+- cassandra_keyspace: name=orders replication_factor=3
+  when: "'orders' not in cassandra_keyspaces"
+
+# Only gather the users:
+- cassandra_facts:
+    gather: ['users']
+'''
+
+
+def read_cluster(session):
+    rows = session.execute("SELECT cluster_name, release_version, native_protocol_version "
+                           "FROM system.local WHERE key = 'local'")
+    row = rows[0]
+    return dict(name=row.cluster_name, release_version=row.release_version,
+                native_protocol_version=row.native_protocol_version)
+
+
+def main():
+    argument_spec = cassandra_argument_spec()
+    argument_spec.update(
+        db_user=dict(default='cassandra'),
+        db_password=dict(default='cassandra', no_log=True),
+        gather=dict(default=['cluster', 'keyspaces', 'users'], type='list')
+    )
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True
+    )
+
+    check_driver(module)
+
+    gather = module.params['gather']
+    for group in gather:
+        if group not in ['cluster', 'keyspaces', 'users']:
+            module.fail_json(msg="Invalid value {0} for gather.".format(group))
+
+    cluster = None
+    try:
+        cluster, session = connect(module)
+        facts = dict()
+
+        if 'cluster' in gather or 'keyspaces' in gather:
+            cluster_facts = read_cluster(session)
+        if 'cluster' in gather:
+            cluster_facts['protocol_version'] = getattr(cluster, 'protocol_version', module.params['protocol_version'])
+            facts['cassandra_cluster'] = cluster_facts
+        if 'keyspaces' in gather:
+            facts['cassandra_keyspaces'] = read_keyspaces(session, release_version=cluster_facts['release_version'])
+        if 'users' in gather:
+            users = read_users(session)
+            facts['cassandra_users'] = dict((name, dict(superuser=user['superuser'], can_login=user['can_login']))
+                                            for name, user in users.items())
+
+        module.exit_json(changed=False, ansible_facts=facts)
+    except Exception as error:
+        module.fail_json(msg=str(error))
+    finally:
+        if cluster is not None:
+            cluster.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/python
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.cassandra_common import (cassandra_argument_spec, check_driver, connect, create_statement,
+                                                   execute_concurrent_statements, render_statement)
+
+DOCUMENTATION = '''
+---
+module: cassandra_grant
+short_description: permission management for Cassandra databases
+description:
+- Grants and revokes the permissions of a user or role in Cassandra databases
+- The given permissions are the complete set the role should have directly. Missing permissions are granted,
+  permissions that are not listed are revoked. Permissions the role inherits from other roles are not touched.
+- The current permissions are read once with LIST ALL PERMISSIONS and only the differences are sent, so a run
+  without changes does not invalidate the permission caches of the cluster.
+- Be aware that cassandra requires an authorizer other than AllowAllAuthorizer to manage permissions.
+- options:
+    db_user:
+        description:
+            - The username used to connect to the Cassandra database
+        required: False
+        default: cassandra
+    db_password:
+        description:
+            - The password used with the username to connect to the Cassandra database
+        required: False
+        default: cassandra
+    db_host:
+        description:
+            - The host that should be used to connect to the Cassandra cluster. Should be one member of the cluster.
+        required: False
+        default: localhost
+    db_hosts:
+        description:
+            - Several members of the cluster to connect to instead of db_host. The module connects to all of them at
+              the same time and uses the first one that accepted the credentials, so a node that is down, restarting
+              or paused does not hold up the task.
+            - The result contains the 'connection' with the 'host' that was used and the 'seconds' connecting took.
+              With C(broker) the hosts race when the broker starts and the result has no 'connection'.
+        required: False
+        default: None
+    connect_timeout:
+        description:
+            - The number of seconds to wait for a host to accept the connection.
+            - Defaults to 2 seconds with C(db_hosts) and to the timeout of the client otherwise.
+        required: False
+        default: None
+    db_port:
+        description:
+            - The port that will be used to connect to the cluster.
+            - This is only required if Cassandra is configured to run on something else than the default port.
+        required: False
+        default: 9042
+    protocol_version:
+        description:
+            - The protocol the Cassandra cluster speaks.
+            - For Cassandra version 1.2 you should set 1
+            - For version 2.0 take 1 or 2
+            - For version 2.1 take 1,2 or 3
+            - Beginning with version 2.2 you can also use 4.
+        required: False
+        default: 3
+    broker:
+        description:
+            - Keep the authenticated session open in a local broker process and reuse it in later tasks,
+              similar to ssh's ControlPersist.
+            - The first task starts the broker. It serves one combination of connection options on a unix socket
+              and exits after it was not used for C(broker_ttl) seconds.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    broker_ttl:
+        description:
+            - The number of idle seconds after which the broker closes the session and exits.
+        required: False
+        default: 60
+    broker_socket_dir:
+        description:
+            - The directory for the sockets of the brokers. It is created with permissions only for the current user.
+        required: False
+        default: ~/.ansible/cp
+    driver:
+        description:
+            - The client used to talk to Cassandra. 'datastax' is the DataStax cassandra-driver, 'native' the small
+              client for the native protocol versions 3 and 4 in module_utils that needs nothing but Python and
+              starts much faster. 'auto' uses cassandra-driver if it is installed and the native client otherwise.
+            - The native client only connects to db_host, ignores local_dc and does not support
+              speculative_execution_delay or traces.
+        required: False
+        default: auto
+        choices: ['auto', 'datastax', 'native']
+    profile:
+        description:
+            - Add a 'timings' section to the result with the seconds it took to connect, to authenticate, to run
+              every statement and to wait for schema agreement, together with the number of statements by type.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    trace:
+        description:
+            - Together with C(profile), request a server side trace of every statement and add it to the timings.
+            - Tracing adds load to the cluster and should only be used to analyse slow runs.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    consistency:
+        description:
+            - The consistency level of all statements. In clusters with several data centers LOCAL_QUORUM or
+              LOCAL_ONE avoid waiting for replicas in remote data centers.
+        required: False
+        default: QUORUM
+        choices: ['ONE', 'TWO', 'THREE', 'QUORUM', 'ALL', 'LOCAL_QUORUM', 'EACH_QUORUM', 'LOCAL_ONE']
+    local_dc:
+        description:
+            - The data center whose nodes receive the requests. Without it all requests go to db_host.
+            - The driver then connects to every node of that data center instead of only to db_host.
+        required: False
+        default: None
+    request_timeout:
+        description:
+            - The number of seconds after which a statement fails if no response arrived. Defaults to the driver's
+              timeout.
+        required: False
+        default: None
+    speculative_execution_delay:
+        description:
+            - Send reads that got no response after this many seconds to another node of the data center as well and
+              use the first response. This keeps a slow node from slowing down the module.
+            - Only reads are executed speculatively, changes are sent once.
+        required: False
+        default: None
+    speculative_executions:
+        description:
+            - The maximum number of additional nodes a read is sent to when C(speculative_execution_delay) is set.
+        required: False
+        default: 2
+    role:
+        description:
+            - The user or role whose permissions are managed.
+        required: True
+        aliases: ['user']
+    permissions:
+        description:
+            - A list of dictionaries with a 'resource' and the 'permissions' the role should have on it.
+            - Resources are written like in CQL, for example 'ALL KEYSPACES', 'KEYSPACE orders',
+              'TABLE orders.items', 'ALL ROLES', 'ROLE app', 'ALL FUNCTIONS' or 'ALL FUNCTIONS IN KEYSPACE orders'.
+            - Permissions are a list like ['SELECT', 'MODIFY'] or 'ALL' for every permission that applies to the
+              resource.
+            - An empty list revokes all permissions of the role.
+        required: True
+    concurrency:
+        description:
+            - The maximum number of GRANT and REVOKE statements that are in flight at the same time.
+        required: False
+        default: 10
+- notes:
+    - Supports check mode. The permissions are read but nothing is changed, the result contains the statements that
+      would be executed as 'plan'.
+    - Requires cassandra-driver for python to be installed on the remote host, unless driver is native.
+    - @See U(https://datastax.github.io/python-driver) for more information on how to install this driver
+    - This module should usually be configured with the 'run_once' option in Ansible since it makes no sense to grant
+      the same permissions from all the hosts
+    - Permissions on resources the module does not know, like single functions or MBeans, are left as they are.
+requirements: ['cassandra-driver']
+author: "Patrick Kranz"
+'''
+
+EXAMPLES = '''
+# Let 'app' read and write its keyspace and read one table of another keyspace, revoke everything else:
+- cassandra_grant:
+    db_user: cassandra
+    db_password: cassandra
+    role: app
+    permissions:
+      - resource: KEYSPACE app
+        permissions: ['SELECT', 'MODIFY']
+      - resource: TABLE reference.countries
+        permissions: ['SELECT']
+
+# Give 'admin' all permissions on all keyspaces:
+- cassandra_grant:
+    role: admin
+    permissions:
+      - resource: ALL KEYSPACES
+        permissions: ALL
+
+# Revoke all permissions of 'legacy_app':
+- cassandra_grant:
+    role: legacy_app
+    permissions: []
+
+'''
+
+import re
+
+DATA_PERMISSIONS = ['CREATE', 'ALTER', 'DROP', 'SELECT', 'MODIFY', 'AUTHORIZE']
+TABLE_PERMISSIONS = ['ALTER', 'DROP', 'SELECT', 'MODIFY', 'AUTHORIZE']
+ALL_ROLES_PERMISSIONS = ['CREATE', 'ALTER', 'DROP', 'AUTHORIZE', 'DESCRIBE']
+ROLE_PERMISSIONS = ['ALTER', 'DROP', 'AUTHORIZE']
+FUNCTIONS_PERMISSIONS = ['CREATE', 'ALTER', 'DROP', 'AUTHORIZE', 'EXECUTE']
+
+# The resources the module manages:
+# (resource in CQL, the same resource as LIST PERMISSIONS shows it, the permissions that apply to it)
+RESOURCE_TYPES = [
+    ('ALL KEYSPACES', '<all keyspaces>', DATA_PERMISSIONS),
+    ('KEYSPACE {0}', '<keyspace {0}>', DATA_PERMISSIONS),
+    ('TABLE {0}.{1}', '<table {0}.{1}>', TABLE_PERMISSIONS),
+    ('ALL ROLES', '<all roles>', ALL_ROLES_PERMISSIONS),
+    ('ROLE {0}', '<role {0}>', ROLE_PERMISSIONS),
+    ('ALL FUNCTIONS', '<all functions>', FUNCTIONS_PERMISSIONS),
+    ('ALL FUNCTIONS IN KEYSPACE {0}', '<all functions in {0}>', FUNCTIONS_PERMISSIONS)
+]
+
+
+def template_pattern(template):
+    """Turns a resource template into a regular expression that matches names in place of the placeholders."""
+    parts = re.split(r'\{\d\}', template)
+    return re.compile('^' + r'(\w+)'.join(re.escape(part) for part in parts) + '$', re.IGNORECASE)
+
+
+def parse_resource(resource, listed=False):
+    """
+    Returns the resource in CQL and the permissions that apply to it, or None if the resource is unknown.
+    Unquoted names are case insensitive in Cassandra, so they are lower cased.
+    With listed the resource is expected in the form LIST PERMISSIONS returns.
+    """
+    resource = ' '.join(str(resource).split())
+    for cql, listing, applicable in RESOURCE_TYPES:
+        match = template_pattern(listing if listed else cql).match(resource)
+        if match:
+            return cql.format(*[name.lower() for name in match.groups()]), applicable
+    return None
+
+
+def read_permissions(session, role):
+    """Returns the set of (resource, permission) tuples granted directly to the role."""
+    permissions = set()
+    for row in session.execute(create_statement('LIST ALL PERMISSIONS OF %s NORECURSIVE', idempotent=True), [role]):
+        parsed = parse_resource(row.resource, listed=True)
+        if parsed is not None:
+            permissions.add((parsed[0], row.permission.upper()))
+    return permissions
+
+
+def desired_permissions(module):
+    """Returns the set of (resource, permission) tuples of the 'permissions' option, fails on invalid entries."""
+    desired = set()
+    for entry in module.params['permissions']:
+        if not isinstance(entry, dict) or not entry.get('resource'):
+            module.fail_json(msg="Every entry of permissions needs to be a dictionary with at least the key "
+                                 "'resource'.")
+        parsed = parse_resource(entry['resource'])
+        if parsed is None:
+            module.fail_json(msg="Invalid resource {0}.".format(entry['resource']))
+        resource, applicable = parsed
+
+        permissions = entry.get('permissions', [])
+        if not isinstance(permissions, list):
+            permissions = str(permissions).split(',')
+        for permission in permissions:
+            permission = str(permission).strip().upper()
+            if permission in ['ALL', 'ALL PERMISSIONS']:
+                desired.update((resource, applicable_permission) for applicable_permission in applicable)
+            elif permission in applicable:
+                desired.add((resource, permission))
+            else:
+                module.fail_json(msg="Permission {0} does not apply to {1}. Valid permissions are {2}.".format(
+                    permission, resource, ', '.join(applicable)))
+    return desired
+
+
+def plan_permissions(current, desired):
+    """Returns a list of (statement, message) tuples with the GRANTs and REVOKEs needed to reach the desired set."""
+    actions = []
+    for resource, permission in sorted(desired - current):
+        actions.append(('GRANT {0} ON {1} TO %s'.format(permission, resource),
+                        'granted {0} ON {1}'.format(permission, resource)))
+    for resource, permission in sorted(current - desired):
+        actions.append(('REVOKE {0} ON {1} FROM %s'.format(permission, resource),
+                        'revoked {0} ON {1}'.format(permission, resource)))
+    return actions
+
+
+def main():
+    argument_spec = cassandra_argument_spec()
+    argument_spec.update(
+        db_user=dict(default='cassandra'),
+        db_password=dict(default='cassandra', no_log=True),
+        role=dict(required=True, aliases=['user']),
+        permissions=dict(required=True, type='list'),
+        concurrency=dict(default=10, type='int')
+    )
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True
+    )
+
+    check_driver(module)
+
+    role = module.params['role']
+    desired = desired_permissions(module)
+
+    cluster = None
+    try:
+        cluster, session = connect(module)
+
+        actions = plan_permissions(read_permissions(session, role), desired)
+        if module.check_mode:
+            module.exit_json(changed=len(actions) > 0, role=role, changes=[msg for statement, msg in actions],
+                             plan=[render_statement(statement, [role]) for statement, msg in actions])
+
+        statements = [(create_statement(statement), [role]) for statement, msg in actions]
+        outcomes = execute_concurrent_statements(session, statements, module.params['concurrency'])
+
+        changes = []
+        errors = []
+        for (statement, msg), (success, outcome) in zip(actions, outcomes):
+            if success:
+                changes.append(msg)
+            else:
+                errors.append(str(outcome))
+        if len(errors) > 0:
+            module.fail_json(msg=', '.join(errors), changed=len(changes) > 0, role=role, changes=changes)
+        module.exit_json(changed=len(changes) > 0, role=role, changes=changes)
+    except Exception as error:
+        module.fail_json(msg=str(error))
+    finally:
+        if cluster is not None:
+            cluster.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -23,6 +23,21 @@ description:
             - The host that should be used to connect to the Cassandra cluster. Should be one member of the cluster.
         required: False
         default: localhost
+    db_hosts:
+        description:
+            - Several members of the cluster to connect to instead of db_host. The module connects to all of them at
+              the same time and uses the first one that accepted the credentials, so a node that is down, restarting
+              or paused does not hold up the task.
+            - The result contains the 'connection' with the 'host' that was used and the 'seconds' connecting took.
+              With C(broker) the hosts race when the broker starts and the result has no 'connection'.
+        required: False
+        default: None
+    connect_timeout:
+        description:
+            - The number of seconds to wait for a host to accept the connection.
+            - Defaults to 2 seconds with C(db_hosts) and to the timeout of the client otherwise.
+        required: False
+        default: None
     db_port:
         description:
             - The port that will be used to connect to the cluster.
@@ -38,33 +53,167 @@ description:
             - Beginning with version 2.2 you can also use 4.
         required: False
         default: 3
+    broker:
+        description:
+            - Keep the authenticated session open in a local broker process and reuse it in later tasks,
+              similar to ssh's ControlPersist.
+            - The first task starts the broker. It serves one combination of connection options on a unix socket
+              and exits after it was not used for C(broker_ttl) seconds.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    broker_ttl:
+        description:
+            - The number of idle seconds after which the broker closes the session and exits.
+        required: False
+        default: 60
+    broker_socket_dir:
+        description:
+            - The directory for the sockets of the brokers. It is created with permissions only for the current user.
+        required: False
+        default: ~/.ansible/cp
+    driver:
+        description:
+            - The client used to talk to Cassandra. 'datastax' is the DataStax cassandra-driver, 'native' the small
+              client for the native protocol versions 3 and 4 in module_utils that needs nothing but Python and
+              starts much faster. 'auto' uses cassandra-driver if it is installed and the native client otherwise.
+            - The native client only connects to db_host, ignores local_dc and does not support
+              speculative_execution_delay or traces.
+        required: False
+        default: auto
+        choices: ['auto', 'datastax', 'native']
+    profile:
+        description:
+            - Add a 'timings' section to the result with the seconds it took to connect, to authenticate, to run
+              every statement and to wait for schema agreement, together with the number of statements by type.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    trace:
+        description:
+            - Together with C(profile), request a server side trace of every statement and add it to the timings.
+            - Tracing adds load to the cluster and should only be used to analyse slow runs.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    consistency:
+        description:
+            - The consistency level of all statements. In clusters with several data centers LOCAL_QUORUM or
+              LOCAL_ONE avoid waiting for replicas in remote data centers.
+        required: False
+        default: QUORUM
+        choices: ['ONE', 'TWO', 'THREE', 'QUORUM', 'ALL', 'LOCAL_QUORUM', 'EACH_QUORUM', 'LOCAL_ONE']
+    local_dc:
+        description:
+            - The data center whose nodes receive the requests. Without it all requests go to db_host.
+            - The driver then connects to every node of that data center instead of only to db_host.
+        required: False
+        default: None
+    request_timeout:
+        description:
+            - The number of seconds after which a statement fails if no response arrived. Defaults to the driver's
+              timeout.
+        required: False
+        default: None
+    speculative_execution_delay:
+        description:
+            - Send reads that got no response after this many seconds to another node of the data center as well and
+              use the first response. This keeps a slow node from slowing down the module.
+            - Only reads are executed speculatively, changes are sent once.
+        required: False
+        default: None
+    speculative_executions:
+        description:
+            - The maximum number of additional nodes a read is sent to when C(speculative_execution_delay) is set.
+        required: False
+        default: 2
     name:
         description:
             - The name of the keyspace
-        required: True
+            - Names are unquoted identifiers, Cassandra stores them in lower case.
+            - Either this or C(keyspaces) is required.
+        required: False
     strategy:
         description:
-            - The name of the replication strategy. For now only 'SimpleStrategy' is supported
+            - The name of the replication strategy.
         required: False
         default: SimpleStrategy
-        choices: ['SimpleStrategy', 'NetworkTopologyStratey']
+        choices: ['SimpleStrategy', 'NetworkTopologyStrategy']
     replication_factor:
         description:
             - The number of nodes in case of SimpleStrategy the data should be replicated on
         required: False
         default: 2
+    replication:
+        description:
+            - A dictionary mapping every data center to its replication factor in case of NetworkTopologyStrategy.
+            - Data centers that are missing or have a factor of 0 hold no replicas.
+            - Required with NetworkTopologyStrategy, not allowed with SimpleStrategy.
+        required: False
+        default: None
     state:
         description:
             - If the user should be present on the system or not. Put 'absent' if you want the user to be removed.
         required: False
         default: present
         choices: ['absent', 'present']
+    keyspaces:
+        description:
+            - A list of keyspaces that should be managed in one run instead of a single C(name).
+            - Every entry is a dictionary with the key 'name' and optionally 'strategy', 'replication_factor',
+              'replication' and 'state'. Missing keys are taken from the module options of the same name.
+            - The state of all keyspaces is read with one query and the statements are executed one after the other.
+            - Mutually exclusive with C(name).
+        required: False
+        default: None
+    schema_agreement_timeout:
+        description:
+            - The number of seconds to wait for all nodes to agree on the schema after the keyspaces were changed.
+            - The module waits once after all statements instead of after every single statement.
+        required: False
+        default: 10
+    clusters:
+        description:
+            - A list of clusters the keyspaces are reconciled in, instead of the single cluster of C(db_host).
+            - Every entry is a dictionary with an optional 'name' and the connection options of the cluster:
+              'db_host', 'db_hosts', 'db_port', 'db_user', 'db_password', 'protocol_version', 'consistency',
+              'local_dc', 'request_timeout', 'connect_timeout', 'speculative_execution_delay' and
+              'speculative_executions'. Missing options are taken from the module options of the same name.
+            - The clusters are reconciled in parallel. The result contains a result for every cluster in
+              'clusters', a cluster that cannot be reached does not keep the others from being reconciled.
+            - The 'db_password' of the entries is masked in the logs and in the result like C(db_password).
+        required: False
+        default: None
+    cluster_concurrency:
+        description:
+            - The maximum number of clusters that are reconciled at the same time when C(clusters) is given.
+        required: False
+        default: 10
+    fingerprint_table:
+        description:
+            - A bookkeeping table, given as keyspace.table, that keeps a hash of the desired state every keyspace
+              was last reconciled with together with the schema version of the cluster. The keyspace of the table
+              needs to exist, the table is created on the first run.
+            - When the fingerprints of all keyspaces of the task and the schema version are unchanged the module
+              returns right after reading them. Any schema change in the cluster makes the fingerprints stale, the
+              keyspaces are then reconciled as usual and the fingerprints are written anew.
+            - The result contains 'fingerprints' telling if they 'matched' and which were 'missing' or 'stale'.
+        required: False
+        default: None
 - notes:
-    - Requires cassandra-driver for python to be installed on the remote host.
+    - Supports check mode. The keyspaces are read but nothing is changed, the result contains the statements that
+      would be executed as 'plan'.
+    - Requires cassandra-driver for python to be installed on the remote host, unless driver is native.
+    - The keyspaces are read from system_schema.keyspaces, or from system.schema_keyspaces before Cassandra 3.0,
+      with one query. The table follows from the release version the driver read while connecting. The native
+      client and the broker do not know it and detect the table with the first query of a connection.
     - @See U(https://datastax.github.io/python-driver) for more information on how to install this driver
     - This module should usually be configured with the 'run_once' option in Ansible since it makes no sense to create the same user from all the hosts
     - According to the Datastax Cassandra documentation you should run 'nodetool repair' on all nodes that are involved after the keyspace was updated.
-    - Currently this module only supports the SimpleStrategy for replication. NetworkTopologyStratey will be added soon.
+    - When the replication of an existing keyspace changed the result contains 'replication_changes' with the
+      factor before and after for every data center that changed. 'gained_replicas' lists the data centers that
+      need a repair, 'lost_replicas' the ones that need a 'nodetool cleanup'. With SimpleStrategy the data center
+      is called 'replication_factor' and stands for the whole cluster.
 
 requirements: ['cassandra-driver']
 author: "Patrick Kranz"
@@ -80,86 +229,283 @@ EXAMPLES = '''
 # Drop keyspace 'test_keyspace'
 - cassandra_keyspace: name=test_keyspace state=absent
 
+# Replicate the keyspace 'orders' to two data centers:
+- cassandra_keyspace:
+    name: orders
+    strategy: NetworkTopologyStrategy
+    replication:
+      dc1: 3
+      dc2: 2
+
+# Manage several keyspaces at once:
+- cassandra_keyspace:
+    keyspaces:
+      - name: orders
+        replication_factor: 3
+      - name: sessions
+      - name: old_keyspace
+        state: absent
+
+# Create the keyspace in every cluster, at most 20 at the same time:
+- cassandra_keyspace:
+    name: orders
+    replication_factor: 3
+    cluster_concurrency: 20
+    clusters: "{{ cassandra_clusters }}"
+
+# Return after one read as long as neither the keyspaces nor the schema changed:
+- cassandra_keyspace:
+    keyspaces: "{{ app_keyspaces }}"
+    fingerprint_table: ops.ansible_fingerprints
+
+# Show where the time of a run goes:
+- cassandra_keyspace: name=test_keyspace replication_factor=3 profile=yes
+  register: keyspace
+- debug: var=keyspace.timings
+
 '''
 
-import json
+from ansible.module_utils.cassandra_common import (cassandra_argument_spec, check_driver, clusters_argument_spec,
+                                                   connect_for_schema_changes, connected_release_version, identifier,
+                                                   read_keyspaces, reconcile_clusters, wait_for_schema_agreement)
+from ansible.module_utils.cassandra_fingerprint import check_fingerprints, fingerprint_table, update_fingerprints
+
+def replication_map(clazz, replication):
+    entries = ["'class': '" + clazz + "'"]
+    for datacenter in sorted(replication):
+        entries.append("'" + datacenter.replace("'", "''") + "': " + replication[datacenter])
+    return "{ " + ", ".join(entries) + " }"
+
+def create_keyspace_statement(keyspace_name, clazz, replication):
+    return "CREATE KEYSPACE " + keyspace_name + " WITH REPLICATION = " + replication_map(clazz, replication)
+
+def alter_keyspace_statement(keyspace_name, clazz, replication):
+    return "ALTER KEYSPACE " + keyspace_name + " WITH REPLICATION = " + replication_map(clazz, replication)
+
+def normalize_replication(replication):
+    """Returns the replication options as strings without the data centers that hold no replicas."""
+    return dict((key, str(value)) for key, value in replication.items() if str(value) != '0')
+
+def replication_changes(existing, clazz, replication):
+    """
+    Compares the replication factor of every data center. Returns a dict mapping the data centers
+    whose factor changed to their factor before and after.
+    """
+    existing_replication = normalize_replication(existing['replication'])
+    changes = {}
+    for key in set(existing_replication) | set(replication):
+        before = int(existing_replication.get(key, 0))
+        after = int(replication.get(key, 0))
+        # a new strategy places all replicas anew, so every data center counts as changed
+        if before != after or existing['class'] != clazz:
+            changes[key] = dict(before=before, after=after)
+    return changes
+
+def plan_keyspace(keyspaces, keyspace, clazz, replication, state):
+    """
+    Compares one desired keyspace against the existing keyspaces.
+    Returns a list of (statement, message) tuples that need to be executed.
+    """
+    if state == 'present':
+        if keyspace not in keyspaces:
+            return [(create_keyspace_statement(keyspace, clazz, replication), "Keyspace created")]
+        if replication_changes(keyspaces[keyspace], clazz, replication):
+            if clazz == 'SimpleStrategy' and keyspaces[keyspace]['class'] == clazz:
+                return [(alter_keyspace_statement(keyspace, clazz, replication), "Replication factor updated")]
+            return [(alter_keyspace_statement(keyspace, clazz, replication), "Replication updated")]
+    elif keyspace in keyspaces:
+        return [("DROP KEYSPACE " + keyspace, "Keyspace deleted")]
+    return []
+
+def desired_replication(module, keyspace, clazz, replication_factor, replication):
+    """Returns the desired replication options of a keyspace as strings, fails on invalid options."""
+    if clazz == 'SimpleStrategy':
+        if replication:
+            module.fail_json(msg="replication is only supported with NetworkTopologyStrategy, use replication_factor "
+                                 "for keyspace {0}.".format(keyspace))
+        replication = dict(replication_factor=replication_factor)
+    elif not isinstance(replication, dict) or not replication:
+        module.fail_json(msg="NetworkTopologyStrategy needs a replication factor for at least one data center in "
+                             "replication for keyspace {0}.".format(keyspace))
+    for key, value in replication.items():
+        try:
+            if int(value) < 0:
+                raise ValueError()
+        except (TypeError, ValueError):
+            module.fail_json(msg="Invalid replication factor {0} of {1} for keyspace {2}.".format(value, key, keyspace))
+    return normalize_replication(dict((key, int(value)) for key, value in replication.items()))
 
-try:
-    from cassandra import ConsistencyLevel
-    from cassandra.auth import PlainTextAuthProvider
-    from cassandra.cluster import Cluster
-    from cassandra.query import SimpleStatement
-except ImportError:
-    cassandra_driver_found = False
-else:
-    cassandra_driver_found = True
+def desired_keyspaces(module):
+    """Returns the entries of the 'keyspaces' option with the module wide defaults filled in."""
+    desired = []
+    seen = set()
+    for entry in module.params['keyspaces']:
+        if not isinstance(entry, dict) or not entry.get('name'):
+            module.fail_json(msg="Every entry of keyspaces needs to be a dictionary with at least the key 'name'.")
+        keyspace = identifier(module, entry['name'], 'keyspace')
+        if keyspace in seen:
+            module.fail_json(msg="Keyspace {0} is listed more than once.".format(keyspace))
+        seen.add(keyspace)
 
-def keyspace_exists(session, keyspace_name):
-    result = session.execute("SELECT keyspace_name FROM system.schema_keyspaces WHERE keyspace_name = %s", [keyspace_name]);
-    return len(result.current_rows) > 0
+        state = entry.get('state', module.params['state'])
+        clazz = entry.get('strategy', module.params['strategy'])
+        if state not in ['present', 'absent']:
+            module.fail_json(msg="Invalid state {0} for keyspace {1}.".format(state, keyspace))
+        if clazz not in ['SimpleStrategy', 'NetworkTopologyStrategy']:
+            module.fail_json(msg="Invalid strategy {0} for keyspace {1}.".format(clazz, keyspace))
+
+        replication = {}
+        if state == 'present':
+            replication = desired_replication(module, keyspace, clazz,
+                                              entry.get('replication_factor', module.params['replication_factor']),
+                                              entry.get('replication', module.params['replication']))
+        desired.append(dict(name=keyspace, strategy=clazz, state=state, replication=replication))
+    return desired
+
+def reconcile_keyspaces(session, desired_list, check_mode=False, release_version=None):
+    """
+    Reads the state of all desired keyspaces with one query and executes the needed statements one after the other.
+    Returns a result for every keyspace. In check mode the results only contain the statements as 'plan'.
+    Changes to the replication of existing keyspaces are reported per data center.
+    The release_version of the connected node, if known, tells which table holds the keyspaces.
+    """
+    keyspaces = read_keyspaces(session, [desired['name'] for desired in desired_list], release_version)
+    results = []
+    for desired in desired_list:
+        result = dict(keyspace=desired['name'], changed=False)
+        msg_list = []
+        actions = plan_keyspace(keyspaces, desired['name'], desired['strategy'],
+                                desired['replication'], desired['state'])
+        if check_mode:
+            result['plan'] = [statement for statement, msg in actions]
+        if actions and desired['state'] == 'present' and desired['name'] in keyspaces:
+            changes = replication_changes(keyspaces[desired['name']], desired['strategy'], desired['replication'])
+            result['replication_changes'] = changes
+            result['gained_replicas'] = sorted(key for key, change in changes.items()
+                                               if change['after'] > change['before'])
+            result['lost_replicas'] = sorted(key for key, change in changes.items()
+                                             if change['after'] < change['before'])
+        for statement, msg in actions:
+            if check_mode:
+                result['changed'] = True
+                msg_list.append(msg)
+                continue
+            try:
+                session.execute(statement)
+            except Exception as error:
+                result['failed'] = True
+                result['error'] = str(error)
+                break
+            result['changed'] = True
+            msg_list.append(msg)
+        if len(msg_list) > 0:
+            result['msg'] = ', '.join(msg_list)
+        results.append(result)
+    return results
+
+def reconcile(module, desired_list):
+    """
+    Connects to the cluster of the module and brings the desired keyspaces into their state.
+    With a fingerprint_table the keyspaces are only reconciled if their fingerprints do not match.
+    """
+    cluster = None
+    try:
+        cluster, session = connect_for_schema_changes(module)
+
+        table = fingerprint_table(module)
+        if table is not None:
+            states = dict((desired['name'], desired) for desired in desired_list)
+            check = check_fingerprints(session, table, 'keyspace', states)
+            if check['matched']:
+                if module.params['keyspaces'] is not None:
+                    return dict(changed=False, schema_agreement=None, fingerprints=dict(matched=True),
+                                results=[dict(keyspace=desired['name'], changed=False) for desired in desired_list])
+                return dict(changed=False, keyspace=desired_list[0]['name'], fingerprints=dict(matched=True))
+
+        results = reconcile_keyspaces(session, desired_list, module.check_mode,
+                                      connected_release_version(module, cluster))
+        changed = any(result['changed'] for result in results)
+        agreement = None
+        if changed and not module.check_mode:
+            agreement = wait_for_schema_agreement(session, module.params['schema_agreement_timeout'])
+
+        fingerprints = None
+        if table is not None:
+            reconciled = dict((result['keyspace'], states[result['keyspace']]) for result in results
+                              if not result.get('failed'))
+            fingerprints = update_fingerprints(module, session, table, 'keyspace', reconciled, check,
+                                               schema_changed=changed)
+
+        if module.params['keyspaces'] is not None:
+            result = dict(changed=changed, results=results, schema_agreement=agreement)
+            if any(keyspace_result.get('failed') for keyspace_result in results):
+                result.update(failed=True, msg='Some keyspaces could not be reconciled')
+        else:
+            result = results[0]
+            if result.get('failed'):
+                return dict(failed=True, msg=result['error'])
+            if agreement is not None:
+                result['schema_agreement'] = agreement
+        if fingerprints is not None:
+            result['fingerprints'] = fingerprints
+        return result
+    finally:
+        if cluster is not None:
+            cluster.shutdown()
 
-def create_keyspace(session, keyspace_name, clazz, replication_factor):
-    query = "CREATE KEYSPACE " + keyspace_name + " WITH REPLICATION = { 'class': '" + clazz + "', 'replication_factor': " + replication_factor + " }"
-    session.execute(query)
 
 def main():
+    argument_spec = cassandra_argument_spec()
+    argument_spec.update(
+        state=dict(default='present', choices=['present', 'absent']),
+        name=dict(required=False),
+        strategy=dict(default='SimpleStrategy', choices=['SimpleStrategy', 'NetworkTopologyStrategy']),
+        replication_factor=dict(default=2),
+        replication=dict(default=None, type='dict'),
+        keyspaces=dict(default=None, required=False, type='list'),
+        schema_agreement_timeout=dict(default=10, type='float'),
+        fingerprint_table=dict(default=None, required=False)
+    )
+    argument_spec.update(clusters_argument_spec())
     module = AnsibleModule(
-        argument_spec=dict(
-            db_user=dict(required=False),
-            db_password=dict(required=False),
-            db_host=dict(default='localhost'),
-            db_port=dict(default=9042),
-            protocol_version=dict(default=3, choices=[1,2,3,4]),
-            state=dict(default='present', choices=['present', 'absent']),
-            name=dict(required=True),
-            strategy=dict(default='SimpleStrategy', choices=['SimpleStrategy']),
-            replication_factor=dict(default=2)
-        )
+        argument_spec=argument_spec,
+        required_one_of=[['name', 'keyspaces']],
+        mutually_exclusive=[['name', 'keyspaces']],
+        supports_check_mode=True
     )
 
-    if not cassandra_driver_found:
-        module.fail_json(msg='no cassandra driver for python found. please install cassandra-driver.')
+    check_driver(module)
 
-    db_user = module.params['db_user']
-    db_password = module.params['db_password']
-    db_host = module.params['db_host']
-    db_port = module.params['db_port']
     state = module.params['state']
     keyspace = module.params['name']
+    if keyspace is not None:
+        keyspace = identifier(module, keyspace, 'keyspace')
     clazz = module.params['strategy']
     replication_factor = module.params['replication_factor']
 
-    if db_user is not None and db_password is not None:
-        auth_provider = PlainTextAuthProvider(username=db_user, password=db_password)
-        cluster = Cluster(contact_points=[db_host], port=db_port,
-                        auth_provider=auth_provider, protocol_version=module.params['protocol_version'])
+    if module.params['keyspaces'] is not None:
+        desired_list = desired_keyspaces(module)
     else:
-        cluster = Cluster(contact_points=[db_host], port=db_port, protocol_version=module.params['protocol_version'])
+        replication = {}
+        if state == 'present':
+            replication = desired_replication(module, keyspace, clazz, replication_factor,
+                                              module.params['replication'])
+        desired_list = [dict(name=keyspace, strategy=clazz, replication=replication, state=state)]
 
     try:
-        session = cluster.connect()
+        if module.params['clusters'] is not None:
+            results = reconcile_clusters(module, lambda target: reconcile(target, desired_list))
+            changed = any(result.get('changed', False) for result in results)
+            if any(result.get('failed') for result in results):
+                module.fail_json(msg='Some clusters could not be reconciled', changed=changed, clusters=results)
+            module.exit_json(changed=changed, clusters=results)
 
-        if state == 'present':
-            if not keyspace_exists(session, keyspace):
-                create_keyspace(session, keyspace, clazz, replication_factor)
-                module.exit_json(changed=True, keyspace=keyspace, msg="Keyspace created")
-            else:
-                rows = session.execute("SELECT strategy_options FROM system.schema_keyspaces WHERE keyspace_name = %s", [keyspace])
-                options = json.loads("[" + rows[0].strategy_options + "]")
-                if options[0]['replication_factor'] != replication_factor:
-                    query = "ALTER KEYSPACE " + keyspace + " WITH REPLICATION = { 'class': '" + clazz + "', 'replication_factor': " + replication_factor + " }"
-                    session.execute(query)
-                    module.exit_json(changed=True, keyspace=keyspace, msg="Replication factor updated")
-        else:
-            if keyspace_exists(session, keyspace):
-                session.execute("DROP KEYSPACE " + keyspace)
-                module.exit_json(changed=True, keyspace=keyspace, msg="Keyspace deleted")
-
-        module.exit_json(changed=False, keyspace=keyspace)
+        result = reconcile(module, desired_list)
     except Exception as error:
         module.fail_json(msg=str(error))
-    finally:
-        cluster.shutdown()
+    if result.pop('failed', False):
+        module.fail_json(**result)
+    module.exit_json(**result)
 
 
 from ansible.module_utils.basic import *
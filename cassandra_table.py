@@ -0,0 +1,592 @@
+#!/usr/bin/python
+
+DOCUMENTATION = '''
+---
+module: cassandra_table
+short_description: table and type management for Cassandra databases
+description:
+- Creates, alters and drops the tables and user defined types of a keyspace from a declarative definition.
+- The current schema of the keyspace is read once and only the statements for the differences are sent. The module
+  waits for schema agreement once after all of them instead of after every statement.
+- options:
+    db_user:
+        description:
+            - The username used to connect to the Cassandra database
+        required: False
+        default: cassandra
+    db_password:
+        description:
+            - The password used with the username to connect to the Cassandra database
+        required: False
+        default: cassandra
+    db_host:
+        description:
+            - The host that should be used to connect to the Cassandra cluster. Should be one member of the cluster.
+        required: False
+        default: localhost
+    db_hosts:
+        description:
+            - Several members of the cluster to connect to instead of db_host. The module connects to all of them at
+              the same time and uses the first one that accepted the credentials, so a node that is down, restarting
+              or paused does not hold up the task.
+            - The result contains the 'connection' with the 'host' that was used and the 'seconds' connecting took.
+              With C(broker) the hosts race when the broker starts and the result has no 'connection'.
+        required: False
+        default: None
+    connect_timeout:
+        description:
+            - The number of seconds to wait for a host to accept the connection.
+            - Defaults to 2 seconds with C(db_hosts) and to the timeout of the client otherwise.
+        required: False
+        default: None
+    db_port:
+        description:
+            - The port that will be used to connect to the cluster.
+            - This is only required if Cassandra is configured to run on something else than the default port.
+        required: False
+        default: 9042
+    protocol_version:
+        description:
+            - The protocol the Cassandra cluster speaks.
+            - For Cassandra version 1.2 you should set 1
+            - For version 2.0 take 1 or 2
+            - For version 2.1 take 1,2 or 3
+            - Beginning with version 2.2 you can also use 4.
+        required: False
+        default: 3
+    broker:
+        description:
+            - Keep the authenticated session open in a local broker process and reuse it in later tasks,
+              similar to ssh's ControlPersist.
+            - The first task starts the broker. It serves one combination of connection options on a unix socket
+              and exits after it was not used for C(broker_ttl) seconds.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    broker_ttl:
+        description:
+            - The number of idle seconds after which the broker closes the session and exits.
+        required: False
+        default: 60
+    broker_socket_dir:
+        description:
+            - The directory for the sockets of the brokers. It is created with permissions only for the current user.
+        required: False
+        default: ~/.ansible/cp
+    driver:
+        description:
+            - The client used to talk to Cassandra. 'datastax' is the DataStax cassandra-driver, 'native' the small
+              client for the native protocol versions 3 and 4 in module_utils that needs nothing but Python and
+              starts much faster. 'auto' uses cassandra-driver if it is installed and the native client otherwise.
+            - The native client only connects to db_host, ignores local_dc and does not support
+              speculative_execution_delay or traces.
+        required: False
+        default: auto
+        choices: ['auto', 'datastax', 'native']
+    profile:
+        description:
+            - Add a 'timings' section to the result with the seconds it took to connect, to authenticate, to run
+              every statement and to wait for schema agreement, together with the number of statements by type.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    trace:
+        description:
+            - Together with C(profile), request a server side trace of every statement and add it to the timings.
+            - Tracing adds load to the cluster and should only be used to analyse slow runs.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    consistency:
+        description:
+            - The consistency level of all statements. In clusters with several data centers LOCAL_QUORUM or
+              LOCAL_ONE avoid waiting for replicas in remote data centers.
+        required: False
+        default: QUORUM
+        choices: ['ONE', 'TWO', 'THREE', 'QUORUM', 'ALL', 'LOCAL_QUORUM', 'EACH_QUORUM', 'LOCAL_ONE']
+    local_dc:
+        description:
+            - The data center whose nodes receive the requests. Without it all requests go to db_host.
+            - The driver then connects to every node of that data center instead of only to db_host.
+        required: False
+        default: None
+    request_timeout:
+        description:
+            - The number of seconds after which a statement fails if no response arrived. Defaults to the driver's
+              timeout.
+        required: False
+        default: None
+    speculative_execution_delay:
+        description:
+            - Send reads that got no response after this many seconds to another node of the data center as well and
+              use the first response. This keeps a slow node from slowing down the module.
+            - Only reads are executed speculatively, changes are sent once.
+        required: False
+        default: None
+    speculative_executions:
+        description:
+            - The maximum number of additional nodes a read is sent to when C(speculative_execution_delay) is set.
+        required: False
+        default: 2
+    keyspace:
+        description:
+            - The keyspace the tables and types belong to.
+        required: True
+    name:
+        description:
+            - The name of a single table. Either this, C(tables) or C(types) is required.
+        required: False
+    columns:
+        description:
+            - A dictionary mapping the column names of the table C(name) to their CQL types, like 'text' or
+              'map<text, int>'. Append ' static' to the type for static columns.
+        required: False
+    primary_key:
+        description:
+            - The primary key of the table C(name). Either a single column or a list whose first element is the
+              partition key, a column or a list of columns, followed by the clustering columns.
+        required: False
+    clustering_order:
+        description:
+            - A dictionary mapping clustering columns to ASC or DESC, columns that are not listed are ASC.
+            - It can only be set when the table is created, the module fails if it differs from an existing table.
+        required: False
+        default: None
+    state:
+        description:
+            - If the table should be present or not. Put 'absent' if you want the table to be dropped.
+        required: False
+        default: present
+        choices: ['absent', 'present']
+    drop_columns:
+        description:
+            - Drop the columns of existing tables that are not part of the definition. Otherwise they are only
+              reported as 'extra_columns'.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    tables:
+        description:
+            - A list of tables that are reconciled in one run instead of the single table C(name).
+            - Every entry is a dictionary with the keys 'name', 'columns' and 'primary_key' and optionally
+              'clustering_order' and 'state'.
+            - Mutually exclusive with C(name).
+        required: False
+        default: None
+    types:
+        description:
+            - A list of user defined types of the keyspace. Every entry is a dictionary with the keys 'name' and
+              'fields', a dictionary mapping the field names to their CQL types, and optionally 'state'.
+            - Types are created and altered before the tables, so the tables can use them, and dropped after them.
+        required: False
+        default: None
+    schema_agreement_timeout:
+        description:
+            - The number of seconds to wait for all nodes to agree on the schema after tables or types were changed.
+            - The module waits once after all statements instead of after every single statement.
+        required: False
+        default: 10
+- notes:
+    - Supports check mode. The schema is read but nothing is changed, the result contains the statements that
+      would be executed as 'plan'.
+    - Requires cassandra-driver for python to be installed on the remote host, unless driver is native.
+    - @See U(https://datastax.github.io/python-driver) for more information on how to install this driver
+    - Requires Cassandra 3.0 or later, the current schema is read from system_schema.columns and
+      system_schema.types with one query each.
+    - Only the differences are sent. New columns and fields are added, columns are only dropped with
+      C(drop_columns). Cassandra can neither change the primary key nor the type of a column, such differences
+      fail the table and leave it as it is.
+    - This module should usually be configured with the 'run_once' option in Ansible since it makes no sense to
+      change the same schema from all the hosts
+requirements: ['cassandra-driver']
+author: "Patrick Kranz"
+'''
+
+EXAMPLES = '''
+# Create the table 'orders.items' or add the columns that are missing:
+- cassandra_table:
+    keyspace: orders
+    name: items
+    columns:
+      order_id: uuid
+      item_id: int
+      name: text
+      quantity: int
+      attributes: map<text, text>
+    primary_key: [order_id, item_id]
+
+# Create a type and two tables in one run, waiting for schema agreement only once:
+- cassandra_table:
+    keyspace: customers
+    types:
+      - name: address
+        fields:
+          street: text
+          city: text
+    tables:
+      - name: customers
+        columns:
+          tenant: text
+          id: uuid
+          home: frozen<address>
+        primary_key: [[tenant, id]]
+      - name: events
+        columns:
+          customer_id: uuid
+          created: timestamp
+          payload: text
+        primary_key: [customer_id, created]
+        clustering_order:
+          created: DESC
+
+# Drop a table:
+- cassandra_table: keyspace=orders name=old_items state=absent
+
+'''
+
+import re
+
+from ansible.module_utils.cassandra_common import (cassandra_argument_spec, cassandra_errors, check_driver,
+                                                   connect_for_schema_changes, identifier, wait_for_schema_agreement)
+
+CQL_TYPE = re.compile(r'^[\w<>, ]+$')
+
+
+class SchemaConflict(Exception):
+    """A difference between the definition and the schema that Cassandra cannot change."""
+
+
+def normalize_type(cql_type):
+    """Returns a CQL type the way it is compared with the schema: lower case, without spaces, varchar as text."""
+    return re.sub(r'\bvarchar\b', 'text', ''.join(cql_type.lower().split()))
+
+
+def column_type(module, name, cql_type):
+    """Returns the type of a column and whether it is static."""
+    parts = str(cql_type).split()
+    static = len(parts) > 1 and parts[-1].lower() == 'static'
+    if static:
+        parts = parts[:-1]
+    cql_type = ' '.join(parts).lower()
+    if not CQL_TYPE.match(cql_type):
+        module.fail_json(msg="Invalid type {0} of column {1}.".format(cql_type, name))
+    return cql_type, static
+
+
+def desired_table(module, entry):
+    """Validates the definition of a table. Returns it with all names as Cassandra stores them."""
+    if not isinstance(entry, dict) or not entry.get('name'):
+        module.fail_json(msg="Every entry of tables needs to be a dictionary with at least the key 'name'.")
+    name = identifier(module, entry['name'], 'table')
+    state = entry.get('state', module.params['state'])
+    if state not in ['present', 'absent']:
+        module.fail_json(msg="Invalid state {0} for table {1}.".format(state, name))
+    table = dict(name=name, state=state, columns=[], static=set(), partition_key=[], clustering=[],
+                 clustering_order={})
+    if state == 'absent':
+        return table
+
+    columns = entry.get('columns')
+    if not isinstance(columns, dict) or len(columns) == 0:
+        module.fail_json(msg="Table {0} needs a dictionary of columns.".format(name))
+    for column, cql_type in columns.items():
+        column = identifier(module, column, 'column')
+        cql_type, static = column_type(module, column, cql_type)
+        table['columns'].append((column, cql_type))
+        if static:
+            table['static'].add(column)
+
+    primary_key = entry.get('primary_key')
+    if not isinstance(primary_key, list):
+        primary_key = [primary_key]
+    if len(primary_key) == 0 or primary_key[0] is None or primary_key[0] == []:
+        module.fail_json(msg="Table {0} needs a primary_key.".format(name))
+    partition_key = primary_key[0] if isinstance(primary_key[0], list) else [primary_key[0]]
+    table['partition_key'] = [identifier(module, column, 'column') for column in partition_key]
+    table['clustering'] = [identifier(module, column, 'column') for column in primary_key[1:]]
+    names = [column for column, cql_type in table['columns']]
+    for column in table['partition_key'] + table['clustering']:
+        if column not in names:
+            module.fail_json(msg="Primary key column {0} of table {1} is not one of its columns.".format(column, name))
+
+    for column, order in (entry.get('clustering_order') or {}).items():
+        column = identifier(module, column, 'column')
+        if column not in table['clustering'] or str(order).upper() not in ['ASC', 'DESC']:
+            module.fail_json(msg="Invalid clustering order {0} {1} for table {2}.".format(column, order, name))
+        table['clustering_order'][column] = str(order).upper()
+    return table
+
+
+def desired_type(module, entry):
+    """Validates the definition of a user defined type."""
+    if not isinstance(entry, dict) or not entry.get('name'):
+        module.fail_json(msg="Every entry of types needs to be a dictionary with at least the key 'name'.")
+    name = identifier(module, entry['name'], 'type')
+    state = entry.get('state', 'present')
+    if state not in ['present', 'absent']:
+        module.fail_json(msg="Invalid state {0} for type {1}.".format(state, name))
+    fields = []
+    if state == 'present':
+        if not isinstance(entry.get('fields'), dict) or len(entry['fields']) == 0:
+            module.fail_json(msg="Type {0} needs a dictionary of fields.".format(name))
+        for field, cql_type in entry['fields'].items():
+            field = identifier(module, field, 'field')
+            cql_type = str(cql_type).lower()
+            if not CQL_TYPE.match(cql_type):
+                module.fail_json(msg="Invalid type {0} of field {1}.".format(cql_type, field))
+            fields.append((field, cql_type))
+    return dict(name=name, state=state, fields=fields)
+
+
+def read_tables(session, keyspace):
+    """
+    Returns the columns, primary key, clustering order and static columns of every table of the keyspace,
+    read with one query.
+    """
+    tables = {}
+    rows = session.execute("SELECT table_name, column_name, kind, position, type, clustering_order "
+                           "FROM system_schema.columns WHERE keyspace_name = %s", [keyspace])
+    for row in rows:
+        table = tables.setdefault(row.table_name, dict(columns={}, static=set(), partition_key={}, clustering={},
+                                                       clustering_order={}))
+        table['columns'][row.column_name] = row.type
+        if row.kind == 'partition_key':
+            table['partition_key'][row.position] = row.column_name
+        elif row.kind == 'clustering':
+            table['clustering'][row.position] = row.column_name
+            table['clustering_order'][row.column_name] = row.clustering_order.upper()
+        elif row.kind == 'static':
+            table['static'].add(row.column_name)
+    for table in tables.values():
+        for key in ['partition_key', 'clustering']:
+            table[key] = [table[key][position] for position in sorted(table[key])]
+    return tables
+
+
+def read_types(session, keyspace):
+    """Returns the fields of every user defined type of the keyspace, read with one query."""
+    types = {}
+    rows = session.execute("SELECT type_name, field_names, field_types FROM system_schema.types "
+                           "WHERE keyspace_name = %s", [keyspace])
+    for row in rows:
+        types[row.type_name] = dict(zip(row.field_names, row.field_types))
+    return types
+
+
+def create_table_statement(keyspace, table):
+    definitions = []
+    for column, cql_type in table['columns']:
+        definitions.append(column + " " + cql_type + (" static" if column in table['static'] else ""))
+    primary_key = "(" + ", ".join(table['partition_key']) + ")"
+    if len(table['clustering']) > 0:
+        primary_key += ", " + ", ".join(table['clustering'])
+    definitions.append("PRIMARY KEY (" + primary_key + ")")
+    statement = "CREATE TABLE " + keyspace + "." + table['name'] + " (" + ", ".join(definitions) + ")"
+    if len(table['clustering_order']) > 0:
+        statement += " WITH CLUSTERING ORDER BY (" + ", ".join(
+            column + " " + table['clustering_order'].get(column, 'ASC') for column in table['clustering']) + ")"
+    return statement
+
+
+def plan_table(tables, keyspace, table, drop_columns):
+    """
+    Compares one desired table against the existing tables.
+    Returns a list of (statement, message) tuples that need to be executed and the columns that are not defined.
+    Raises SchemaConflict for differences Cassandra cannot change.
+    """
+    name = table['name']
+    if table['state'] == 'absent':
+        if name in tables:
+            return [("DROP TABLE " + keyspace + "." + name, "Table dropped")], []
+        return [], []
+    if name not in tables:
+        return [(create_table_statement(keyspace, table), "Table created")], []
+
+    existing = tables[name]
+    if existing['partition_key'] != table['partition_key'] or existing['clustering'] != table['clustering']:
+        raise SchemaConflict("The primary key of table {0} cannot be changed.".format(name))
+    for column in table['clustering']:
+        if existing['clustering_order'][column] != table['clustering_order'].get(column, 'ASC'):
+            raise SchemaConflict("The clustering order of column {0} of table {1} cannot be changed to {2}.".format(
+                column, name, table['clustering_order'].get(column, 'ASC')))
+    actions = []
+    for column, cql_type in table['columns']:
+        static = column in table['static']
+        if column not in existing['columns']:
+            actions.append(("ALTER TABLE " + keyspace + "." + name + " ADD " + column + " " + cql_type +
+                            (" static" if static else ""), "Column {0} added".format(column)))
+        elif normalize_type(existing['columns'][column]) != normalize_type(cql_type):
+            raise SchemaConflict("Column {0} of table {1} is {2}, its type cannot be changed to {3}.".format(
+                column, name, existing['columns'][column], cql_type))
+        elif (column in existing['static']) != static:
+            raise SchemaConflict("Column {0} of table {1} cannot be made {2}.".format(
+                column, name, 'static' if static else 'regular'))
+
+    defined = set(column for column, cql_type in table['columns'])
+    extra = sorted(column for column in existing['columns'] if column not in defined)
+    if drop_columns:
+        for column in extra:
+            actions.append(("ALTER TABLE " + keyspace + "." + name + " DROP " + column,
+                            "Column {0} dropped".format(column)))
+        extra = []
+    return actions, extra
+
+
+def plan_type(types, keyspace, user_type):
+    """
+    Compares one desired user defined type against the existing types.
+    Returns a list of (statement, message) tuples that need to be executed and the fields that are not defined.
+    """
+    name = user_type['name']
+    if user_type['state'] == 'absent':
+        if name in types:
+            return [("DROP TYPE " + keyspace + "." + name, "Type dropped")], []
+        return [], []
+    if name not in types:
+        fields = ", ".join(field + " " + cql_type for field, cql_type in user_type['fields'])
+        return [("CREATE TYPE " + keyspace + "." + name + " (" + fields + ")", "Type created")], []
+
+    actions = []
+    for field, cql_type in user_type['fields']:
+        if field not in types[name]:
+            actions.append(("ALTER TYPE " + keyspace + "." + name + " ADD " + field + " " + cql_type,
+                            "Field {0} added".format(field)))
+        elif normalize_type(types[name][field]) != normalize_type(cql_type):
+            raise SchemaConflict("Field {0} of type {1} is {2}, its type cannot be changed to {3}.".format(
+                field, name, types[name][field], cql_type))
+    defined = set(field for field, cql_type in user_type['fields'])
+    return actions, sorted(field for field in types[name] if field not in defined)
+
+
+def execute_actions(session, result, actions, check_mode):
+    """Executes the statements of one table or type one after the other and records the outcome in its result."""
+    msg_list = []
+    if check_mode:
+        result['plan'] = [statement for statement, msg in actions]
+    for statement, msg in actions:
+        if not check_mode:
+            try:
+                session.execute(statement)
+            except Exception as error:
+                result['failed'] = True
+                result['error'] = str(error)
+                break
+        result['changed'] = True
+        msg_list.append(msg)
+    if len(msg_list) > 0:
+        result['msg'] = ', '.join(msg_list)
+    return result
+
+
+def reconcile_schema(module, session, keyspace, tables, types):
+    """
+    Reads the schema of the keyspace once and executes the statements for all desired types and tables.
+    Types that are present come first, so tables can use them, and types that are absent come last.
+    Returns a result for every table and type.
+    """
+    try:
+        existing_tables = read_tables(session, keyspace)
+        existing_types = read_types(session, keyspace) if len(types) > 0 else {}
+    except cassandra_errors('InvalidRequest'):
+        module.fail_json(msg='cassandra_table requires Cassandra 3.0 or later.')
+
+    ordered = [('type', user_type) for user_type in types if user_type['state'] == 'present']
+    ordered += [('table', table) for table in tables]
+    ordered += [('type', user_type) for user_type in types if user_type['state'] == 'absent']
+
+    results = []
+    for kind, desired in ordered:
+        result = {kind: desired['name'], 'changed': False}
+        try:
+            if kind == 'table':
+                actions, extra = plan_table(existing_tables, keyspace, desired, module.params['drop_columns'])
+            else:
+                actions, extra = plan_type(existing_types, keyspace, desired)
+        except SchemaConflict as conflict:
+            result['failed'] = True
+            result['error'] = str(conflict)
+            results.append(result)
+            continue
+        if len(extra) > 0:
+            result['extra_columns' if kind == 'table' else 'extra_fields'] = extra
+        results.append(execute_actions(session, result, actions, module.check_mode))
+    return results
+
+
+def main():
+    argument_spec = cassandra_argument_spec()
+    argument_spec.update(
+        keyspace=dict(required=True),
+        name=dict(required=False),
+        columns=dict(default=None, required=False, type='dict'),
+        primary_key=dict(default=None, required=False, type='raw'),
+        clustering_order=dict(default=None, required=False, type='dict'),
+        state=dict(default='present', choices=['present', 'absent']),
+        drop_columns=dict(default='no', type='bool'),
+        tables=dict(default=None, required=False, type='list'),
+        types=dict(default=None, required=False, type='list'),
+        schema_agreement_timeout=dict(default=10, type='float')
+    )
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        required_one_of=[['name', 'tables', 'types']],
+        mutually_exclusive=[['name', 'tables']],
+        supports_check_mode=True
+    )
+
+    check_driver(module)
+
+    keyspace = identifier(module, module.params['keyspace'], 'keyspace')
+    if module.params['name'] is not None:
+        tables = [desired_table(module, dict(name=module.params['name'], columns=module.params['columns'],
+                                             primary_key=module.params['primary_key'],
+                                             clustering_order=module.params['clustering_order']))]
+    else:
+        tables = [desired_table(module, entry) for entry in module.params['tables'] or []]
+    types = [desired_type(module, entry) for entry in module.params['types'] or []]
+    for what, definitions in [('Table', tables), ('Type', types)]:
+        names = [definition['name'] for definition in definitions]
+        for name in set(names):
+            if names.count(name) > 1:
+                module.fail_json(msg="{0} {1} is listed more than once.".format(what, name))
+
+    cluster = None
+    try:
+        cluster, session = connect_for_schema_changes(module)
+
+        results = reconcile_schema(module, session, keyspace, tables, types)
+        changed = any(result['changed'] for result in results)
+        agreement = None
+        if changed and not module.check_mode:
+            agreement = wait_for_schema_agreement(session, module.params['schema_agreement_timeout'])
+
+        if module.params['name'] is None:
+            if any(result.get('failed') for result in results):
+                module.fail_json(msg='Some tables or types could not be reconciled', changed=changed,
+                                 results=results, schema_agreement=agreement)
+            module.exit_json(changed=changed, results=results, schema_agreement=agreement)
+
+        result = [result for result in results if 'table' in result][0]
+        type_results = [type_result for type_result in results if 'type' in type_result]
+        if len(type_results) > 0:
+            result['types'] = type_results
+        if agreement is not None:
+            result['schema_agreement'] = agreement
+        errors = [failed['error'] for failed in results if failed.get('failed')]
+        if len(errors) > 0:
+            result.pop('failed', None)
+            result.pop('error', None)
+            result['msg'] = ', '.join(errors)
+            result['changed'] = changed
+            module.fail_json(**result)
+        module.exit_json(**result)
+    except Exception as error:
+        module.fail_json(msg=str(error))
+    finally:
+        if cluster is not None:
+            cluster.shutdown()
+
+
+from ansible.module_utils.basic import *
+if __name__ == '__main__':
+    main()
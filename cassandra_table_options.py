@@ -0,0 +1,521 @@
+#!/usr/bin/python
+
+DOCUMENTATION = '''
+---
+module: cassandra_table_options
+short_description: tuning of the table options of Cassandra databases
+description:
+- Sets the compaction, compression, caching, bloom_filter_fp_chance and gc_grace_seconds options of many tables.
+- The options of all tables are read with one query and only the tables whose options differ are altered. The
+  module waits for schema agreement once after all of them instead of after every statement.
+- Only the options that are given are compared, and of the map options only the sub options that are given.
+  Values are compared the way Cassandra stores them, so 'LeveledCompactionStrategy' matches the full class name,
+  4 matches '4' and 'all' matches 'ALL'.
+- options:
+    db_user:
+        description:
+            - The username used to connect to the Cassandra database
+        required: False
+        default: cassandra
+    db_password:
+        description:
+            - The password used with the username to connect to the Cassandra database
+        required: False
+        default: cassandra
+    db_host:
+        description:
+            - The host that should be used to connect to the Cassandra cluster. Should be one member of the cluster.
+        required: False
+        default: localhost
+    db_hosts:
+        description:
+            - Several members of the cluster to connect to instead of db_host. The module connects to all of them at
+              the same time and uses the first one that accepted the credentials, so a node that is down, restarting
+              or paused does not hold up the task.
+            - The result contains the 'connection' with the 'host' that was used and the 'seconds' connecting took.
+              With C(broker) the hosts race when the broker starts and the result has no 'connection'.
+        required: False
+        default: None
+    connect_timeout:
+        description:
+            - The number of seconds to wait for a host to accept the connection.
+            - Defaults to 2 seconds with C(db_hosts) and to the timeout of the client otherwise.
+        required: False
+        default: None
+    db_port:
+        description:
+            - The port that will be used to connect to the cluster.
+            - This is only required if Cassandra is configured to run on something else than the default port.
+        required: False
+        default: 9042
+    protocol_version:
+        description:
+            - The protocol the Cassandra cluster speaks.
+            - For Cassandra version 1.2 you should set 1
+            - For version 2.0 take 1 or 2
+            - For version 2.1 take 1,2 or 3
+            - Beginning with version 2.2 you can also use 4.
+        required: False
+        default: 3
+    broker:
+        description:
+            - Keep the authenticated session open in a local broker process and reuse it in later tasks,
+              similar to ssh's ControlPersist.
+            - The first task starts the broker. It serves one combination of connection options on a unix socket
+              and exits after it was not used for C(broker_ttl) seconds.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    broker_ttl:
+        description:
+            - The number of idle seconds after which the broker closes the session and exits.
+        required: False
+        default: 60
+    broker_socket_dir:
+        description:
+            - The directory for the sockets of the brokers. It is created with permissions only for the current user.
+        required: False
+        default: ~/.ansible/cp
+    driver:
+        description:
+            - The client used to talk to Cassandra. 'datastax' is the DataStax cassandra-driver, 'native' the small
+              client for the native protocol versions 3 and 4 in module_utils that needs nothing but Python and
+              starts much faster. 'auto' uses cassandra-driver if it is installed and the native client otherwise.
+            - The native client only connects to db_host, ignores local_dc and does not support
+              speculative_execution_delay or traces.
+        required: False
+        default: auto
+        choices: ['auto', 'datastax', 'native']
+    profile:
+        description:
+            - Add a 'timings' section to the result with the seconds it took to connect, to authenticate, to run
+              every statement and to wait for schema agreement, together with the number of statements by type.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    trace:
+        description:
+            - Together with C(profile), request a server side trace of every statement and add it to the timings.
+            - Tracing adds load to the cluster and should only be used to analyse slow runs.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    consistency:
+        description:
+            - The consistency level of all statements. In clusters with several data centers LOCAL_QUORUM or
+              LOCAL_ONE avoid waiting for replicas in remote data centers.
+        required: False
+        default: QUORUM
+        choices: ['ONE', 'TWO', 'THREE', 'QUORUM', 'ALL', 'LOCAL_QUORUM', 'EACH_QUORUM', 'LOCAL_ONE']
+    local_dc:
+        description:
+            - The data center whose nodes receive the requests. Without it all requests go to db_host.
+            - The driver then connects to every node of that data center instead of only to db_host.
+        required: False
+        default: None
+    request_timeout:
+        description:
+            - The number of seconds after which a statement fails if no response arrived. Defaults to the driver's
+              timeout.
+        required: False
+        default: None
+    speculative_execution_delay:
+        description:
+            - Send reads that got no response after this many seconds to another node of the data center as well and
+              use the first response. This keeps a slow node from slowing down the module.
+            - Only reads are executed speculatively, changes are sent once.
+        required: False
+        default: None
+    speculative_executions:
+        description:
+            - The maximum number of additional nodes a read is sent to when C(speculative_execution_delay) is set.
+        required: False
+        default: 2
+    keyspace:
+        description:
+            - The keyspace of the table, and of every entry of C(tables) that has no 'keyspace' of its own.
+        required: False
+        default: None
+    name:
+        description:
+            - The name of the table
+            - Either this or C(tables) is required.
+        required: False
+    compaction:
+        description:
+            - The compaction options of the table, a dictionary with at least the 'class' of the strategy, like
+              LeveledCompactionStrategy or the full class name.
+            - CQL replaces the whole map, so the module sends the current sub options together with the given ones.
+              When the class changes only the given sub options are sent, the others return to the defaults of the
+              new class.
+        required: False
+        default: None
+    compression:
+        description:
+            - The compression options of the table, a dictionary with at least the 'class' of the compressor and
+              for example 'chunk_length_in_kb'. The names used before Cassandra 3.0, 'sstable_compression' and
+              'chunk_length_kb', are accepted as well. The current sub options are kept like with C(compaction).
+            - C({enabled: false}) disables the compression, it takes no other sub options.
+        required: False
+        default: None
+    caching:
+        description:
+            - The caching options of the table, 'keys' and 'rows_per_partition'. The one that is not given keeps its
+              current value.
+        required: False
+        default: None
+    bloom_filter_fp_chance:
+        description:
+            - The false positive chance of the bloom filter, greater than 0 and at most 1.
+        required: False
+        default: None
+    gc_grace_seconds:
+        description:
+            - The number of seconds tombstones are kept before they can be purged.
+        required: False
+        default: None
+    tables:
+        description:
+            - A list of tables that should be tuned in one run instead of a single C(name).
+            - Every entry is a dictionary with the key 'name' and optionally 'keyspace', 'compaction',
+              'compression', 'caching', 'bloom_filter_fp_chance' and 'gc_grace_seconds'. Missing keys are taken
+              from the module options of the same name.
+            - Mutually exclusive with C(name).
+        required: False
+        default: None
+    schema_agreement_timeout:
+        description:
+            - The number of seconds to wait for all nodes to agree on the schema after tables were altered.
+            - The module waits once after all statements instead of after every single statement.
+        required: False
+        default: 10
+- notes:
+    - Supports check mode. The options are read but nothing is changed, the result contains the statements that
+      would be executed as 'plan'.
+    - Requires cassandra-driver for python to be installed on the remote host, unless driver is native.
+    - @See U(https://datastax.github.io/python-driver) for more information on how to install this driver
+    - Requires Cassandra 3.0 or later, the options of all tables are read from system_schema.tables with one query.
+    - The result of every table whose options differ contains 'option_changes' with the value of every changed
+      option before and after, also in check mode, to keep a record of the tuning. For map options 'after' is
+      the whole map that is sent.
+    - A new compaction strategy or compression only applies to SSTables written afterwards, run
+      'nodetool upgradesstables -a' to rewrite the existing ones.
+    - This module should usually be configured with the 'run_once' option in Ansible since it makes no sense to
+      change the same schema from all the hosts
+requirements: ['cassandra-driver']
+author: "Patrick Kranz"
+'''
+
+EXAMPLES = '''
+# Use leveled compaction for the table 'orders.items':
+- cassandra_table_options:
+    keyspace: orders
+    name: items
+    compaction:
+      class: LeveledCompactionStrategy
+      sstable_size_in_mb: 160
+
+# Tune several tables at once, the keyspace and gc_grace_seconds apply to all of them:
+- cassandra_table_options:
+    keyspace: orders
+    gc_grace_seconds: 86400
+    tables:
+      - name: items
+        compression:
+          class: LZ4Compressor
+          chunk_length_in_kb: 16
+      - name: events
+        compaction:
+          class: TimeWindowCompactionStrategy
+          compaction_window_unit: DAYS
+          compaction_window_size: 1
+        bloom_filter_fp_chance: 0.01
+      - name: customers
+        keyspace: customers
+        caching:
+          keys: ALL
+          rows_per_partition: 100
+  register: tuning
+
+# Keep a record of what changed:
+- debug: msg="{{ item.keyspace }}.{{ item.table }} {{ item.option_changes }}"
+  with_items: "{{ tuning.results }}"
+  when: item.changed
+
+'''
+from ansible.module_utils.cassandra_common import (cassandra_argument_spec, cassandra_errors, check_driver,
+                                                   connect_for_schema_changes, identifier, short_class_name,
+                                                   wait_for_schema_agreement)
+
+OPTIONS = ['compaction', 'compression', 'caching', 'bloom_filter_fp_chance', 'gc_grace_seconds']
+MAP_OPTIONS = ['compaction', 'compression', 'caching']
+# the names of the compression options before Cassandra 3.0, which still accepts them
+COMPRESSION_ALIASES = {'sstable_compression': 'class', 'chunk_length_kb': 'chunk_length_in_kb'}
+
+
+def normalize_value(value):
+    """Returns an option value as a string the way Cassandra shows it, numbers and booleans compare by value."""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    text = str(value).strip()
+    if text.lower() in ['true', 'false']:
+        return text.lower()
+    try:
+        number = float(text)
+        if number == int(number):
+            return str(int(number))
+    except (OverflowError, ValueError):
+        return text
+    return repr(number)
+
+
+def normalize_map(option, values):
+    """Returns the sub options of a map option with string values and the names Cassandra uses since 3.0."""
+    normalized = {}
+    for key, value in values.items():
+        key = str(key)
+        if option == 'compression':
+            key = COMPRESSION_ALIASES.get(key, key)
+        value = normalize_value(value)
+        if option == 'caching':
+            value = value.upper()
+        normalized[key] = value
+    return normalized
+
+
+def option_differs(option, current, desired):
+    """Compares one option of a table. Of map options only the desired sub options are compared."""
+    if option not in MAP_OPTIONS:
+        return current is None or normalize_value(current) != normalize_value(desired)
+    current = normalize_map(option, current or {})
+    if option == 'compression' and 'enabled' not in current:
+        # Cassandra only shows 'enabled' once the compression was disabled
+        current['enabled'] = 'true' if 'class' in current else 'false'
+    for key, value in desired.items():
+        if key == 'class':
+            if short_class_name(current.get(key, '')) != short_class_name(value):
+                return True
+        elif current.get(key) != value:
+            return True
+    return False
+
+
+def resulting_map(option, current, desired):
+    """
+    Returns the whole map a map option gets. CQL replaces the map, so the current sub options are kept unless the
+    class changes, the sub options of another class would not apply to the new one.
+    """
+    current = normalize_map(option, current or {})
+    if option == 'compression' and desired.get('enabled') == 'false':
+        return dict(desired)
+    if 'class' in desired and short_class_name(current.get('class', '')) != short_class_name(desired['class']):
+        return dict(desired)
+    resulting = dict(current)
+    resulting.update(desired)
+    return resulting
+
+
+def option_literal(value):
+    if isinstance(value, dict):
+        entries = ["'" + key.replace("'", "''") + "': '" + value[key].replace("'", "''") + "'"
+                   for key in sorted(value)]
+        return "{" + ", ".join(entries) + "}"
+    return normalize_value(value)
+
+
+def alter_table_statement(keyspace, table, options):
+    settings = [option + " = " + option_literal(options[option]) for option in OPTIONS if option in options]
+    return "ALTER TABLE " + keyspace + "." + table + " WITH " + " AND ".join(settings)
+
+
+def desired_options(module, table, entry):
+    """Returns the given options of a table, normalized for the comparison. Fails on invalid values."""
+    options = {}
+    for option in OPTIONS:
+        value = entry.get(option, module.params[option])
+        if value is None:
+            continue
+        if option in MAP_OPTIONS:
+            if not isinstance(value, dict) or not value:
+                module.fail_json(msg="Option {0} of table {1} needs to be a dictionary.".format(option, table))
+            value = normalize_map(option, value)
+            # compression can be switched on and off without naming the compressor
+            switched = option == 'compression' and 'enabled' in value
+            if option in ['compaction', 'compression'] and 'class' not in value and not switched:
+                module.fail_json(msg="Option {0} of table {1} needs a class.".format(option, table))
+            if switched and value['enabled'] not in ['true', 'false']:
+                module.fail_json(msg="Invalid enabled {0} of the compression of table {1}.".format(value['enabled'],
+                                                                                                   table))
+            if switched and value['enabled'] == 'false' and len(value) > 1:
+                module.fail_json(msg="Option compression of table {0} takes no other sub options when it is "
+                                     "disabled.".format(table))
+        elif option == 'bloom_filter_fp_chance':
+            try:
+                value = float(value)
+                if not 0 < value <= 1:
+                    raise ValueError()
+            except (TypeError, ValueError):
+                module.fail_json(msg="Invalid bloom_filter_fp_chance {0} of table {1}.".format(value, table))
+        else:
+            try:
+                value = int(value)
+                if value < 0:
+                    raise ValueError()
+            except (TypeError, ValueError):
+                module.fail_json(msg="Invalid gc_grace_seconds {0} of table {1}.".format(value, table))
+        options[option] = value
+    if not options:
+        module.fail_json(msg="No options given for table {0}.".format(table))
+    return options
+
+
+def desired_tables(module):
+    """Returns the entries of the 'tables' option, or the single table, with the module wide defaults filled in."""
+    entries = module.params['tables']
+    if entries is None:
+        entries = [dict(name=module.params['name'])]
+    desired = []
+    seen = set()
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get('name'):
+            module.fail_json(msg="Every entry of tables needs to be a dictionary with at least the key 'name'.")
+        if entry.get('keyspace', module.params['keyspace']) is None:
+            module.fail_json(msg="Table {0} needs a keyspace.".format(entry['name']))
+        keyspace = identifier(module, entry.get('keyspace', module.params['keyspace']), 'keyspace')
+        table = identifier(module, entry['name'], 'table')
+        if (keyspace, table) in seen:
+            module.fail_json(msg="Table {0}.{1} is listed more than once.".format(keyspace, table))
+        seen.add((keyspace, table))
+        desired.append(dict(keyspace=keyspace, name=table,
+                            options=desired_options(module, keyspace + "." + table, entry)))
+    return desired
+
+
+def read_table_options(session, keyspaces):
+    """Returns the options of every table of the keyspaces, read with one query."""
+    rows = session.execute("SELECT keyspace_name, table_name, " + ", ".join(OPTIONS) + " FROM system_schema.tables "
+                           "WHERE keyspace_name IN %s", [tuple(keyspaces)])
+    tables = {}
+    for row in rows:
+        options = dict((option, getattr(row, option)) for option in OPTIONS)
+        for option in MAP_OPTIONS:
+            if options[option] is not None:
+                options[option] = dict(options[option])
+        tables[(row.keyspace_name, row.table_name)] = options
+    return tables
+
+
+def option_changes(current, desired):
+    """Returns a dict mapping the options that differ to their value before and the value that is sent."""
+    changes = {}
+    for option, value in desired.items():
+        if option_differs(option, current[option], value):
+            if option in MAP_OPTIONS:
+                value = resulting_map(option, current[option], value)
+            changes[option] = dict(before=current[option], after=value)
+    return changes
+
+
+def reconcile_tables(session, desired_list, check_mode=False):
+    """
+    Reads the options of all desired tables with one query and alters the tables whose options differ.
+    Returns a result for every table. In check mode the results only contain the statements as 'plan'.
+    """
+    tables = read_table_options(session, sorted(set(desired['keyspace'] for desired in desired_list)))
+    results = []
+    for desired in desired_list:
+        keyspace, table = desired['keyspace'], desired['name']
+        result = dict(keyspace=keyspace, table=table, changed=False)
+        results.append(result)
+        if (keyspace, table) not in tables:
+            result['failed'] = True
+            result['error'] = "Table {0}.{1} does not exist.".format(keyspace, table)
+            continue
+        changes = option_changes(tables[(keyspace, table)], desired['options'])
+        if not changes:
+            continue
+        result['option_changes'] = changes
+        statement = alter_table_statement(keyspace, table, dict((option, change['after'])
+                                                                for option, change in changes.items()))
+        if check_mode:
+            result['plan'] = [statement]
+        else:
+            try:
+                session.execute(statement)
+            except Exception as error:
+                result['failed'] = True
+                result['error'] = str(error)
+                continue
+        result['changed'] = True
+        result['msg'] = "Options updated: " + ", ".join(option for option in OPTIONS if option in changes)
+    return results
+
+
+def reconcile(module, desired_list):
+    """Connects to the cluster of the module and brings the options of the desired tables into their state."""
+    cluster = None
+    try:
+        cluster, session = connect_for_schema_changes(module)
+
+        try:
+            results = reconcile_tables(session, desired_list, module.check_mode)
+        except cassandra_errors('InvalidRequest'):
+            return dict(failed=True, msg='cassandra_table_options requires Cassandra 3.0 or later.')
+        changed = any(result['changed'] for result in results)
+        agreement = None
+        if changed and not module.check_mode:
+            agreement = wait_for_schema_agreement(session, module.params['schema_agreement_timeout'])
+
+        if module.params['tables'] is not None:
+            if any(result.get('failed') for result in results):
+                return dict(failed=True, msg='Some tables could not be tuned', changed=changed,
+                            results=results, schema_agreement=agreement)
+            return dict(changed=changed, results=results, schema_agreement=agreement)
+
+        result = results[0]
+        if result.get('failed'):
+            return dict(failed=True, msg=result['error'])
+        if agreement is not None:
+            result['schema_agreement'] = agreement
+        return result
+    finally:
+        if cluster is not None:
+            cluster.shutdown()
+
+
+def main():
+    argument_spec = cassandra_argument_spec()
+    argument_spec.update(
+        keyspace=dict(default=None, required=False),
+        name=dict(required=False),
+        compaction=dict(default=None, required=False, type='dict'),
+        compression=dict(default=None, required=False, type='dict'),
+        caching=dict(default=None, required=False, type='dict'),
+        bloom_filter_fp_chance=dict(default=None, required=False, type='float'),
+        gc_grace_seconds=dict(default=None, required=False, type='int'),
+        tables=dict(default=None, required=False, type='list'),
+        schema_agreement_timeout=dict(default=10, type='float')
+    )
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        required_one_of=[['name', 'tables']],
+        mutually_exclusive=[['name', 'tables']],
+        supports_check_mode=True
+    )
+
+    check_driver(module)
+
+    desired_list = desired_tables(module)
+
+    try:
+        result = reconcile(module, desired_list)
+    except Exception as error:
+        module.fail_json(msg=str(error))
+    if result.pop('failed', False):
+        module.fail_json(**result)
+    module.exit_json(**result)
+
+
+from ansible.module_utils.basic import *
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,11 @@
 #!/usr/bin/python
 
 from ansible.module_utils.basic import *
+from ansible.module_utils.cassandra_common import (can_login, cassandra_argument_spec, check_driver,
+                                                   clusters_argument_spec, connect, create_statement,
+                                                   execute_concurrent_statements, read_users, reconcile_clusters,
+                                                   render_statement)
+from ansible.module_utils.cassandra_fingerprint import check_fingerprints, fingerprint_table, update_fingerprints
 
 DOCUMENTATION = '''
 ---
@@ -30,6 +35,21 @@ description:
             - The host that should be used to connect to the Cassandra cluster. Should be one member of the cluster.
         required: False
         default: localhost
+    db_hosts:
+        description:
+            - Several members of the cluster to connect to instead of db_host. The module connects to all of them at
+              the same time and uses the first one that accepted the credentials, so a node that is down, restarting
+              or paused does not hold up the task.
+            - The result contains the 'connection' with the 'host' that was used and the 'seconds' connecting took.
+              With C(broker) the hosts race when the broker starts and the result has no 'connection'.
+        required: False
+        default: None
+    connect_timeout:
+        description:
+            - The number of seconds to wait for a host to accept the connection.
+            - Defaults to 2 seconds with C(db_hosts) and to the timeout of the client otherwise.
+        required: False
+        default: None
     db_port:
         description:
             - The port that will be used to connect to the cluster.
@@ -45,10 +65,85 @@ description:
             - Beginning with version 2.2 you can also use 4.
         required: False
         default: 3
+    broker:
+        description:
+            - Keep the authenticated session open in a local broker process and reuse it in later tasks,
+              similar to ssh's ControlPersist.
+            - The first task starts the broker. It serves one combination of connection options on a unix socket
+              and exits after it was not used for C(broker_ttl) seconds.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    broker_ttl:
+        description:
+            - The number of idle seconds after which the broker closes the session and exits.
+        required: False
+        default: 60
+    broker_socket_dir:
+        description:
+            - The directory for the sockets of the brokers. It is created with permissions only for the current user.
+        required: False
+        default: ~/.ansible/cp
+    driver:
+        description:
+            - The client used to talk to Cassandra. 'datastax' is the DataStax cassandra-driver, 'native' the small
+              client for the native protocol versions 3 and 4 in module_utils that needs nothing but Python and
+              starts much faster. 'auto' uses cassandra-driver if it is installed and the native client otherwise.
+            - The native client only connects to db_host, ignores local_dc and does not support
+              speculative_execution_delay or traces.
+        required: False
+        default: auto
+        choices: ['auto', 'datastax', 'native']
+    profile:
+        description:
+            - Add a 'timings' section to the result with the seconds it took to connect, to authenticate, to run
+              every statement and to wait for schema agreement, together with the number of statements by type.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    trace:
+        description:
+            - Together with C(profile), request a server side trace of every statement and add it to the timings.
+            - Tracing adds load to the cluster and should only be used to analyse slow runs.
+        required: False
+        default: no
+        choices: ['yes', 'no']
+    consistency:
+        description:
+            - The consistency level of all statements. In clusters with several data centers LOCAL_QUORUM or
+              LOCAL_ONE avoid waiting for replicas in remote data centers.
+        required: False
+        default: QUORUM
+        choices: ['ONE', 'TWO', 'THREE', 'QUORUM', 'ALL', 'LOCAL_QUORUM', 'EACH_QUORUM', 'LOCAL_ONE']
+    local_dc:
+        description:
+            - The data center whose nodes receive the requests. Without it all requests go to db_host.
+            - The driver then connects to every node of that data center instead of only to db_host.
+        required: False
+        default: None
+    request_timeout:
+        description:
+            - The number of seconds after which a statement fails if no response arrived. Defaults to the driver's
+              timeout.
+        required: False
+        default: None
+    speculative_execution_delay:
+        description:
+            - Send reads that got no response after this many seconds to another node of the data center as well and
+              use the first response. This keeps a slow node from slowing down the module.
+            - Only reads are executed speculatively, changes are sent once.
+        required: False
+        default: None
+    speculative_executions:
+        description:
+            - The maximum number of additional nodes a read is sent to when C(speculative_execution_delay) is set.
+        required: False
+        default: 2
     user:
         description:
             - The username of the user that should be created
-        required: True
+            - Either this or C(users) is required.
+        required: False
     password:
         description:
             - The password that should be set for the user to create
@@ -69,14 +164,67 @@ description:
     update_password:
         description:
             - If the password of the user should be updated during every run or just when the user is created.
+            - With 'always' the password is only written if it differs from the current one. The module compares it
+              against the stored hash if the python bcrypt module is installed and db_user may read system_auth,
+              otherwise it tries to log in with the new password.
         required: False
         default: always
         choices: ['always', 'on_create']
+    users:
+        description:
+            - A list of users that should be reconciled in one run instead of a single C(user).
+            - Every entry is a dictionary with the key 'user' and optionally 'password', 'superuser', 'state' and
+              'update_password'. Missing keys are taken from the module options of the same name.
+            - The passwords of the entries are masked in the logs and in the result like C(password).
+            - The existing users are read only once and all changes are sent over the same session.
+            - Mutually exclusive with C(user).
+        required: False
+        default: None
+    concurrency:
+        description:
+            - The maximum number of statements that are in flight at the same time when C(users) is given.
+        required: False
+        default: 10
+    clusters:
+        description:
+            - A list of clusters the users are reconciled in, instead of the single cluster of C(db_host).
+            - Every entry is a dictionary with an optional 'name' and the connection options of the cluster:
+              'db_host', 'db_hosts', 'db_port', 'db_user', 'db_password', 'protocol_version', 'consistency',
+              'local_dc', 'request_timeout', 'connect_timeout', 'speculative_execution_delay' and
+              'speculative_executions'. Missing options are taken from the module options of the same name.
+            - The clusters are reconciled in parallel. The result contains a result for every cluster in
+              'clusters', a cluster that cannot be reached does not keep the others from being reconciled.
+            - The 'db_password' of the entries is masked in the logs and in the result like C(db_password).
+        required: False
+        default: None
+    cluster_concurrency:
+        description:
+            - The maximum number of clusters that are reconciled at the same time when C(clusters) is given.
+        required: False
+        default: 10
+    fingerprint_table:
+        description:
+            - A bookkeeping table, given as keyspace.table, that keeps a salted hash of the desired state every user
+              was last reconciled with together with the schema version of the cluster. The keyspace needs to exist,
+              the table is created on the first run.
+            - When the fingerprints of all users of the task and the schema version are unchanged the module
+              returns right after reading them, without looking up the users or verifying passwords. Otherwise the
+              users are reconciled as usual and the fingerprints are written anew.
+            - The result contains 'fingerprints' telling if they 'matched' and which were 'missing' or 'stale'.
+        required: False
+        default: None
 - notes:
-    - Requires cassandra-driver for python to be installed on the remote host.
+    - Supports check mode. The users are read but nothing is changed, the result contains the statements that
+      would be executed as 'plan' with all passwords masked.
+    - Requires cassandra-driver for python to be installed on the remote host, unless driver is native.
     - @See U(https://datastax.github.io/python-driver) for more information on how to install this driver
     - This module should usually be configured with the 'run_once' option in Ansible since it makes no sense to create
       the same user from all the hosts
+    - Users are looked up directly in system_auth.roles (Cassandra 2.2+) or system_auth.users (older versions). If
+      db_user is not allowed to read those tables the module falls back to the slower LIST USERS. Roles that cannot
+      login are not users and are left alone.
+    - Changes to the users that are made outside of the module are not noticed while the fingerprints of
+      C(fingerprint_table) match, change the desired state or delete the rows to reconcile them again.
 requirements: ['cassandra-driver']
 author: "Patrick Kranz"
 '''
@@ -91,18 +239,53 @@ EXAMPLES = '''
 # Remove an existing user 'testuser' from the database
 - cassandra_user: db_user=cassandra db_password=cassandra user=testuser state=absent
 
+# Create or update several users at once and remove an old one:
+- cassandra_user:
+    db_user: cassandra
+    db_password: cassandra
+    users:
+      - user: app_reader
+        password: readerpassword
+      - user: app_admin
+        password: adminpassword
+        superuser: yes
+      - user: legacy_app
+        state: absent
+  no_log: true
+
+# Create the same user in several clusters at once:
+- cassandra_user:
+    user: app_reader
+    password: readerpassword
+    clusters:
+      - name: eu
+        db_host: cassandra-eu.example.com
+      - name: us
+        db_host: cassandra-us.example.com
+        db_password: uspassword
+  no_log: true
+
+# Skip the password checks of later runs as long as nothing changed:
+- cassandra_user:
+    users: "{{ app_users }}"
+    fingerprint_table: ops.ansible_fingerprints
+  no_log: true
+
+# Connect to whichever of three nodes answers first, for example during a rolling restart:
+- cassandra_user:
+    db_hosts: ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+    user: app_reader
+    password: readerpassword
+
 '''
 
 
 try:
-    from cassandra import ConsistencyLevel
-    from cassandra.auth import PlainTextAuthProvider
-    from cassandra.cluster import Cluster
-    from cassandra.query import SimpleStatement
+    import bcrypt
 except ImportError:
-    cassandra_driver_found = False
+    bcrypt_found = False
 else:
-    cassandra_driver_found = True
+    bcrypt_found = True
 
 def superuser_string(is_superuser):
     if is_superuser:
@@ -111,87 +294,279 @@ def superuser_string(is_superuser):
         return "NOSUPERUSER"
 
 
-def create_statement(statement):
-    return SimpleStatement(statement, consistency_level=ConsistencyLevel.QUORUM)
+def ensure_password(password, module, username=None):
+    if password is None:
+        module.fail_json(msg="Password is required for this operation.", username=username)
 
 
-def ensure_password(password, module):
-    if password is None:
-        module.fail_json(msg="Password is required for this operation.")
+def password_matches(module, user, username, password):
+    """
+    Checks if the given password already is the password of an existing user.
+    The stored bcrypt hash is verified locally if it could be read and the bcrypt module is installed,
+    otherwise a login with the given credentials is attempted.
+    """
+    salted_hash = user.get('salted_hash')
+    if salted_hash is not None and bcrypt_found:
+        try:
+            return bcrypt.checkpw(password.encode('utf-8'), salted_hash.encode('utf-8'))
+        except ValueError:
+            # not a hash the bcrypt module understands
+            pass
+    return can_login(module, username, password)
 
 
-def main():
-    module = AnsibleModule(
-        argument_spec=dict(
-            db_user=dict(default='cassandra'),
-            db_password=dict(default='cassandra'),
-            db_host=dict(default='localhost'),
-            db_port=dict(default=9042),
-            protocol_version=dict(default=3, choices=[1, 2, 3, 4]),
-            user=dict(required=True),
-            password=dict(default=None, required=False),
-            superuser=dict(default='no', choices=BOOLEANS),
-            state=dict(default='present', choices=['present', 'absent']),
-            update_password=dict(default='always', choices=['always', 'on_create'])
-        )
-    )
+def plan_user(module, users, username, password, superuser, state, update_password, password_check):
+    """
+    Compares one desired user against the users found in the database.
+    password_check is called with the username and password to find out if the password is already set.
+    Returns a list of (statement, parameters, message) tuples that need to be executed.
+    """
+    actions = []
+    if username in users:
+        if state == 'present':
+            if update_password == 'always':
+                ensure_password(password, module, username)
+                if not password_check(username, password):
+                    actions.append(('ALTER USER %s WITH PASSWORD %s', (username, password), 'Password updated'))
+            if users[username]['superuser'] != superuser:
+                actions.append(('ALTER USER %s {0}'.format(superuser_string(superuser)), [username],
+                                'Superuser status changed'))
+        else:
+            actions.append(('DROP USER IF EXISTS %s', [username], 'User deleted'))
+    elif state == 'present':
+        ensure_password(password, module, username)
+        actions.append(('CREATE USER %s WITH PASSWORD %s {0}'.format(superuser_string(superuser)),
+                        (username, password), 'User created'))
+    return actions
+
+
+def entry_value(module, entry, key):
+    """Returns an option of an entry of 'users', or the module option of the same name if the entry has none."""
+    value = entry.get(key)
+    if value is None:
+        return module.params[key]
+    return value
+
+
+def desired_users(module):
+    """Returns the entries of the 'users' option with the module wide defaults filled in."""
+    desired = []
+    seen = set()
+    for entry in module.params['users']:
+        if not isinstance(entry, dict) or not entry.get('user'):
+            module.fail_json(msg="Every entry of users needs to be a dictionary with at least the key 'user'.")
+        username = entry['user']
+        if username in seen:
+            module.fail_json(msg="User {0} is listed more than once.".format(username))
+        seen.add(username)
+
+        state = entry_value(module, entry, 'state')
+        update_password = entry_value(module, entry, 'update_password')
+        if state not in ['present', 'absent']:
+            module.fail_json(msg="Invalid state {0} for user {1}.".format(state, username))
+        if update_password not in ['always', 'on_create']:
+            module.fail_json(msg="Invalid update_password {0} for user {1}.".format(update_password, username))
+
+        desired.append(dict(user=username,
+                            password=entry_value(module, entry, 'password'),
+                            superuser=module.boolean(entry_value(module, entry, 'superuser')),
+                            state=state,
+                            update_password=update_password))
+    return desired
+
+
+def desired_states(module):
+    """Returns the names of the users of the task and their desired state by name, the input of the fingerprints."""
+    if module.params['users'] is not None:
+        desired_list = desired_users(module)
+    else:
+        desired_list = [dict(user=module.params['user'], password=module.params['password'],
+                             superuser=module.boolean(module.params['superuser']), state=module.params['state'],
+                             update_password=module.params['update_password'])]
+    return [desired['user'] for desired in desired_list], dict((desired['user'], desired) for desired in desired_list)
+
+
+def reconcile_users(module, session):
+    """
+    Brings all users of the 'users' option into their desired state.
+    Reads the existing users once and sends all changes with bounded concurrency over the given session.
+    In check mode only the plan of every user is returned.
+    """
+    desired_list = desired_users(module)
+    password_updates = [desired for desired in desired_list
+                        if desired['state'] == 'present' and desired['update_password'] == 'always']
+    users = read_users(session, with_hashes=len(password_updates) > 0, login_only=True)
+
+    # verifying passwords is expensive, so the checks run in parallel as well
+    checks = [desired for desired in password_updates
+              if desired['user'] in users and desired['password'] is not None]
+    matching = {}
+    if len(checks) > 0:
+        # imported here, it takes a noticeable part of the start of every module
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(module.params['concurrency'], len(checks)))
+        try:
+            verified = pool.map(lambda desired: password_matches(module, users[desired['user']],
+                                                                 desired['user'], desired['password']), checks)
+        finally:
+            pool.close()
+        for desired, matches in zip(checks, verified):
+            matching[desired['user']] = matches
+
+    planned = []
+    for desired in desired_list:
+        actions = plan_user(module, users, desired['user'], desired['password'], desired['superuser'],
+                            desired['state'], desired['update_password'],
+                            lambda name, password: matching.get(name, False))
+        planned.append((desired['user'], actions))
+
+    if module.check_mode:
+        return [plan_result(dict(user=username), actions, desired['password'])
+                for (username, actions), desired in zip(planned, desired_list)]
+
+    statements = []
+    for username, actions in planned:
+        for statement, parameters, msg in actions:
+            statements.append((create_statement(statement), parameters))
+
+    outcomes = iter(execute_concurrent_statements(session, statements, module.params['concurrency']))
+
+    results = []
+    for username, actions in planned:
+        result = dict(user=username, changed=False)
+        msg_list = []
+        errors = []
+        for statement, parameters, msg in actions:
+            success, outcome = next(outcomes)
+            if success:
+                result['changed'] = True
+                msg_list.append(msg)
+            else:
+                errors.append(str(outcome))
+        if len(msg_list) > 0:
+            result['msg'] = ', '.join(msg_list)
+        if len(errors) > 0:
+            result['failed'] = True
+            result['error'] = ', '.join(errors)
+        results.append(result)
+    return results
+
+
+def plan_result(result, actions, password):
+    """Fills a result with what would be changed without executing anything."""
+    result['changed'] = len(actions) > 0
+    if len(actions) > 0:
+        result['msg'] = ', '.join(msg for statement, parameters, msg in actions)
+    result['plan'] = [render_statement(statement, parameters, [password]) for statement, parameters, msg in actions]
+    return result
+
+
+def reconcile(module):
+    """
+    Connects to the cluster of the module and brings the user or users into their desired state.
+    With a fingerprint_table the users are only reconciled if their fingerprints do not match.
+    """
+    cluster = None
+    try:
+        cluster, session = connect(module)
 
-    if not cassandra_driver_found:
-        module.fail_json(msg='no cassandra driver for python found. please install cassandra-driver.')
+        table = fingerprint_table(module)
+        if table is None:
+            return reconcile_session(module, session)
 
-    db_user = module.params['db_user']
-    db_password = module.params['db_password']
-    db_host = module.params['db_host']
-    db_port = module.params['db_port']
+        names, states = desired_states(module)
+        check = check_fingerprints(session, table, 'user', states)
+        if check['matched']:
+            if module.params['users'] is not None:
+                return dict(changed=False, results=[dict(user=name, changed=False) for name in names],
+                            fingerprints=dict(matched=True))
+            return dict(changed=False, username=names[0], fingerprints=dict(matched=True))
+
+        result = reconcile_session(module, session)
+        # a failing single user raises, of several users only the ones that failed are left out
+        failed = set(user_result['user'] for user_result in result.get('results', []) if user_result.get('failed'))
+        reconciled = dict((name, state) for name, state in states.items() if name not in failed)
+        result['fingerprints'] = update_fingerprints(module, session, table, 'user', reconciled, check)
+        return result
+    finally:
+        if cluster is not None:
+            cluster.shutdown()
+
+
+def reconcile_session(module, session):
+    """Brings the user or users into their desired state over the given session."""
     username = module.params['user']
     password = module.params['password']
     state = module.params['state']
     update_password = module.params['update_password']
     superuser = module.boolean(module.params['superuser'])
 
-    auth_provider = PlainTextAuthProvider(username=db_user, password=db_password)
-    cluster = Cluster(contact_points=[db_host], port=db_port,
-                      auth_provider=auth_provider, protocol_version=module.params['protocol_version'])
+    if module.params['users'] is not None:
+        results = reconcile_users(module, session)
+        changed = any(result['changed'] for result in results)
+        if any(result.get('failed') for result in results):
+            return dict(failed=True, msg='Some users could not be reconciled', changed=changed, results=results)
+        return dict(changed=changed, results=results)
+
+    msg_list = []
+    users = read_users(session, username, with_hashes=state == 'present' and update_password == 'always',
+                       login_only=True)
+    actions = plan_user(module, users, username, password, superuser, state, update_password,
+                        lambda name, password: password_matches(module, users[name], name, password))
+    if module.check_mode:
+        return dict(username=username, **plan_result(dict(), actions, password))
+
+    for statement, parameters, msg in actions:
+        session.execute(create_statement(statement), parameters)
+        msg_list.append(msg)
+
+    if len(msg_list) > 0:
+        return dict(changed=True, username=username, msg=', '.join(msg_list))
+    return dict(changed=False, username=username)
+
+
+def main():
+    argument_spec = cassandra_argument_spec()
+    argument_spec.update(
+        db_user=dict(default='cassandra'),
+        db_password=dict(default='cassandra', no_log=True),
+        user=dict(required=False),
+        password=dict(default=None, required=False, no_log=True),
+        superuser=dict(default='no', choices=BOOLEANS),
+        state=dict(default='present', choices=['present', 'absent']),
+        update_password=dict(default='always', choices=['always', 'on_create']),
+        users=dict(default=None, required=False, type='list', elements='dict',
+                   options=dict(user=dict(required=True), password=dict(required=False, no_log=True),
+                                superuser=dict(required=False, type='raw'),
+                                state=dict(required=False, choices=['present', 'absent']),
+                                update_password=dict(required=False, choices=['always', 'on_create']))),
+        concurrency=dict(default=10, type='int'),
+        fingerprint_table=dict(default=None, required=False)
+    )
+    argument_spec.update(clusters_argument_spec())
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        required_one_of=[['user', 'users']],
+        mutually_exclusive=[['user', 'users']],
+        supports_check_mode=True
+    )
+
+    check_driver(module)
 
     try:
-        msg_list = []
-        session = cluster.connect()
-        users = session.execute('LIST USERS')
-
-        user_found = False
-        for user in users:
-            if user.name == username:
-                user_found = True
-                if state == 'present':
-                    if update_password == 'always':
-                        ensure_password(password, module)
-                        statement = create_statement('ALTER USER %s WITH PASSWORD %s')
-                        session.execute(statement, (username, password))
-                        msg_list.append('Password updated')
-                    if user.super != superuser:
-                        statement = create_statement('ALTER USER %s {0}'.format(superuser_string(superuser)))
-                        session.execute(statement, [username])
-                        msg_list.append('Superuser status changed')
-                else:
-                    statement = create_statement('DROP USER IF EXISTS %s')
-                    session.execute(statement, [username])
-                    msg_list.append('User deleted')
-                break
-
-        if not user_found and state == 'present':
-            ensure_password(password, module)
-            statement = create_statement('CREATE USER %s WITH PASSWORD %s {0}'.format(superuser_string(superuser)))
-            session.execute(statement, (username, password))
-            msg_list.append('User created')
+        if module.params['clusters'] is not None:
+            results = reconcile_clusters(module, reconcile)
+            changed = any(result.get('changed', False) for result in results)
+            if any(result.get('failed') for result in results):
+                module.fail_json(msg='Some clusters could not be reconciled', changed=changed, clusters=results)
+            module.exit_json(changed=changed, clusters=results)
 
-        if len(msg_list) > 0:
-            module.exit_json(changed=True, username=username, msg=', '.join(msg_list))
-        else:
-            module.exit_json(changed=False, username=username)
+        result = reconcile(module)
     except Exception as error:
         module.fail_json(msg=str(error))
-    finally:
-        cluster.shutdown()
+    if result.pop('failed', False):
+        module.fail_json(**result)
+    module.exit_json(**result)
 
 
 if __name__ == '__main__':
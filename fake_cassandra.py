@@ -0,0 +1,929 @@
+# An in-memory stand-in for a Cassandra cluster to run the modules without a database.
+#
+# FakeCassandra keeps users, permissions, keyspaces, tables and types and understands the statements the modules send. It replaces the
+# driver's Cluster class, so the modules build their connection as usual and only the network part is missing.
+# Every connect and every statement is counted, which lets the tests and bench_modules.py check how many round
+# trips a module run costs.
+#
+# FakeNativeServer serves the same fake cluster over the CQL native protocol to test the native client.
+
+import contextlib
+import importlib
+import json
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from cassandra import AuthenticationFailed, InvalidRequest
+from cassandra.cluster import NoHostAvailable
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+import ansible.module_utils
+if os.path.join(REPO_DIR, 'module_utils') not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(os.path.join(REPO_DIR, 'module_utils'))
+
+from ansible.module_utils import basic
+from ansible.module_utils import cassandra_common
+
+try:
+    from ansible.module_utils.testing import patch_module_args
+except ImportError:
+    @contextlib.contextmanager
+    def patch_module_args(args):
+        basic._ANSIBLE_ARGS = json.dumps({'ANSIBLE_MODULE_ARGS': args}).encode('utf-8')
+        yield
+
+STRATEGY_PACKAGE = 'org.apache.cassandra.locator.'
+OPTION_PACKAGES = dict(compaction='org.apache.cassandra.db.compaction.',
+                       compression='org.apache.cassandra.io.compress.')
+
+SELECT = re.compile(r"^SELECT (?P<columns>.+?) FROM (?P<table>[\w.]+)(?: WHERE (?P<where>.+?))?(?: LIMIT \d+)?$")
+
+
+def split_definitions(text):
+    """Splits a list of CQL definitions at the commas that are not nested in parentheses or angle brackets."""
+    parts = []
+    depth = 0
+    current = ''
+    for character in text:
+        if character in '(<':
+            depth += 1
+        elif character in ')>':
+            depth -= 1
+        if character == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+        else:
+            current += character
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def schema_type(cql_type):
+    """Returns a type the way Cassandra shows it in system_schema."""
+    cql_type = re.sub(r'\s*,\s*', ', ', cql_type.strip().lower())
+    return re.sub(r'\bvarchar\b', 'text', cql_type)
+
+
+def default_table_options():
+    """Returns the options Cassandra 3.11 gives a table that was created without any."""
+    return dict(compaction={'class': OPTION_PACKAGES['compaction'] + 'SizeTieredCompactionStrategy',
+                            'max_threshold': '32', 'min_threshold': '4'},
+                compression={'chunk_length_in_kb': '64', 'class': OPTION_PACKAGES['compression'] + 'LZ4Compressor'},
+                caching={'keys': 'ALL', 'rows_per_partition': 'NONE'}, bloom_filter_fp_chance=0.01,
+                gc_grace_seconds=864000)
+
+
+def parse_table_options(text):
+    """Parses the options of ALTER TABLE WITH the way Cassandra stores them, with full class names."""
+    options = {}
+    for setting in text.split(' AND '):
+        option, value = [part.strip() for part in setting.split('=', 1)]
+        if value.startswith('{'):
+            value = dict(re.findall(r"'([^']*)'\s*:\s*'([^']*)'", value))
+            if 'class' in value and '.' not in value['class'] and option in OPTION_PACKAGES:
+                value['class'] = OPTION_PACKAGES[option] + value['class']
+            if option == 'compaction':
+                value = dict(default_table_options()['compaction'], **value)
+        elif option == 'bloom_filter_fp_chance':
+            value = float(value)
+        else:
+            value = int(value)
+        options[option] = value
+    return options
+
+
+def version_tuple(release_version):
+    return tuple(int(part) for part in release_version.split('.')[:2])
+
+
+def parse_replication(literal):
+    """Parses a replication map literal like { 'class': 'SimpleStrategy', 'replication_factor': 2 }."""
+    replication = dict(re.findall(r"'([^']*)'\s*:\s*'?([^',}\s]*)'?", literal))
+    if '.' not in replication['class']:
+        replication['class'] = STRATEGY_PACKAGE + replication['class']
+    return replication
+
+
+class FakeCassandra(object):
+    """
+    The state of a fake cluster. release_version decides which system tables exist, like it does in Cassandra:
+    system_auth.roles since 2.2 and system_schema.keyspaces since 3.0.
+    """
+
+    def __init__(self, release_version='3.11.4', peers=2):
+        self.release_version = release_version
+        self.peers = peers
+        self.reachable = True
+        # hosts that refuse connections and seconds other hosts take to accept one
+        self.down_hosts = set()
+        self.host_delays = {}
+        self.users = {'cassandra': dict(password='cassandra', superuser=True)}
+        self.keyspaces = {}
+        self.permissions = {}
+        self.tables = {}
+        self.table_options = {}
+        # the rows of the tables that are not system tables by their primary key
+        self.rows = {}
+        self.types = {}
+        self.schema_version = uuid.uuid4()
+        self.lock = threading.Lock()
+        self.reset_counters()
+
+        self.statements = [
+            (SELECT, self.select),
+            (re.compile(r'^LIST USERS$'), self.list_users),
+            (re.compile(r'^CREATE USER %s WITH PASSWORD %s (SUPERUSER|NOSUPERUSER)$'), self.create_user),
+            (re.compile(r'^ALTER USER %s WITH PASSWORD %s$'), self.alter_password),
+            (re.compile(r'^ALTER USER %s (SUPERUSER|NOSUPERUSER)$'), self.alter_superuser),
+            (re.compile(r'^DROP USER IF EXISTS %s$'), self.drop_user),
+            (re.compile(r'^LIST ALL PERMISSIONS OF %s NORECURSIVE$'), self.list_permissions),
+            (re.compile(r'^GRANT (\w+) ON (.+) TO %s$'), self.grant),
+            (re.compile(r'^REVOKE (\w+) ON (.+) FROM %s$'), self.revoke),
+            (re.compile(r'^CREATE KEYSPACE (\w+) WITH REPLICATION = (\{.*\})$'), self.create_keyspace),
+            (re.compile(r'^ALTER KEYSPACE (\w+) WITH REPLICATION = (\{.*\})$'), self.alter_keyspace),
+            (re.compile(r'^DROP KEYSPACE (\w+)$'), self.drop_keyspace),
+            (re.compile(r'^CREATE TABLE (IF NOT EXISTS )?(\w+)\.(\w+) \((.*?)\)'
+                        r'(?: WITH CLUSTERING ORDER BY \((.*)\))?$'),
+             self.create_table),
+            (re.compile(r'^ALTER TABLE (\w+)\.(\w+) ADD (\w+) (.+?)( static)?$'), self.add_column),
+            (re.compile(r'^ALTER TABLE (\w+)\.(\w+) DROP (\w+)$'), self.drop_column),
+            (re.compile(r'^ALTER TABLE (\w+)\.(\w+) WITH (.+)$'), self.alter_table_options),
+            (re.compile(r'^DROP TABLE (\w+)\.(\w+)$'), self.drop_table),
+            (re.compile(r'^INSERT INTO (\w+)\.(\w+) \(([\w, ]+)\) VALUES \(([%s, ]+)\)$'), self.insert),
+            (re.compile(r'^CREATE TYPE (\w+)\.(\w+) \((.*)\)$'), self.create_type),
+            (re.compile(r'^ALTER TYPE (\w+)\.(\w+) ADD (\w+) (.+)$'), self.add_field),
+            (re.compile(r'^DROP TYPE (\w+)\.(\w+)$'), self.drop_type)
+        ]
+
+    def reset_counters(self):
+        self.connections = 0
+        self.queries = []
+
+    def add_users(self, count, prefix='user', password='password', superuser=False):
+        for index in range(count):
+            self.users['{0}{1}'.format(prefix, index)] = dict(password=password, superuser=superuser)
+
+    def add_keyspaces(self, count, prefix='keyspace', replication_factor=2):
+        for index in range(count):
+            self.keyspaces['{0}{1}'.format(prefix, index)] = {'class': STRATEGY_PACKAGE + 'SimpleStrategy',
+                                                              'replication_factor': str(replication_factor)}
+
+    def add_tables(self, count, keyspace, prefix='table'):
+        for index in range(count):
+            name = '{0}{1}'.format(prefix, index)
+            self.tables[(keyspace, name)] = [dict(column_name='id', kind='partition_key', position=0, type='uuid')]
+            self.table_options[(keyspace, name)] = default_table_options()
+
+    def has_version(self, major, minor=0):
+        return version_tuple(self.release_version) >= (major, minor)
+
+    def cluster(self, *args, **options):
+        """Used in place of the driver's Cluster class. The options of the last cluster are kept for the tests."""
+        self.cluster_options = options
+        return FakeCluster(self, options)
+
+    def execute(self, statement, parameters=None):
+        query = getattr(statement, 'query_string', statement)
+        with self.lock:
+            self.queries.append(query)
+            for pattern, handler in self.statements:
+                match = pattern.match(query)
+                if match:
+                    return handler(match, list(parameters or []))
+        raise InvalidRequest('line 1:0 no viable alternative at input ' + query)
+
+    # system tables
+
+    def system_tables(self):
+        tables = {'system.local': self.local_rows, 'system.peers': self.peer_rows}
+        if self.has_version(2, 2):
+            tables['system_auth.roles'] = self.role_rows
+        else:
+            tables['system_auth.users'] = self.legacy_user_rows
+            tables['system_auth.credentials'] = self.credential_rows
+        if self.has_version(3):
+            tables['system_schema.keyspaces'] = self.keyspace_rows
+            tables['system_schema.tables'] = self.table_rows
+            tables['system_schema.columns'] = self.column_rows
+            tables['system_schema.types'] = self.type_rows
+        else:
+            tables['system.schema_keyspaces'] = self.legacy_keyspace_rows
+        return tables
+
+    def local_rows(self):
+        return [dict(key='local', cluster_name='Fake Cluster', release_version=self.release_version,
+                     native_protocol_version='4', schema_version=self.schema_version)]
+
+    def peer_rows(self):
+        return [dict(peer='127.0.0.{0}'.format(index + 2), schema_version=self.schema_version)
+                for index in range(self.peers)]
+
+    def role_rows(self):
+        return [dict(role=name, is_superuser=user['superuser'], can_login=user.get('login', True), salted_hash=None)
+                for name, user in self.users.items()]
+
+    def legacy_user_rows(self):
+        return [dict(name=name, super=user['superuser']) for name, user in self.users.items()]
+
+    def credential_rows(self):
+        return [dict(username=name, salted_hash=None) for name in self.users]
+
+    def keyspace_rows(self):
+        return [dict(keyspace_name=name, durable_writes=True, replication=dict(replication))
+                for name, replication in self.keyspaces.items()]
+
+    def table_rows(self):
+        return [dict(self.table_options[(keyspace, table)], keyspace_name=keyspace, table_name=table)
+                for keyspace, table in self.tables]
+
+    def column_rows(self):
+        return [dict(column, keyspace_name=keyspace, table_name=table,
+                     clustering_order=column.get('clustering_order', 'none'))
+                for (keyspace, table), columns in self.tables.items() for column in columns]
+
+    def type_rows(self):
+        return [dict(keyspace_name=keyspace, type_name=name, field_names=[field for field, cql_type in fields],
+                     field_types=[cql_type for field, cql_type in fields])
+                for (keyspace, name), fields in self.types.items()]
+
+    def legacy_keyspace_rows(self):
+        rows = []
+        for name, replication in self.keyspaces.items():
+            options = dict(replication)
+            rows.append(dict(keyspace_name=name, durable_writes=True, strategy_class=options.pop('class'),
+                             strategy_options=json.dumps(options)))
+        return rows
+
+    def select(self, match, parameters):
+        table = match.group('table')
+        tables = self.system_tables()
+        if table in tables:
+            rows = tables[table]()
+        elif tuple(table.split('.')) in self.tables:
+            rows = list(self.rows.get(tuple(table.split('.')), {}).values())
+        else:
+            raise InvalidRequest('unconfigured table ' + table.split('.')[-1])
+
+        where = match.group('where')
+        if where is not None:
+            for condition in where.split(' AND '):
+                column, operator, value = re.match(r"(\w+) (=|IN) (%s|'[^']*')", condition).groups()
+                if value == '%s':
+                    value = parameters.pop(0)
+                else:
+                    value = value.strip("'")
+                values = set(value) if operator == 'IN' else set([value])
+                rows = [row for row in rows if row[column] in values]
+
+        columns = [column.strip() for column in match.group('columns').split(',')]
+        for column in columns:
+            if rows and column not in rows[0]:
+                raise InvalidRequest('Undefined column name ' + column)
+        Row = namedtuple('Row', columns)
+        return [Row(*[row[column] for column in columns]) for row in rows]
+
+    # users
+
+    def list_users(self, match, parameters):
+        Row = namedtuple('Row', ['name', 'super'])
+        return [Row(name, user['superuser']) for name, user in self.users.items()]
+
+    def create_user(self, match, parameters):
+        username, password = parameters
+        if username in self.users:
+            raise InvalidRequest('User {0} already exists'.format(username))
+        self.users[username] = dict(password=password, superuser=match.group(1) == 'SUPERUSER')
+        return []
+
+    def alter_password(self, match, parameters):
+        username, password = parameters
+        self.users[username]['password'] = password
+        return []
+
+    def alter_superuser(self, match, parameters):
+        self.users[parameters[0]]['superuser'] = match.group(1) == 'SUPERUSER'
+        return []
+
+    def drop_user(self, match, parameters):
+        self.users.pop(parameters[0], None)
+        return []
+
+    # permissions
+
+    def grant_permissions(self, role, resource, permissions):
+        """Grants permissions on a resource given in the form LIST PERMISSIONS shows, like <keyspace app>."""
+        for permission in permissions:
+            self.permissions.setdefault(role, set()).add((resource, permission))
+
+    def role_permissions(self, role):
+        if role not in self.users:
+            raise InvalidRequest('<role {0}> doesn\'t exist'.format(role))
+        return self.permissions.setdefault(role, set())
+
+    def list_permissions(self, match, parameters):
+        Row = namedtuple('Row', ['role', 'username', 'resource', 'permission'])
+        return [Row(parameters[0], parameters[0], resource, permission)
+                for resource, permission in sorted(self.role_permissions(parameters[0]))]
+
+    def listed_resource(self, resource):
+        return '<' + resource.lower().replace('functions in keyspace', 'functions in') + '>'
+
+    def grant(self, match, parameters):
+        self.role_permissions(parameters[0]).add((self.listed_resource(match.group(2)), match.group(1)))
+        return []
+
+    def revoke(self, match, parameters):
+        self.role_permissions(parameters[0]).discard((self.listed_resource(match.group(2)), match.group(1)))
+        return []
+
+    # keyspaces
+
+    def schema_changed(self):
+        self.schema_version = uuid.uuid4()
+
+    # unquoted names are stored in lower case, like Cassandra does
+
+    def create_keyspace(self, match, parameters):
+        name = match.group(1).lower()
+        if name in self.keyspaces:
+            raise InvalidRequest('Keyspace {0} already exists'.format(name))
+        self.keyspaces[name] = parse_replication(match.group(2))
+        self.schema_changed()
+        return []
+
+    def alter_keyspace(self, match, parameters):
+        name = match.group(1).lower()
+        if name not in self.keyspaces:
+            raise InvalidRequest('Keyspace {0} does not exist'.format(name))
+        self.keyspaces[name] = parse_replication(match.group(2))
+        self.schema_changed()
+        return []
+
+    # tables and types
+
+    def table(self, keyspace, name):
+        if (keyspace, name) not in self.tables:
+            raise InvalidRequest('Table {0}.{1} does not exist'.format(keyspace, name))
+        return self.tables[(keyspace, name)]
+
+    def create_table(self, match, parameters):
+        if_not_exists, keyspace, name, definitions, clustering_order = match.groups()
+        if keyspace not in self.keyspaces:
+            raise InvalidRequest('Keyspace {0} does not exist'.format(keyspace))
+        if (keyspace, name) in self.tables and if_not_exists:
+            return []
+        if (keyspace, name) in self.tables:
+            raise InvalidRequest('Table {0}.{1} already exists'.format(keyspace, name))
+        columns = []
+        primary_key = None
+        for definition in split_definitions(definitions):
+            if definition.upper().startswith('PRIMARY KEY'):
+                primary_key = split_definitions(definition[definition.index('(') + 1:definition.rindex(')')])
+                continue
+            parts = definition.split(' ', 1)
+            static = parts[1].endswith(' static')
+            columns.append(dict(column_name=parts[0], kind='static' if static else 'regular', position=-1,
+                                type=schema_type(parts[1][:-len(' static')] if static else parts[1])))
+        partition_key = split_definitions(primary_key[0].strip('()'))
+        for column in columns:
+            if column['column_name'] in partition_key:
+                column.update(kind='partition_key', position=partition_key.index(column['column_name']))
+            elif column['column_name'] in primary_key[1:]:
+                column.update(kind='clustering', position=primary_key[1:].index(column['column_name']),
+                              clustering_order='asc')
+        for order in split_definitions(clustering_order or ''):
+            column, direction = order.split(' ')
+            for existing in columns:
+                if existing['column_name'] == column:
+                    existing['clustering_order'] = direction.lower()
+        self.tables[(keyspace, name)] = columns
+        self.table_options[(keyspace, name)] = default_table_options()
+        self.schema_changed()
+        return []
+
+    def add_column(self, match, parameters):
+        keyspace, name, column, cql_type, static = match.groups()
+        columns = self.table(keyspace, name)
+        if any(existing['column_name'] == column for existing in columns):
+            raise InvalidRequest('Invalid column name {0} because it conflicts with an existing column'.format(column))
+        columns.append(dict(column_name=column, kind='static' if static else 'regular', position=-1,
+                            type=schema_type(cql_type)))
+        self.schema_changed()
+        return []
+
+    def drop_column(self, match, parameters):
+        keyspace, name, column = match.groups()
+        columns = self.table(keyspace, name)
+        self.tables[(keyspace, name)] = [existing for existing in columns if existing['column_name'] != column]
+        self.schema_changed()
+        return []
+
+    def alter_table_options(self, match, parameters):
+        keyspace, name, options = match.groups()
+        self.table(keyspace, name)
+        self.table_options[(keyspace, name)].update(parse_table_options(options))
+        self.schema_changed()
+        return []
+
+    def drop_table(self, match, parameters):
+        self.table(*match.groups())
+        del self.tables[match.groups()]
+        del self.table_options[match.groups()]
+        self.rows.pop(match.groups(), None)
+        self.schema_changed()
+        return []
+
+    def insert(self, match, parameters):
+        keyspace, name, columns, values = match.groups()
+        schema = self.table(keyspace, name)
+        row = dict(zip([column.strip() for column in columns.split(',')], parameters))
+        key = tuple(row.get(column['column_name'])
+                    for column in sorted(schema, key=lambda column: (column['kind'], column['position']))
+                    if column['kind'] in ['partition_key', 'clustering'])
+        self.rows.setdefault((keyspace, name), {})[key] = row
+        return []
+
+    def create_type(self, match, parameters):
+        keyspace, name, definitions = match.groups()
+        if (keyspace, name) in self.types:
+            raise InvalidRequest('A user type of name {0}.{1} already exists'.format(keyspace, name))
+        self.types[(keyspace, name)] = [(definition.split(' ', 1)[0], schema_type(definition.split(' ', 1)[1]))
+                                        for definition in split_definitions(definitions)]
+        self.schema_changed()
+        return []
+
+    def add_field(self, match, parameters):
+        keyspace, name, field, cql_type = match.groups()
+        self.types[(keyspace, name)].append((field, schema_type(cql_type)))
+        self.schema_changed()
+        return []
+
+    def drop_type(self, match, parameters):
+        if self.types.pop(match.groups(), None) is None:
+            raise InvalidRequest('No user type named {0}.{1} exists.'.format(*match.groups()))
+        self.schema_changed()
+        return []
+
+    def drop_keyspace(self, match, parameters):
+        name = match.group(1).lower()
+        if self.keyspaces.pop(name, None) is None:
+            raise InvalidRequest('Keyspace {0} does not exist'.format(name))
+        self.schema_changed()
+        return []
+
+
+class FakeCluster(object):
+
+    def __init__(self, cassandra, options):
+        self.cassandra = cassandra
+        self.options = options
+        self.protocol_version = options.get('protocol_version', 4)
+        self.metadata = FakeMetadata(cassandra)
+
+    def set_core_connections_per_host(self, distance, connections):
+        pass
+
+    def set_max_connections_per_host(self, distance, connections):
+        pass
+
+    def connect(self):
+        host = self.options.get('contact_points', ['127.0.0.1'])[0]
+        if not self.cassandra.reachable or host in self.cassandra.down_hosts:
+            raise NoHostAvailable('Unable to connect to any servers', {host: OSError('Connection refused')})
+        delay = self.cassandra.host_delays.get(host, 0)
+        timeout = self.options.get('connect_timeout', 5)
+        time.sleep(min(delay, timeout))
+        if delay > timeout:
+            raise NoHostAvailable('Unable to connect to any servers', {host: OSError('Timed out')})
+        with self.cassandra.lock:
+            self.cassandra.connections += 1
+            auth_provider = self.options.get('auth_provider')
+            if auth_provider is not None:
+                user = self.cassandra.users.get(auth_provider.username)
+                if user is None or user['password'] != auth_provider.password:
+                    raise NoHostAvailable('Unable to connect to any servers', {
+                        '127.0.0.1': AuthenticationFailed('Provided username and/or password are incorrect')})
+        return FakeSession(self.cassandra)
+
+    def shutdown(self):
+        pass
+
+
+class FakeMetadata(object):
+    """The hosts the driver knows after connecting, with the release_version it read from the system tables."""
+
+    Host = namedtuple('Host', ['address', 'release_version'])
+
+    def __init__(self, cassandra):
+        self.cassandra = cassandra
+
+    def all_hosts(self):
+        addresses = ['127.0.0.1'] + [row['peer'] for row in self.cassandra.peer_rows()]
+        return [self.Host(address, self.cassandra.release_version) for address in addresses]
+
+
+class FakeSession(object):
+
+    def __init__(self, cassandra):
+        self.cassandra = cassandra
+
+    def execute(self, statement, parameters=None, trace=False):
+        future = FakeFuture(trace, self.submit)
+        future.run(self.cassandra.execute, statement, parameters)
+        return future.result()
+
+    def execute_async(self, statement, parameters=None, trace=False, timeout=None, execution_profile=None):
+        """
+        Executes the statement on a thread of its own, like the driver answers on its event loop.
+        Timeout and profile are not used.
+        """
+        future = FakeFuture(trace, self.submit)
+        self.submit(future.run, self.cassandra.execute, statement, parameters)
+        return future
+
+    def submit(self, fn, *args, **kwargs):
+        """Runs the function on a thread of its own, the driver hands work to its executor this way."""
+        thread = threading.Thread(target=fn, args=args, kwargs=kwargs)
+        thread.daemon = True
+        thread.start()
+
+    def shutdown(self):
+        pass
+
+
+class FakeFuture(object):
+    """A ResponseFuture of the driver. Traced statements get a trace with one event."""
+
+    Trace = namedtuple('Trace', ['coordinator', 'duration', 'request_type', 'events'])
+    Event = namedtuple('Event', ['source', 'source_elapsed', 'thread_name', 'description'])
+
+    # what the driver's ResultSet reads from the future, all rows are in the first page
+    _col_names = None
+    _col_types = None
+    has_more_pages = False
+
+    def __init__(self, trace, submit):
+        self.trace = trace
+        self.submit = submit
+        self.rows = None
+        self.error = None
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def run(self, execute, statement, parameters):
+        try:
+            rows = execute(statement, parameters)
+            error = None
+        except Exception as failure:
+            rows, error = None, failure
+        with self.lock:
+            self.rows, self.error = rows, error
+            self.done.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            self.call(*callback)
+
+    def call(self, callback, errback, callback_args, errback_args):
+        if self.error is not None:
+            errback(self.error, *errback_args)
+        else:
+            callback(self.rows, *callback_args)
+
+    def result(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return TracedRows(self.rows, self)
+
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=()):
+        with self.lock:
+            if not self.done.is_set():
+                self.callbacks.append((callback, errback, callback_args, errback_args))
+                return
+        # statements answer faster than over the network, called right away the callbacks that start the next
+        # statement would recurse
+        self.submit(self.call, callback, errback, callback_args, errback_args)
+
+    def clear_callbacks(self):
+        with self.lock:
+            self.callbacks = []
+
+    def get_query_trace(self, max_wait=None):
+        if not self.trace:
+            raise ValueError('the statement was not traced')
+        return self.Trace('127.0.0.1', 0.001, 'Execute CQL3 query',
+                          [self.Event('127.0.0.1', 0.0005, 'Native-Transport-Requests-1', 'Parsing statement')])
+
+
+class TracedRows(list):
+    """The rows of a statement, which also offer the trace of the statement like a ResultSet of the driver."""
+
+    def __init__(self, rows, future):
+        list.__init__(self, rows)
+        self.future = future
+
+    def get_query_trace(self, max_wait=None):
+        return self.future.get_query_trace(max_wait)
+
+
+class FakeClusters(object):
+    """Several fake clusters, the one a module connects to is chosen by its contact point (db_host)."""
+
+    def __init__(self, clusters):
+        self.clusters = clusters
+
+    def reset_counters(self):
+        for cassandra in self.clusters.values():
+            cassandra.reset_counters()
+
+    @property
+    def connections(self):
+        return sum(cassandra.connections for cassandra in self.clusters.values())
+
+    @property
+    def queries(self):
+        return [query for cassandra in self.clusters.values() for query in cassandra.queries]
+
+    def cluster(self, contact_points, **options):
+        return self.clusters[contact_points[0]].cluster(contact_points=contact_points, **options)
+
+
+class NativeProtocolHandler(socketserver.BaseRequestHandler):
+    """Speaks the CQL native protocol for one connection to a FakeNativeServer."""
+
+    def handle(self):
+        self.authenticated = False
+        while True:
+            header = self.receive(9)
+            if header is None:
+                return
+            version, flags, stream, opcode, length = struct.unpack('>BBhBi', header)
+            body = self.receive(length) if length else b''
+            self.server.protocol_versions.append(version)
+            try:
+                response_opcode, response = self.respond(opcode, body)
+            except Exception as error:
+                response_opcode, response = 0x00, struct.pack('>i', error_code(error)) + pack_string(str(error))
+            self.request.sendall(struct.pack('>BBhBi', 0x80 | version, 0, stream, response_opcode, len(response)) +
+                                 response)
+
+    def receive(self, length):
+        data = b''
+        while len(data) < length:
+            chunk = self.request.recv(length - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def respond(self, opcode, body):
+        cassandra = self.server.cassandra
+        if opcode == 0x01:
+            with cassandra.lock:
+                cassandra.connections += 1
+            if self.server.authenticate:
+                return 0x03, pack_string('org.apache.cassandra.auth.PasswordAuthenticator')
+            self.authenticated = True
+            return 0x02, b''
+        if opcode == 0x0F:
+            token = body[4:].split(b'\x00')
+            user = cassandra.users.get(token[1].decode('utf-8'))
+            if user is None or user['password'] != token[2].decode('utf-8'):
+                raise AuthenticationFailed('Provided username and/or password are incorrect')
+            self.authenticated = True
+            return 0x10, struct.pack('>i', -1)
+        if opcode == 0x07 and self.authenticated:
+            return 0x08, self.query(body)
+        raise ProtocolError('Unexpected message 0x{0:02x}'.format(opcode))
+
+    def query(self, body):
+        length = struct.unpack('>i', body[:4])[0]
+        query = body[4:4 + length].decode('utf-8')
+        position = 4 + length
+        consistency, flags = struct.unpack('>HB', body[position:position + 3])
+        position += 3
+        values = []
+        if flags & 0x01:
+            count = struct.unpack('>H', body[position:position + 2])[0]
+            position += 2
+            for index in range(count):
+                length = struct.unpack('>i', body[position:position + 4])[0]
+                values.append(body[position + 4:position + 4 + length])
+                position += 4 + length
+        page_size = struct.unpack('>i', body[position:position + 4])[0]
+        position += 4
+        offset = 0
+        if flags & 0x08:
+            offset = struct.unpack('>i', body[position + 4:position + 8])[0]
+        self.server.consistency_levels.append(consistency)
+
+        query, parameters = parameterize(query, values)
+        rows = self.server.cassandra.execute(query, parameters)
+        match = SELECT.match(query)
+        if match is None and not query.startswith('LIST '):
+            return struct.pack('>i', 0x0001)
+        if rows:
+            columns = list(rows[0]._fields)
+        else:
+            columns = [column.strip() for column in match.group('columns').split(',')] if match else []
+        return encode_rows(columns, rows, offset, page_size)
+
+
+class FakeNativeServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Serves a FakeCassandra over the CQL native protocol on a free port of 127.0.0.1, for the native client.
+    The bound values and string literals of the statements are handed to the fake cluster as parameters again,
+    so it sees the same statements as from the driver. Rows are returned page by page.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, cassandra, authenticate=True):
+        socketserver.TCPServer.__init__(self, ('127.0.0.1', 0), NativeProtocolHandler)
+        self.cassandra = cassandra
+        self.authenticate = authenticate
+        self.protocol_versions = []
+        self.consistency_levels = []
+        self.port = self.server_address[1]
+        thread = threading.Thread(target=self.serve_forever, kwargs=dict(poll_interval=0.05))
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def error_code(error):
+    if isinstance(error, AuthenticationFailed):
+        return 0x0100
+    if isinstance(error, InvalidRequest):
+        return 0x2200
+    if isinstance(error, ProtocolError):
+        return 0x000A
+    return 0x0000
+
+
+def pack_string(value):
+    value = value.encode('utf-8')
+    return struct.pack('>H', len(value)) + value
+
+
+def parameterize(query, values):
+    """
+    Turns the bind markers and the string literals outside of maps back into %s and their values into parameters.
+    A value bound with IN is a list of strings, every other value a string.
+    """
+    values = list(values)
+    parameters = []
+
+    def replace(match):
+        if match.group(0) == '?':
+            value = values.pop(0)
+            if query[:match.start()].rstrip().endswith(' IN'):
+                value = tuple(decode_list(value))
+            else:
+                value = value.decode('utf-8')
+        elif query[:match.start()].count('{') > query[:match.start()].count('}'):
+            return match.group(0)
+        else:
+            value = match.group(0)[1:-1].replace("''", "'")
+        parameters.append(value)
+        return '%s'
+
+    return re.sub(r"'(?:[^']|'')*'|\?", replace, query), parameters
+
+
+def decode_list(data):
+    items = []
+    position = 4
+    for index in range(struct.unpack('>i', data[:4])[0]):
+        length = struct.unpack('>i', data[position:position + 4])[0]
+        items.append(data[position + 4:position + 4 + length].decode('utf-8'))
+        position += 4 + length
+    return items
+
+
+def column_type(values):
+    """Returns the type id, its encoding and the encoder of a column, inferred from its first value."""
+    value = next((value for value in values if value is not None), '')
+    if isinstance(value, bool):
+        return struct.pack('>H', 0x0004), lambda value: b'\x01' if value else b'\x00'
+    if isinstance(value, int):
+        return struct.pack('>H', 0x0002), lambda value: struct.pack('>q', value)
+    if isinstance(value, float):
+        return struct.pack('>H', 0x0007), lambda value: struct.pack('>d', value)
+    if isinstance(value, uuid.UUID):
+        return struct.pack('>H', 0x000C), lambda value: value.bytes
+    if isinstance(value, dict):
+        return struct.pack('>HHH', 0x0021, 0x000D, 0x000D), lambda value: encode_collection(
+            [item for pair in sorted(value.items()) for item in pair], len(value))
+    if isinstance(value, (list, set)):
+        return struct.pack('>HH', 0x0020 if isinstance(value, list) else 0x0022, 0x000D), \
+            lambda value: encode_collection(value, len(value))
+    return struct.pack('>H', 0x000D), lambda value: str(value).encode('utf-8')
+
+
+def encode_collection(items, count):
+    body = struct.pack('>i', count)
+    for item in items:
+        item = str(item).encode('utf-8')
+        body += struct.pack('>i', len(item)) + item
+    return body
+
+
+def encode_rows(columns, rows, offset, page_size):
+    page = rows[offset:offset + page_size] if page_size > 0 else rows[offset:]
+    more = page_size > 0 and offset + page_size < len(rows)
+    types = [column_type([row[index] for row in rows]) for index in range(len(columns))]
+
+    body = struct.pack('>iii', 0x0002, 0x0001 | (0x0002 if more else 0), len(columns))
+    if more:
+        body += struct.pack('>ii', 4, offset + page_size)
+    body += pack_string('fake') + pack_string('table')
+    for column, (type_spec, encoder) in zip(columns, types):
+        body += pack_string(column) + type_spec
+    body += struct.pack('>i', len(page))
+    for row in page:
+        for value, (type_spec, encoder) in zip(row, types):
+            if value is None:
+                body += struct.pack('>i', -1)
+            else:
+                data = encoder(value)
+                body += struct.pack('>i', len(data)) + data
+    return body
+
+
+class ModuleExit(SystemExit):
+    """Raised instead of printing the result, derived from SystemExit like the real exit of a module."""
+
+    def __init__(self, result, module):
+        SystemExit.__init__(self, 0)
+        self.result = result
+        self.module = module
+
+
+def exit_json(module, **result):
+    raise ModuleExit(result, module)
+
+
+def fail_json(module, **result):
+    result['failed'] = True
+    raise ModuleExit(result, module)
+
+
+def masked_values():
+    """Returns the values the last module run would have masked in its logs and its result."""
+    return set(run_module.last_module.no_log_values)
+
+
+def load_module(name):
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    return importlib.import_module(name)
+
+
+def run_module(name, cassandra, args):
+    """
+    Runs the main function of a module against the fake cluster, or the FakeClusters.
+    Returns the result of the module and the cost of the run: seconds, connections and queries.
+    """
+    module = load_module(name)
+    cassandra.reset_counters()
+    start = time.time()
+    with patch_module_args(args), \
+            mock.patch.object(cassandra_common, 'Cluster', cassandra.cluster), \
+            mock.patch.object(basic.AnsibleModule, 'exit_json', exit_json), \
+            mock.patch.object(basic.AnsibleModule, 'fail_json', fail_json):
+        try:
+            module.main()
+        except ModuleExit as module_exit:
+            result = module_exit.result
+            run_module.last_module = module_exit.module
+        else:
+            raise AssertionError('module {0} did not exit'.format(name))
+    cost = dict(seconds=time.time() - start, connections=cassandra.connections, queries=len(cassandra.queries))
+    return result, cost
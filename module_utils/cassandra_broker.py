@@ -0,0 +1,415 @@
+# A small local process that keeps an authenticated Cassandra session open between module runs,
+# similar to what ControlPersist does for ssh.
+#
+# The first module that wants to use the broker forks it. The broker opens the session, listens on a unix
+# socket that only the current user can access and exits after it was idle for a while. The modules talk to
+# it with one JSON document per line. Every request is either a single statement or a list of statements
+# that the broker executes concurrently.
+#
+# This file only depends on the standard library, the driver is only imported if the broker keeps a session of
+# the driver. The session the broker keeps is handed in by the caller, so any object with an
+# execute(statement, parameters) method can stand in for a real Cassandra session.
+
+import binascii
+import datetime
+import errno
+import hashlib
+import hmac
+import json
+import os
+import select
+import socket
+import sys
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+BROKER_START_TIMEOUT = 30
+IDLE_CHECK_INTERVAL = 1
+
+
+class BrokerError(Exception):
+    pass
+
+
+def broker_secret(socket_dir):
+    """
+    Returns the secret the names of the sockets in the directory are derived with. It is created on first use,
+    only the current user can read it.
+    """
+    path = os.path.join(socket_dir, 'broker.key')
+    if not os.path.exists(path):
+        # written to a file of its own and linked in place, so no module run ever reads a half written secret
+        temporary = '{0}.{1}'.format(path, os.getpid())
+        descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, 'wb') as secret_file:
+            secret_file.write(binascii.hexlify(os.urandom(32)))
+        try:
+            os.link(temporary, path)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        finally:
+            os.unlink(temporary)
+    with open(path, 'rb') as secret_file:
+        return secret_file.read()
+
+
+def broker_socket_path(socket_dir, connection_options):
+    """
+    Returns the path of the socket of the broker that serves the given connection options.
+    Every combination of options gets its own broker. The options, which include the password, are only used as
+    an HMAC keyed with the secret of the directory, so the names of the sockets do not allow to guess them.
+    """
+    socket_dir = os.path.expanduser(socket_dir)
+    options = json.dumps(connection_options, sort_keys=True, default=str).encode('utf-8')
+    digest = hmac.new(broker_secret(socket_dir), options, hashlib.sha256).hexdigest()
+    return os.path.join(socket_dir, 'cassandra-' + digest[:24] + '.sock')
+
+
+def encode_value(value):
+    """Prepares statement parameters for JSON. Tuples are kept apart from lists, the driver renders them differently."""
+    if isinstance(value, tuple):
+        return {'__tuple__': [encode_value(item) for item in value]}
+    if isinstance(value, list):
+        return [encode_value(item) for item in value]
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, dict) and '__tuple__' in value:
+        return tuple(decode_value(item) for item in value['__tuple__'])
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    return value
+
+
+def jsonable(value):
+    """Converts the column types the driver returns that JSON does not know."""
+    if hasattr(value, 'items'):
+        return dict(value.items())
+    if isinstance(value, (set, frozenset)) or type(value).__name__ == 'SortedSet':
+        return list(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_statement(statement, parameters=None):
+    return dict(query=getattr(statement, 'query_string', statement),
+                consistency_level=getattr(statement, 'consistency_level', None),
+                fetch_size=getattr(statement, 'fetch_size', None),
+                is_idempotent=getattr(statement, 'is_idempotent', False),
+                parameters=encode_value(parameters))
+
+
+def encode_rows(rows):
+    columns = None
+    values = []
+    for row in rows:
+        if columns is None:
+            columns = list(row._fields)
+        values.append(list(row))
+    return dict(columns=columns or [], rows=values)
+
+
+def encode_error(error):
+    return dict(error=str(error), type=type(error).__name__)
+
+
+class BrokerRow(object):
+    """A row received from the broker. Columns can be read as attributes or by index."""
+
+    def __init__(self, columns, values):
+        self._fields = columns
+        self._values = values
+        for column, value in zip(columns, values):
+            setattr(self, column, value)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __getitem__(self, index):
+        return self._values[index]
+
+    def __len__(self):
+        return len(self._values)
+
+
+class BrokerResult(list):
+    """The rows of a statement. Like a ResultSet of the driver it offers the fetched rows as current_rows."""
+
+    def __init__(self, encoded):
+        list.__init__(self, [BrokerRow(encoded['columns'], values) for values in encoded['rows']])
+        self.current_rows = list(self)
+
+
+def raise_error(encoded, errors=None):
+    """
+    Raises the exception the broker reported as the exception of the same name in errors, a module or a dict.
+    Without errors the exceptions of the driver are used if it is loaded.
+    """
+    if errors is None:
+        errors = sys.modules.get('cassandra')
+    if isinstance(errors, dict):
+        error_class = errors.get(encoded['type'])
+    else:
+        error_class = getattr(errors, encoded['type'], None)
+    if error_class is not None:
+        try:
+            error = error_class(encoded['error'])
+        except TypeError:
+            error = None
+        if isinstance(error, Exception):
+            raise error
+    raise BrokerError(encoded['error'])
+
+
+class BrokerSession(object):
+    """Client side of the broker offering the parts of the driver's Session the modules use."""
+
+    def __init__(self, socket_path, timeout=None, errors=None):
+        self.socket_path = socket_path
+        self.errors = errors
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.reader = self.sock.makefile('rb')
+
+    def request(self, payload):
+        self.sock.sendall(json.dumps(payload, default=jsonable).encode('utf-8') + b'\n')
+        line = self.reader.readline()
+        if not line:
+            raise BrokerError('The broker at {0} closed the connection.'.format(self.socket_path))
+        return json.loads(line.decode('utf-8'))
+
+    def execute(self, statement, parameters=None):
+        response = self.request(dict(op='execute', statement=encode_statement(statement, parameters)))
+        if 'error' in response:
+            raise_error(response, self.errors)
+        return BrokerResult(response)
+
+    def execute_concurrent(self, statements_and_parameters, concurrency=100, raise_on_first_error=False):
+        """Executes the statements concurrently inside the broker and returns (success, result) tuples."""
+        statements = [encode_statement(statement, parameters) for statement, parameters in statements_and_parameters]
+        response = self.request(dict(op='execute_concurrent', statements=statements, concurrency=concurrency))
+        if 'error' in response:
+            raise_error(response, self.errors)
+        results = []
+        for result in response['results']:
+            if 'error' in result:
+                if raise_on_first_error:
+                    raise_error(result, self.errors)
+                results.append((False, BrokerError(result['error'])))
+            else:
+                results.append((True, BrokerResult(result)))
+        return results
+
+    def shutdown(self):
+        """Closes the connection to the broker. The broker itself and its session stay alive."""
+        self.reader.close()
+        self.sock.close()
+
+
+def driver_session(session):
+    """Sessions of the driver can execute statements asynchronously, they need the driver's statements."""
+    return hasattr(session, 'execute_async')
+
+
+def decode_statement(encoded, session):
+    if driver_session(session):
+        from cassandra.query import SimpleStatement
+        statement = SimpleStatement(encoded['query'], consistency_level=encoded['consistency_level'],
+                                    is_idempotent=encoded.get('is_idempotent', False))
+        if encoded.get('fetch_size'):
+            statement.fetch_size = encoded['fetch_size']
+        return statement
+    return encoded['query']
+
+
+def run_statement(session, encoded):
+    try:
+        return encode_rows(session.execute(decode_statement(encoded, session), decode_value(encoded['parameters'])))
+    except Exception as error:
+        return encode_error(error)
+
+
+def run_statements(session, statements, concurrency):
+    if not driver_session(session) and not hasattr(session, 'execute_concurrent'):
+        return [run_statement(session, encoded) for encoded in statements]
+
+    decoded = [(decode_statement(encoded, session), decode_value(encoded['parameters'])) for encoded in statements]
+    if driver_session(session):
+        from cassandra.concurrent import execute_concurrent
+        outcomes = execute_concurrent(session, decoded, concurrency=concurrency, raise_on_first_error=False)
+    else:
+        outcomes = session.execute_concurrent(decoded, concurrency=concurrency, raise_on_first_error=False)
+    results = []
+    for success, outcome in outcomes:
+        if success:
+            results.append(encode_rows(outcome))
+        else:
+            results.append(encode_error(outcome))
+    return results
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server
+        server.track(1)
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    break
+                request = json.loads(line.decode('utf-8'))
+                if request['op'] == 'execute':
+                    response = run_statement(server.session, request['statement'])
+                elif request['op'] == 'execute_concurrent':
+                    response = dict(results=run_statements(server.session, request['statements'],
+                                                           request['concurrency']))
+                else:
+                    response = dict(error='Unknown operation ' + str(request['op']), type='BrokerError')
+                self.wfile.write(json.dumps(response, default=jsonable).encode('utf-8') + b'\n')
+                self.wfile.flush()
+        finally:
+            server.track(-1)
+
+
+class BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, session, ttl):
+        socketserver.UnixStreamServer.__init__(self, socket_path, BrokerHandler)
+        self.session = session
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.active = 0
+        self.last_used = time.time()
+
+    def track(self, delta):
+        with self.lock:
+            self.active += delta
+            self.last_used = time.time()
+
+    def idle(self):
+        with self.lock:
+            return self.active == 0 and time.time() - self.last_used > self.ttl
+
+
+def bind(socket_path, session, ttl):
+    """Binds the broker socket, replacing a socket that was left behind by a broker that is gone."""
+    old_umask = os.umask(0o077)
+    try:
+        try:
+            return BrokerServer(socket_path, session, ttl)
+        except socket.error as error:
+            if error.errno != errno.EADDRINUSE or broker_alive(socket_path):
+                raise
+        os.unlink(socket_path)
+        return BrokerServer(socket_path, session, ttl)
+    finally:
+        os.umask(old_umask)
+
+
+def serve(socket_path, session, ttl, ready=None):
+    """
+    Serves the session on the socket until nothing used it for ttl seconds.
+    ready is called once the socket accepts connections.
+    """
+    server = bind(socket_path, session, ttl)
+
+    def watch_idle():
+        while not server.idle():
+            time.sleep(IDLE_CHECK_INTERVAL)
+        server.shutdown()
+
+    watcher = threading.Thread(target=watch_idle)
+    watcher.daemon = True
+    watcher.start()
+    if ready is not None:
+        ready()
+    try:
+        server.serve_forever(poll_interval=IDLE_CHECK_INTERVAL)
+    finally:
+        server.server_close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+
+
+def broker_alive(socket_path):
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except socket.error:
+        return False
+    finally:
+        probe.close()
+    return True
+
+
+def start_broker(socket_path, connect, ttl):
+    """
+    Forks a detached broker process. connect is called in that process and returns the session and a function
+    to shut it down. Waits until the broker is ready and raises a BrokerError if it could not be started.
+    """
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        os.setsid()
+        if os.fork() != 0:
+            os._exit(0)
+        # detach from the output of the module, Ansible waits until it is closed
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        status = 1
+        try:
+            session, close = connect()
+            try:
+                serve(socket_path, session, ttl, ready=lambda: os.write(write_end, b'ok\n'))
+                status = 0
+            finally:
+                close()
+        except Exception as error:
+            os.write(write_end, ('error: ' + str(error) + '\n').encode('utf-8'))
+        finally:
+            os._exit(status)
+
+    os.close(write_end)
+    os.waitpid(pid, 0)
+    try:
+        readable = select.select([read_end], [], [], BROKER_START_TIMEOUT)[0]
+        message = os.read(read_end, 4096).decode('utf-8').strip() if readable else ''
+    finally:
+        os.close(read_end)
+    if message != 'ok':
+        raise BrokerError(message[len('error: '):] if message.startswith('error: ')
+                          else 'The broker did not start within {0} seconds.'.format(BROKER_START_TIMEOUT))
+
+
+def broker_session(socket_dir, connection_options, connect, ttl, errors=None):
+    """
+    Returns a BrokerSession for the broker serving the given connection options and starts the broker if it
+    is not running yet. See start_broker for connect and raise_error for errors.
+    """
+    socket_dir = os.path.expanduser(socket_dir)
+    if not os.path.isdir(socket_dir):
+        os.makedirs(socket_dir, 0o700)
+    socket_path = broker_socket_path(socket_dir, connection_options)
+    if not broker_alive(socket_path):
+        try:
+            start_broker(socket_path, connect, ttl)
+        except BrokerError:
+            # another module run may have started the same broker in the meantime
+            if not broker_alive(socket_path):
+                raise
+    return BrokerSession(socket_path, errors=errors)
@@ -0,0 +1,749 @@
+# Code shared by the Cassandra modules.
+# Ansible picks this file up if the module_utils directory sits next to the playbook (or in a configured
+# module_utils path) and bundles it with every module that imports it.
+
+import json
+import re
+import sys
+import threading
+import time
+import weakref
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ansible.module_utils import cassandra_native
+from ansible.module_utils.cassandra_broker import broker_session
+from ansible.module_utils.cassandra_profile import Profiler, ProfilingSession, attach_profiler, timing_auth_provider
+
+try:
+    from importlib.util import find_spec
+except ImportError:
+    # Python 2
+    import imp
+
+    def find_spec(name):
+        try:
+            return imp.find_module(name)
+        except ImportError:
+            return None
+
+# Importing the driver takes longer than most module runs, so it is only imported by load_driver when it is used.
+cassandra_driver_found = find_spec('cassandra') is not None
+
+ConsistencyLevel = None
+PlainTextAuthProvider = None
+EXEC_PROFILE_DEFAULT = None
+Cluster = None
+ExecutionProfile = None
+execute_concurrent = None
+ConstantSpeculativeExecutionPolicy = None
+DCAwareRoundRobinPolicy = None
+HostDistance = None
+WhiteListRoundRobinPolicy = None
+SimpleStatement = None
+NoHostAvailable = None
+
+# (module, name) of everything load_driver imports from the driver
+DRIVER_IMPORTS = [
+    ('cassandra', 'ConsistencyLevel'),
+    ('cassandra.auth', 'PlainTextAuthProvider'),
+    ('cassandra.cluster', 'EXEC_PROFILE_DEFAULT'),
+    ('cassandra.cluster', 'Cluster'),
+    ('cassandra.cluster', 'ExecutionProfile'),
+    ('cassandra.cluster', 'NoHostAvailable'),
+    ('cassandra.concurrent', 'execute_concurrent'),
+    ('cassandra.policies', 'ConstantSpeculativeExecutionPolicy'),
+    ('cassandra.policies', 'DCAwareRoundRobinPolicy'),
+    ('cassandra.policies', 'HostDistance'),
+    ('cassandra.policies', 'WhiteListRoundRobinPolicy'),
+    ('cassandra.query', 'SimpleStatement')
+]
+
+DRIVERS = ['auto', 'datastax', 'native']
+
+
+# Tables holding the users, newest layout first:
+# (table, name column, superuser column, login column if not every row is a user,
+#  table holding the password hashes if it is not the same table)
+AUTH_TABLES = [
+    ('system_auth.roles', 'role', 'is_superuser', 'can_login', None),
+    ('system_auth.users', 'name', 'super', None, 'system_auth.credentials')
+]
+
+USERS_FETCH_SIZE = 1000
+
+SCHEMA_AGREEMENT_POLL_INTERVAL = 0.2
+
+# The options every entry of 'clusters' may set for its own cluster
+CLUSTER_OPTIONS = ['db_user', 'db_password', 'db_host', 'db_hosts', 'db_port', 'protocol_version', 'consistency',
+                   'local_dc', 'request_timeout', 'connect_timeout', 'speculative_execution_delay',
+                   'speculative_executions']
+
+# The connect timeout in seconds when several db_hosts race to connect, a node that is slower is not waited for
+HOSTS_CONNECT_TIMEOUT = 2
+
+# unquoted names of keyspaces, tables, columns and types
+IDENTIFIER = re.compile(r'^\w+$')
+
+CONSISTENCY_LEVELS = ['ONE', 'TWO', 'THREE', 'QUORUM', 'ALL', 'LOCAL_QUORUM', 'EACH_QUORUM', 'LOCAL_ONE']
+
+# Tables holding the keyspaces, newest layout first: (table, columns)
+KEYSPACE_TABLES = [
+    ('system_schema.keyspaces', 'keyspace_name, durable_writes, replication'),
+    ('system.schema_keyspaces', 'keyspace_name, durable_writes, strategy_class, strategy_options')
+]
+
+# The index into KEYSPACE_TABLES that worked for a session, detected once per connection
+keyspace_layouts = weakref.WeakKeyDictionary()
+
+
+def load_driver():
+    """Imports the parts of the DataStax driver the modules use. Names that are already set are kept."""
+    for module_name, name in DRIVER_IMPORTS:
+        if globals()[name] is None:
+            globals()[name] = getattr(__import__(module_name, fromlist=[name]), name)
+
+
+def driver_name(module):
+    """Returns the client the module uses, 'datastax' or 'native'. 'auto' prefers the DataStax driver if installed."""
+    driver = module.params.get('driver') or 'auto'
+    if driver == 'auto':
+        return 'datastax' if cassandra_driver_found else 'native'
+    return driver
+
+
+def check_driver(module):
+    """Fails the module if it should use the DataStax driver and the driver is not installed."""
+    if driver_name(module) == 'datastax' and not cassandra_driver_found:
+        module.fail_json(msg='no cassandra driver for python found. please install cassandra-driver or use '
+                             'driver=native.')
+
+
+def cassandra_errors(*names):
+    """
+    Returns a tuple with the exceptions of the given names of the native client and, if it is loaded, of the
+    driver, to catch the error whichever client raised it.
+    """
+    errors = [cassandra_native.ERRORS[name] for name in names]
+    driver = sys.modules.get('cassandra')
+    if driver is not None:
+        errors.extend(getattr(driver, name) for name in names if hasattr(driver, name))
+    return tuple(errors)
+
+
+def create_statement(statement, fetch_size=None, idempotent=False):
+    """
+    The consistency level of the statement is taken from the consistency option of the module.
+    Only idempotent statements are executed speculatively.
+    """
+    if SimpleStatement is None:
+        return cassandra_native.Statement(statement, fetch_size=fetch_size, is_idempotent=idempotent)
+    if fetch_size is None:
+        return SimpleStatement(statement, is_idempotent=idempotent)
+    return SimpleStatement(statement, fetch_size=fetch_size, is_idempotent=idempotent)
+
+
+def cassandra_argument_spec():
+    """Returns the connection options every Cassandra module accepts."""
+    return dict(
+        db_user=dict(required=False),
+        db_password=dict(required=False, no_log=True),
+        db_host=dict(default='localhost'),
+        db_hosts=dict(default=None, required=False, type='list'),
+        db_port=dict(default=9042, type='int'),
+        protocol_version=dict(default=3, type='int', choices=[1, 2, 3, 4]),
+        broker=dict(default='no', type='bool'),
+        broker_ttl=dict(default=60, type='int'),
+        broker_socket_dir=dict(default='~/.ansible/cp'),
+        driver=dict(default='auto', choices=DRIVERS),
+        profile=dict(default='no', type='bool'),
+        trace=dict(default='no', type='bool'),
+        consistency=dict(default='QUORUM', choices=CONSISTENCY_LEVELS),
+        local_dc=dict(default=None, required=False),
+        request_timeout=dict(default=None, required=False, type='float'),
+        connect_timeout=dict(default=None, required=False, type='float'),
+        speculative_execution_delay=dict(default=None, required=False, type='float'),
+        speculative_executions=dict(default=2, type='int')
+    )
+
+
+def clusters_argument_spec():
+    """
+    Returns the 'clusters' and 'cluster_concurrency' options. The entries of clusters take the connection options
+    of CLUSTER_OPTIONS without defaults, the options an entry leaves out are taken from the module.
+    """
+    spec = cassandra_argument_spec()
+    options = dict(name=dict(required=False))
+    for key in CLUSTER_OPTIONS:
+        options[key] = dict((name, value) for name, value in spec[key].items() if name != 'default')
+        options[key]['required'] = False
+    return dict(
+        clusters=dict(default=None, required=False, type='list', elements='dict', options=options),
+        cluster_concurrency=dict(default=10, type='int')
+    )
+
+
+def load_balancing_policy(module, host):
+    """
+    Requests only go to the given host unless a local data center or speculative executions are configured.
+    Those need other nodes to send requests to, so the driver then connects to every node of the local data center.
+    """
+    if module.params.get('local_dc') or module.params.get('speculative_execution_delay'):
+        return DCAwareRoundRobinPolicy(local_dc=module.params.get('local_dc'), used_hosts_per_remote_dc=0)
+    return WhiteListRoundRobinPolicy([host])
+
+
+def execution_profile(module, host):
+    """Returns the default execution profile built from the consistency, timeout and speculation options."""
+    profile = ExecutionProfile(load_balancing_policy=load_balancing_policy(module, host),
+                               consistency_level=getattr(ConsistencyLevel, module.params.get('consistency', 'QUORUM')))
+    if module.params.get('request_timeout'):
+        profile.request_timeout = module.params['request_timeout']
+    if module.params.get('speculative_execution_delay'):
+        profile.speculative_execution_policy = ConstantSpeculativeExecutionPolicy(
+            module.params['speculative_execution_delay'], module.params.get('speculative_executions', 2))
+    return profile
+
+
+def connect_timeout(module):
+    """Returns the connect timeout option, which is shorter by default when several db_hosts race to connect."""
+    if module.params.get('connect_timeout'):
+        return module.params['connect_timeout']
+    if module.params.get('db_hosts'):
+        return HOSTS_CONNECT_TIMEOUT
+    return None
+
+
+def connection_host(module):
+    """Returns the host further connections of the module should go to, the one of db_hosts that answered first."""
+    connection = getattr(module, 'connection', None)
+    if connection is not None:
+        return connection['host']
+    return module.params['db_host']
+
+
+def create_cluster(module, username=None, password=None, metadata=False, profiler=None, host=None, **options):
+    """
+    Creates a Cluster for the connection options of the module that is as cheap to connect as possible:
+    - schema and token metadata are only loaded if metadata is True, the modules query the system tables themselves
+    - all requests go to the given host, by default the one of connection_host, the driver does not open pools to
+      the other nodes, unless local_dc or speculative executions need them
+    - only a single connection is opened to that host
+    The credentials default to db_user and db_password. Without credentials no authentication is used.
+    With a profiler the time the authentication took is recorded. Additional options are passed on to the Cluster.
+    """
+    load_driver()
+    if host is None:
+        host = connection_host(module)
+    if connect_timeout(module) is not None:
+        options.setdefault('connect_timeout', connect_timeout(module))
+    if username is None and password is None:
+        username = module.params['db_user']
+        password = module.params['db_password']
+    if username is not None and password is not None:
+        if profiler is not None:
+            options['auth_provider'] = timing_auth_provider(username, password, profiler)
+        else:
+            options['auth_provider'] = PlainTextAuthProvider(username=username, password=password)
+
+    protocol_version = module.params['protocol_version']
+    cluster = Cluster(contact_points=[host], port=module.params['db_port'],
+                      protocol_version=protocol_version,
+                      execution_profiles={EXEC_PROFILE_DEFAULT: execution_profile(module, host)},
+                      schema_metadata_enabled=metadata, token_metadata_enabled=metadata, **options)
+    if protocol_version < 3:
+        # newer protocol versions multiplex all requests over a single connection anyway
+        cluster.set_core_connections_per_host(HostDistance.LOCAL, 1)
+        cluster.set_max_connections_per_host(HostDistance.LOCAL, 1)
+    return cluster
+
+
+def native_session(module, username=None, password=None, profiler=None, host=None):
+    """
+    Opens a session of the native client to the host with the credentials, consistency and timeouts of the
+    module. The host and the credentials default like in create_cluster.
+    """
+    if module.params.get('speculative_execution_delay'):
+        raise cassandra_native.NativeError('Speculative executions are not supported by the native driver.')
+    if username is None and password is None:
+        username = module.params['db_user']
+        password = module.params['db_password']
+    return cassandra_native.NativeSession(host or connection_host(module), module.params['db_port'],
+                                          protocol_version=module.params['protocol_version'],
+                                          username=username, password=password,
+                                          consistency=module.params.get('consistency') or 'QUORUM',
+                                          connect_timeout=connect_timeout(module) or
+                                          cassandra_native.CONNECT_TIMEOUT,
+                                          request_timeout=module.params.get('request_timeout') or
+                                          cassandra_native.REQUEST_TIMEOUT,
+                                          profiler=profiler)
+
+
+def can_login(module, username, password):
+    """Tries to authenticate against the cluster with the given credentials."""
+    if driver_name(module) == 'native':
+        try:
+            native_session(module, username, password).shutdown()
+        except (cassandra_native.AuthenticationFailed, cassandra_native.NoHostAvailable):
+            return False
+        return True
+
+    cluster = create_cluster(module, username, password)
+    try:
+        cluster.connect()
+    except cassandra_errors('AuthenticationFailed') + (NoHostAvailable,):
+        return False
+    finally:
+        cluster.shutdown()
+    return True
+
+
+def connect(module, **options):
+    """
+    Connects to the cluster as described in create_cluster and returns the cluster and the session.
+    With the native driver the session of the native client is returned as both, options for the Cluster are ignored.
+    With the broker option the session is kept open by a local broker process and reused by later module runs.
+    In that case the returned cluster only closes the connection to the broker.
+    With the profile option every result of the module gets the timings of the run.
+    With db_hosts every result tells the host that was used and how long connecting took, see connect_hosts.
+    """
+    if module.params.get('profile'):
+        profiler = Profiler(trace=module.params['trace'])
+        attach_profiler(module, profiler)
+        module.profiler = profiler
+        start = time.time()
+        cluster, session = open_session(module, profiler=profiler, **options)
+        profiler.record('connect', time.time() - start)
+        return cluster, ProfilingSession(session, profiler)
+    return open_session(module, **options)
+
+
+def open_session(module, profiler=None, **options):
+    if module.params.get('broker'):
+        connection_options = dict(db_user=module.params['db_user'], db_password=module.params['db_password'],
+                                  db_host=module.params['db_host'], db_hosts=module.params.get('db_hosts'),
+                                  db_port=module.params['db_port'],
+                                  protocol_version=module.params['protocol_version'], options=options,
+                                  driver=driver_name(module))
+        for name in ['consistency', 'local_dc', 'request_timeout', 'connect_timeout', 'speculative_execution_delay',
+                     'speculative_executions']:
+            connection_options[name] = module.params.get(name)
+
+        def open_broker_session():
+            cluster, session = connect_hosts(module, **options)
+            return session, cluster.shutdown
+
+        session = broker_session(module.params['broker_socket_dir'], connection_options, open_broker_session,
+                                 module.params['broker_ttl'], errors=cassandra_native.ERRORS)
+        return session, session
+
+    return connect_hosts(module, profiler=profiler, **options)
+
+
+def connect_host(module, host, profiler=None, **options):
+    """Connects to a single host with the client of the module and returns the cluster and the session."""
+    if driver_name(module) == 'native':
+        session = native_session(module, profiler=profiler, host=host)
+        return session, session
+
+    cluster = create_cluster(module, profiler=profiler, host=host, **options)
+    try:
+        return cluster, cluster.connect()
+    except Exception:
+        cluster.shutdown()
+        raise
+
+
+def connect_hosts(module, profiler=None, **options):
+    """
+    Connects to db_host, or to all db_hosts at the same time, and returns the cluster and the session of the first
+    host that accepted the credentials. A node that is down, restarting or paused does not hold up the module.
+    The host and the seconds it took are kept as the 'connection' of the module and added to its results.
+    """
+    hosts = module.params.get('db_hosts')
+    if not hosts:
+        return connect_host(module, module.params['db_host'], profiler, **options)
+
+    def open_host(host):
+        cluster, session = connect_host(module, host, profiler, **options)
+        return (cluster, session), cluster.shutdown
+
+    host, (cluster, session), seconds = first_connected(hosts, open_host)
+    module.connection = dict(host=host, seconds=round(seconds, 6))
+    report_connection(module)
+    return cluster, session
+
+
+def first_connected(hosts, open_host):
+    """
+    Calls open_host for all hosts at the same time and returns the host, the connection of the first call that
+    succeeded and the seconds it took. open_host returns a connection and a function to close it. Connections
+    that succeed later are closed right away. Raises NoHostAvailable with all errors if no host could be connected.
+    """
+    start = time.time()
+    outcomes = queue.Queue()
+    lock = threading.Lock()
+    chosen = []
+
+    def attempt(host):
+        try:
+            connection, close = open_host(host)
+        except Exception as error:
+            outcomes.put((host, None, error))
+            return
+        with lock:
+            first = len(chosen) == 0
+            chosen.append(host)
+        if first:
+            outcomes.put((host, connection, None))
+        else:
+            close()
+
+    for host in hosts:
+        # the module must not wait for hosts that are slow to answer when it exits
+        thread = threading.Thread(target=attempt, args=(host,))
+        thread.daemon = True
+        thread.start()
+
+    errors = []
+    for index in range(len(hosts)):
+        host, connection, error = outcomes.get()
+        if error is None:
+            return host, connection, time.time() - start
+        errors.append('{0}: {1}'.format(host, error))
+    raise cassandra_native.NoHostAvailable('Unable to connect to any of the hosts, ' + '; '.join(errors))
+
+
+def report_connection(module):
+    """Adds the 'connection' of the module to every result it returns."""
+    exit_json = module.exit_json
+    fail_json = module.fail_json
+
+    def exit_with_connection(**kwargs):
+        kwargs['connection'] = module.connection
+        exit_json(**kwargs)
+
+    def fail_with_connection(**kwargs):
+        kwargs['connection'] = module.connection
+        fail_json(**kwargs)
+
+    module.exit_json = exit_with_connection
+    module.fail_json = fail_with_connection
+
+
+def execute_concurrent_statements(session, statements, concurrency):
+    """
+    Executes the (statement, parameters) tuples with at most concurrency statements in flight.
+    Returns a (success, result or error) tuple for every statement.
+    """
+    if hasattr(session, 'execute_concurrent'):
+        # the broker and newer drivers offer this on the session
+        return session.execute_concurrent(statements, concurrency=concurrency, raise_on_first_error=False)
+    return execute_concurrent(session, statements, concurrency=concurrency, raise_on_first_error=False)
+
+
+def cql_literal(value, secrets=()):
+    if value in secrets:
+        return "'********'"
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, tuple)):
+        return '(' + ', '.join(cql_literal(item, secrets) for item in value) + ')'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def render_statement(statement, parameters=None, secrets=()):
+    """Renders a statement with its parameters for the plan of the check mode. Secret values are masked."""
+    if not parameters:
+        return statement
+    secrets = [secret for secret in secrets if secret is not None]
+    return statement % tuple(cql_literal(parameter, secrets) for parameter in parameters)
+
+
+def read_users(session, username=None, with_hashes=False, login_only=False):
+    """
+    Returns a dict mapping usernames to a dict with their superuser and can_login flags and, if requested, their
+    password hash. If a username is given only the partition of that user is read, otherwise all users are
+    streamed page by page. The users are read from system_auth.roles (Cassandra 2.2+), which also holds roles that
+    cannot login and are left out with login_only, or from system_auth.users on older versions.
+    If the connected user may not read system_auth, LIST USERS is used instead and no hashes are returned.
+    """
+    for table, name_column, superuser_column, login_column, hash_table in AUTH_TABLES:
+        columns = [name_column, superuser_column]
+        if login_column is not None:
+            columns.append(login_column)
+        if with_hashes and hash_table is None:
+            columns.append('salted_hash')
+        query = 'SELECT {0} FROM {1}'.format(', '.join(columns), table)
+        parameters = None
+        if username is not None:
+            query += ' WHERE {0} = %s'.format(name_column)
+            parameters = [username]
+        try:
+            rows = session.execute(create_statement(query, fetch_size=USERS_FETCH_SIZE, idempotent=True),
+                                   parameters)
+        except cassandra_errors('InvalidRequest'):
+            # the table does not exist in this version of Cassandra
+            continue
+        except cassandra_errors('Unauthorized'):
+            break
+
+        users = {}
+        for row in rows:
+            can_login = getattr(row, login_column) if login_column is not None else True
+            if login_only and not can_login:
+                continue
+            users[getattr(row, name_column)] = dict(superuser=getattr(row, superuser_column), can_login=can_login,
+                                                    salted_hash=getattr(row, 'salted_hash', None))
+        if with_hashes and hash_table is not None:
+            read_legacy_hashes(session, hash_table, users, username)
+        return users
+
+    users = {}
+    for user in session.execute(create_statement('LIST USERS', fetch_size=USERS_FETCH_SIZE, idempotent=True)):
+        if username is None or user.name == username:
+            users[user.name] = dict(superuser=user.super, can_login=True, salted_hash=None)
+    return users
+
+
+def read_legacy_hashes(session, hash_table, users, username=None):
+    """Adds the password hashes kept in the separate credentials table of Cassandra < 2.2 to the given users."""
+    query = 'SELECT username, salted_hash FROM {0}'.format(hash_table)
+    parameters = None
+    if username is not None:
+        query += ' WHERE username = %s'
+        parameters = [username]
+    try:
+        rows = session.execute(create_statement(query, fetch_size=USERS_FETCH_SIZE, idempotent=True), parameters)
+        for row in rows:
+            if row.username in users:
+                users[row.username]['salted_hash'] = row.salted_hash
+    except cassandra_errors('InvalidRequest', 'Unauthorized'):
+        pass
+
+
+def major_version(release_version):
+    try:
+        return int(release_version.split('.')[0])
+    except (AttributeError, ValueError):
+        return 0
+
+
+def identifier(module, name, what):
+    """Returns the name as Cassandra stores unquoted identifiers, fails if it is no valid identifier."""
+    name = str(name)
+    if not IDENTIFIER.match(name):
+        module.fail_json(msg="Invalid {0} name {1}.".format(what, name))
+    return name.lower()
+
+
+def short_class_name(clazz):
+    return clazz.split('.')[-1]
+
+
+def keyspace_from_row(row):
+    if hasattr(row, 'replication'):
+        replication = dict(row.replication)
+        clazz = replication.pop('class')
+    else:
+        replication = json.loads(row.strategy_options)
+        clazz = row.strategy_class
+    return {'class': short_class_name(clazz), 'replication': replication, 'durable_writes': row.durable_writes}
+
+
+def connected_release_version(module, cluster):
+    """
+    Returns the release_version of the connected node, which the driver read from system.local and system.peers
+    while connecting, so no query is needed. If the node is not found by its address the version is only used if
+    all nodes agree on it. Returns None with the native client and the broker, they do not read it.
+    """
+    metadata = getattr(cluster, 'metadata', None)
+    if metadata is None or not hasattr(metadata, 'all_hosts'):
+        return None
+    versions = {}
+    for host in metadata.all_hosts():
+        if getattr(host, 'release_version', None):
+            versions[host.address] = host.release_version
+    host = connection_host(module)
+    if host in versions:
+        return versions[host]
+    if len(set(versions.values())) == 1:
+        return list(versions.values())[0]
+    return None
+
+
+def read_keyspaces(session, keyspace_names=None, release_version=None):
+    """
+    Returns a dict mapping the keyspaces to the short name of their replication 'class', the 'replication'
+    options and 'durable_writes', read with a single query. Without names all keyspaces are read.
+    Cassandra 3.0 moved the keyspaces from system.schema_keyspaces to system_schema.keyspaces. The table is
+    taken from the release_version if it is known, otherwise the first one that exists is remembered for the session.
+    """
+    if release_version is not None:
+        keyspace_layouts[session] = 0 if major_version(release_version) >= 3 else 1
+    first = keyspace_layouts.get(session, 0)
+    for index in range(first, len(KEYSPACE_TABLES)):
+        table, columns = KEYSPACE_TABLES[index]
+        query = 'SELECT {0} FROM {1}'.format(columns, table)
+        parameters = None
+        if keyspace_names is not None:
+            query += ' WHERE keyspace_name IN %s'
+            parameters = [tuple(keyspace_names)]
+        try:
+            rows = session.execute(create_statement(query, idempotent=True), parameters)
+        except cassandra_errors('InvalidRequest'):
+            # the table does not exist in this version of Cassandra
+            continue
+        keyspace_layouts[session] = index
+        return dict((row.keyspace_name, keyspace_from_row(row)) for row in rows)
+    raise cassandra_native.InvalidRequest('no table with the keyspaces found')
+
+
+def schema_versions(session):
+    """Returns the distinct schema versions known to the connected node for itself and all of its peers."""
+    versions = set()
+    for row in session.execute("SELECT schema_version FROM system.local WHERE key = 'local'"):
+        versions.add(row.schema_version)
+    for row in session.execute("SELECT schema_version FROM system.peers"):
+        if row.schema_version is not None:
+            versions.add(row.schema_version)
+    return versions
+
+
+def connect_for_schema_changes(module):
+    """
+    Connects like connect for modules that change the schema. The driver does not wait for schema agreement after
+    every statement, the module calls wait_for_schema_agreement once after all of them instead.
+    """
+    return connect(module, max_schema_agreement_wait=0)
+
+
+def wait_for_schema_agreement(session, timeout):
+    """
+    Waits until all nodes report the same schema version or the timeout expired.
+    Returns a dict telling if the schema agreed and how many seconds the wait took.
+    The wait is recorded as schema_agreement if the session is profiled.
+    """
+    start = time.time()
+    agreed = len(schema_versions(session)) <= 1
+    while not agreed and time.time() - start < timeout:
+        time.sleep(SCHEMA_AGREEMENT_POLL_INTERVAL)
+        agreed = len(schema_versions(session)) <= 1
+    record_timing(session, 'schema_agreement', time.time() - start)
+    return dict(agreed=agreed, seconds=round(time.time() - start, 3))
+
+
+def record_timing(session, name, duration):
+    """Records an additional timing if the session is profiled."""
+    if isinstance(session, ProfilingSession):
+        session.profiler.record(name, duration)
+
+
+class ClusterFailed(Exception):
+    """Raised instead of exiting when the reconciliation of one of several clusters failed."""
+
+    def __init__(self, result):
+        Exception.__init__(self, result.get('msg'))
+        self.result = result
+
+
+class ClusterTarget(object):
+    """
+    Stands in for the module while one entry of 'clusters' is reconciled. The parameters of the module are
+    overridden with the options of the entry and failing does not exit the module, so the other clusters go on.
+    """
+
+    def __init__(self, module, name, params):
+        self.module = module
+        self.name = name
+        self.params = params
+        self.connection = None
+        self.profiler = None
+
+    def __getattr__(self, name):
+        return getattr(self.module, name)
+
+    def fail_json(self, **kwargs):
+        raise ClusterFailed(kwargs)
+
+    def exit_json(self, **kwargs):
+        raise ClusterFailed(dict(kwargs, msg='module exited while reconciling cluster {0}'.format(self.name)))
+
+
+def cluster_targets(module):
+    """Returns a ClusterTarget for every entry of the 'clusters' option. Fails on invalid entries."""
+    spec = cassandra_argument_spec()
+    targets = []
+    names = set()
+    for entry in module.params['clusters']:
+        if not isinstance(entry, dict):
+            module.fail_json(msg="Every entry of clusters needs to be a dictionary with the connection options.")
+        params = dict(module.params)
+        params['clusters'] = None
+        if entry.get('db_host') is not None and entry.get('db_hosts') is None:
+            # the hosts of the module are not hosts of this cluster
+            params['db_hosts'] = None
+        for key, value in entry.items():
+            if key == 'name' or value is None:
+                continue
+            if key not in CLUSTER_OPTIONS:
+                module.fail_json(msg="Invalid option {0} in clusters, valid options are name, {1}.".format(
+                    key, ', '.join(CLUSTER_OPTIONS)))
+            try:
+                if spec[key].get('type') == 'int':
+                    value = int(value)
+                elif spec[key].get('type') == 'float':
+                    value = float(value)
+                elif spec[key].get('type') == 'list' and not isinstance(value, list):
+                    value = [item.strip() for item in str(value).split(',')]
+            except (TypeError, ValueError):
+                module.fail_json(msg="Invalid value {0} for {1} in clusters.".format(value, key))
+            if 'choices' in spec[key] and value not in spec[key]['choices']:
+                module.fail_json(msg="Invalid value {0} for {1} in clusters.".format(value, key))
+            params[key] = value
+        name = entry.get('name')
+        if name is None:
+            name = params['db_hosts'][0] if params.get('db_hosts') else params['db_host']
+        if name in names:
+            module.fail_json(msg="Cluster {0} is listed more than once.".format(name))
+        names.add(name)
+        targets.append(ClusterTarget(module, name, params))
+    return targets
+
+
+def reconcile_clusters(module, reconcile):
+    """
+    Calls reconcile with a ClusterTarget for every entry of the 'clusters' option, at most cluster_concurrency at
+    the same time. Returns the results in the order of the entries, each with the name of its 'cluster'.
+    An error only fails the result of its own cluster.
+    """
+    targets = cluster_targets(module)
+
+    def reconcile_target(target):
+        try:
+            result = reconcile(target)
+        except ClusterFailed as failure:
+            result = dict(failure.result, failed=True)
+        except Exception as error:
+            result = dict(failed=True, msg=str(error))
+        result['cluster'] = target.name
+        if target.connection is not None:
+            result['connection'] = target.connection
+        if target.profiler is not None and 'timings' not in result:
+            result['timings'] = target.profiler.report()
+        return result
+
+    if len(targets) == 0:
+        return []
+    # imported here, it takes a noticeable part of the start of every module
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(module.params['cluster_concurrency'], len(targets)))
+    try:
+        return pool.map(reconcile_target, targets)
+    finally:
+        pool.close()
@@ -0,0 +1,134 @@
+# Fingerprints of the desired state that cassandra_user and cassandra_keyspace keep in a bookkeeping table.
+#
+# Every managed object gets a row with a salted hash of the desired state it was last reconciled with and the
+# schema version of the cluster at that time. When all objects of a task have a row whose fingerprint matches
+# their desired state and the schema version did not change since, the task changes nothing and the module
+# returns after reading one partition of the table. A missing row, another desired state or a newer schema
+# version fall back to the full reconciliation, which writes the fingerprints anew.
+#
+# The fingerprints are PBKDF2 hashes with a random salt per row, so the passwords of the users cannot be read
+# from the table.
+
+import binascii
+import hashlib
+import json
+import os
+import re
+
+from ansible.module_utils.cassandra_common import (cassandra_errors, create_statement,
+                                                   execute_concurrent_statements, wait_for_schema_agreement)
+
+# desired states with a password are hashed with many iterations, the others only need to be compared
+FINGERPRINT_ITERATIONS = 10000
+FINGERPRINT_CONCURRENCY = 10
+TABLE_NAME = re.compile(r'^\w+\.\w+$')
+
+
+def fingerprint_table(module):
+    """Returns the bookkeeping table of the module as keyspace.table, or None if fingerprints are not used."""
+    table = module.params['fingerprint_table']
+    if table is None:
+        return None
+    if not TABLE_NAME.match(table):
+        module.fail_json(msg="Invalid fingerprint_table {0}, it needs to be given as keyspace.table.".format(table))
+    return table.lower()
+
+
+def state_fingerprint(state, salt=None, iterations=None):
+    """
+    Returns the fingerprint of a desired state as 'pbkdf2_sha256$iterations$salt$hash'.
+    A new random salt is used unless the salt of a stored fingerprint is given to compare with it.
+    """
+    if salt is None:
+        salt = os.urandom(16)
+    if iterations is None:
+        iterations = FINGERPRINT_ITERATIONS if state.get('password') is not None else 1
+    text = json.dumps(state, sort_keys=True).encode('utf-8')
+    digest = hashlib.pbkdf2_hmac('sha256', text, salt, iterations)
+    return 'pbkdf2_sha256${0}${1}${2}'.format(iterations, binascii.hexlify(salt).decode('ascii'),
+                                              binascii.hexlify(digest).decode('ascii'))
+
+
+def fingerprint_matches(stored, state):
+    """Tells if a stored fingerprint was taken of the same desired state."""
+    try:
+        algorithm, iterations, salt, digest = stored.split('$')
+        if algorithm != 'pbkdf2_sha256':
+            return False
+        return state_fingerprint(state, binascii.unhexlify(salt), int(iterations)) == stored
+    except (AttributeError, TypeError, ValueError):
+        return False
+
+
+def local_schema_version(session):
+    row = list(session.execute("SELECT schema_version FROM system.local WHERE key = 'local'"))[0]
+    return str(row.schema_version)
+
+
+def check_fingerprints(session, table, kind, states):
+    """
+    Reads the schema version and the fingerprints of the desired states, a dict mapping the names of the objects
+    to their state, from the partition of the kind of object. Returns a dict telling whether all fingerprints
+    'matched', which ones are 'missing' or 'stale', the 'schema_version' and whether the table 'exists'.
+    """
+    schema_version = local_schema_version(session)
+    check = dict(matched=False, missing=[], stale=[], schema_version=schema_version, exists=True)
+    try:
+        rows = session.execute(create_statement("SELECT name, fingerprint, schema_version FROM " + table +
+                                                " WHERE kind = %s AND name IN %s", idempotent=True),
+                               [kind, tuple(sorted(states))])
+    except cassandra_errors('InvalidRequest'):
+        # the table is created when the first fingerprints are stored
+        check['exists'] = False
+        check['missing'] = sorted(states)
+        return check
+    stored = dict((row.name, row) for row in rows)
+    for name in sorted(states):
+        if name not in stored:
+            check['missing'].append(name)
+        elif stored[name].schema_version != schema_version or \
+                not fingerprint_matches(stored[name].fingerprint, states[name]):
+            check['stale'].append(name)
+    check['matched'] = len(check['missing']) == 0 and len(check['stale']) == 0
+    return check
+
+
+def store_fingerprints(session, table, kind, states, check, schema_changed=False, schema_agreement_timeout=10):
+    """
+    Writes the fingerprints of the desired states after they were reconciled. The schema version read by
+    check_fingerprints is stored, unless the schema was changed since, by the module or by creating the table.
+    Returns the names of the objects whose fingerprint could not be written.
+    """
+    if not check['exists']:
+        session.execute("CREATE TABLE IF NOT EXISTS " + table + " (kind text, name text, fingerprint text, "
+                        "schema_version text, PRIMARY KEY (kind, name))")
+        wait_for_schema_agreement(session, schema_agreement_timeout)
+        schema_changed = True
+    schema_version = local_schema_version(session) if schema_changed else check['schema_version']
+
+    names = sorted(states)
+    statements = [(create_statement("INSERT INTO " + table + " (kind, name, fingerprint, schema_version) "
+                                    "VALUES (%s, %s, %s, %s)"),
+                   (kind, name, state_fingerprint(states[name]), schema_version)) for name in names]
+    outcomes = execute_concurrent_statements(session, statements, FINGERPRINT_CONCURRENCY)
+    return [name for name, (success, outcome) in zip(names, outcomes) if not success]
+
+
+def update_fingerprints(module, session, table, kind, states, check, schema_changed=False):
+    """
+    Stores the fingerprints of the reconciled states, unless in check mode, and returns the 'fingerprints' entry
+    of the result. Failing to store them does not fail the module, the next run reconciles everything again.
+    """
+    report = dict(matched=False, missing=check['missing'], stale=check['stale'])
+    if module.check_mode or len(states) == 0:
+        return report
+    try:
+        failed = store_fingerprints(session, table, kind, states, check, schema_changed,
+                                    module.params.get('schema_agreement_timeout', 10))
+    except Exception as error:
+        report['error'] = str(error)
+        return report
+    report['stored'] = len(states) - len(failed)
+    if len(failed) > 0:
+        report['error'] = 'The fingerprints of {0} could not be stored.'.format(', '.join(failed))
+    return report
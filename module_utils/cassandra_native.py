@@ -0,0 +1,602 @@
+# A small client for the CQL native protocol, versions 3 and 4, that only depends on the standard library.
+#
+# It covers what the modules need: STARTUP, SASL PLAIN authentication, QUERY with bound values and paged results.
+# Importing the DataStax driver takes longer than most module runs, and the driver has to be installed on every
+# host the modules run on. With the 'native' driver option the modules use this client instead.
+#
+# There is no connection pool, no load balancing, no prepared statements and no compression. The session opens
+# a single connection to one host. Several statements can be in flight at the same time on that connection
+# (see NativeSession.execute_concurrent), but the session is used by one thread at a time.
+
+import datetime
+import decimal
+import socket
+import struct
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+CQL_VERSION = '3.0.0'
+PROTOCOL_VERSIONS = [3, 4]
+CONNECT_TIMEOUT = 5
+REQUEST_TIMEOUT = 10
+DEFAULT_FETCH_SIZE = 5000
+MAX_STREAMS = 32768
+
+HEADER = struct.Struct('>BBhBi')
+
+# opcodes
+ERROR = 0x00
+STARTUP = 0x01
+READY = 0x02
+AUTHENTICATE = 0x03
+QUERY = 0x07
+RESULT = 0x08
+AUTH_CHALLENGE = 0x0E
+AUTH_RESPONSE = 0x0F
+AUTH_SUCCESS = 0x10
+
+# flags of frames
+TRACING_FLAG = 0x02
+CUSTOM_PAYLOAD_FLAG = 0x04
+WARNING_FLAG = 0x08
+
+# flags of QUERY messages
+VALUES_FLAG = 0x01
+PAGE_SIZE_FLAG = 0x04
+PAGING_STATE_FLAG = 0x08
+
+# kinds of RESULT messages
+ROWS_RESULT = 0x0002
+
+# flags of the metadata of rows
+GLOBAL_TABLES_SPEC_FLAG = 0x0001
+HAS_MORE_PAGES_FLAG = 0x0002
+NO_METADATA_FLAG = 0x0004
+
+CONSISTENCY_LEVELS = dict(ANY=0, ONE=1, TWO=2, THREE=3, QUORUM=4, ALL=5, LOCAL_QUORUM=6, EACH_QUORUM=7, SERIAL=8,
+                          LOCAL_SERIAL=9, LOCAL_ONE=10)
+
+# Statements whose values can be bound. All others take the values as literals, like the driver renders them.
+BINDABLE_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+
+class NativeError(Exception):
+    pass
+
+
+class NoHostAvailable(NativeError):
+    pass
+
+
+class OperationTimedOut(NativeError):
+    pass
+
+
+class RequestError(NativeError):
+    """An ERROR message of the server. The errors the modules handle have their own classes, named like in the driver."""
+
+    def __init__(self, message, code=None):
+        NativeError.__init__(self, message)
+        self.code = code
+
+
+class AuthenticationFailed(RequestError):
+    pass
+
+
+class Unauthorized(RequestError):
+    pass
+
+
+class InvalidRequest(RequestError):
+    pass
+
+
+class AlreadyExists(RequestError):
+    pass
+
+
+ERROR_NAMES = {
+    0x0000: 'Server error', 0x000A: 'Protocol error', 0x0100: 'Bad credentials', 0x1000: 'Unavailable exception',
+    0x1001: 'Overloaded', 0x1002: 'Is bootstrapping', 0x1003: 'Truncate error', 0x1100: 'Write timeout',
+    0x1200: 'Read timeout', 0x1300: 'Read failure', 0x1400: 'Function failure', 0x1500: 'Write failure',
+    0x2000: 'Syntax error', 0x2100: 'Unauthorized', 0x2200: 'Invalid query', 0x2300: 'Config error',
+    0x2400: 'Already exists', 0x2500: 'Unprepared query'
+}
+
+ERROR_CLASSES = {0x0100: AuthenticationFailed, 0x2100: Unauthorized, 0x2200: InvalidRequest, 0x2400: AlreadyExists}
+
+# The errors by name, to raise the same error for an error the broker reported
+ERRORS = dict((error.__name__, error) for error in [NativeError, NoHostAvailable, OperationTimedOut, RequestError,
+                                                      AuthenticationFailed, Unauthorized, InvalidRequest,
+                                                      AlreadyExists])
+
+
+class Statement(object):
+    """Stands in for the driver's SimpleStatement when the driver is not used."""
+
+    def __init__(self, query_string, fetch_size=None, is_idempotent=False, consistency_level=None):
+        self.query_string = query_string
+        self.fetch_size = fetch_size
+        self.is_idempotent = is_idempotent
+        self.consistency_level = consistency_level
+
+
+# encoding
+
+def encode_string(value):
+    value = value.encode('utf-8')
+    return struct.pack('>H', len(value)) + value
+
+
+def encode_long_string(value):
+    value = value.encode('utf-8')
+    return struct.pack('>i', len(value)) + value
+
+
+def encode_bytes(value):
+    if value is None:
+        return struct.pack('>i', -1)
+    return struct.pack('>i', len(value)) + value
+
+
+def encode_string_map(values):
+    body = struct.pack('>H', len(values))
+    for key, value in sorted(values.items()):
+        body += encode_string(key) + encode_string(value)
+    return body
+
+
+def bindable(value):
+    """Values that can be sent without knowing the type of the column: text, booleans, uuids and collections of them."""
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return all(bindable(item) and not isinstance(item, (list, tuple, set, frozenset)) for item in value)
+    return isinstance(value, (str, bool, uuid.UUID)) or value is None or type(value).__name__ == 'unicode'
+
+
+def encode_value(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return b'\x01' if value else b'\x00'
+    if isinstance(value, uuid.UUID):
+        return value.bytes
+    if isinstance(value, (list, tuple, set, frozenset)):
+        body = struct.pack('>i', len(value))
+        for item in value:
+            body += encode_bytes(encode_value(item))
+        return body
+    return value.encode('utf-8')
+
+
+def cql_literal(value):
+    """Renders a value as CQL literal like the driver does for statements that are not prepared."""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float, decimal.Decimal)) or type(value).__name__ == 'long':
+        return repr(value) if isinstance(value, float) else str(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, bytearray):
+        return '0x' + ''.join('{0:02x}'.format(byte) for byte in value)
+    if isinstance(value, datetime.datetime):
+        return str(int(time_value(value) * 1000))
+    if isinstance(value, datetime.date):
+        return "'" + value.isoformat() + "'"
+    if isinstance(value, dict):
+        return '{' + ', '.join(cql_literal(key) + ': ' + cql_literal(item) for key, item in value.items()) + '}'
+    if isinstance(value, (set, frozenset)):
+        return '{' + ', '.join(cql_literal(item) for item in value) + '}'
+    if isinstance(value, list):
+        return '[' + ', '.join(cql_literal(item) for item in value) + ']'
+    if isinstance(value, tuple):
+        return '(' + ', '.join(cql_literal(item) for item in value) + ')'
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def time_value(value):
+    epoch = datetime.datetime(1970, 1, 1, tzinfo=value.tzinfo)
+    return (value - epoch).total_seconds()
+
+
+def bind(query, parameters):
+    """
+    Returns the query with bind markers and the encoded values.
+    Only values whose type is clear from the value alone are bound, and only in statements that accept bind markers.
+    Otherwise the values are inserted as literals and no values are returned.
+    """
+    if not parameters:
+        return query, None
+    parameters = list(parameters)
+    if query.lstrip().split(' ')[0].upper() in BINDABLE_STATEMENTS and all(bindable(value) for value in parameters):
+        return query % tuple('?' for value in parameters), [encode_value(value) for value in parameters]
+    return query % tuple(cql_literal(value) for value in parameters), None
+
+
+def query_message(query, values, consistency, fetch_size, paging_state=None):
+    flags = PAGE_SIZE_FLAG
+    if values is not None:
+        flags |= VALUES_FLAG
+    if paging_state is not None:
+        flags |= PAGING_STATE_FLAG
+    body = encode_long_string(query) + struct.pack('>HB', consistency, flags)
+    if values is not None:
+        body += struct.pack('>H', len(values))
+        for value in values:
+            body += encode_bytes(value)
+    body += struct.pack('>i', fetch_size)
+    if paging_state is not None:
+        body += encode_bytes(paging_state)
+    return body
+
+
+# decoding
+
+class Reader(object):
+
+    def __init__(self, body):
+        self.body = body
+        self.position = 0
+
+    def read(self, length):
+        data = self.body[self.position:self.position + length]
+        if len(data) < length:
+            raise NativeError('The server sent an incomplete message.')
+        self.position += length
+        return data
+
+    def unpack(self, fmt):
+        return struct.unpack(fmt, self.read(struct.calcsize(fmt)))[0]
+
+    def read_int(self):
+        return self.unpack('>i')
+
+    def read_short(self):
+        return self.unpack('>H')
+
+    def read_string(self):
+        return self.read(self.read_short()).decode('utf-8')
+
+    def read_long_string(self):
+        return self.read(self.read_int()).decode('utf-8')
+
+    def read_bytes(self):
+        length = self.read_int()
+        if length < 0:
+            return None
+        return self.read(length)
+
+    def read_short_bytes(self):
+        return self.read(self.read_short())
+
+    def read_string_list(self):
+        return [self.read_string() for index in range(self.read_short())]
+
+    def read_bytes_map(self):
+        return dict((self.read_string(), self.read_bytes()) for index in range(self.read_short()))
+
+    def read_type(self):
+        type_id = self.read_short()
+        if type_id == 0x0000:
+            return ('custom', self.read_string())
+        if type_id in (0x0020, 0x0022):
+            return (TYPE_NAMES[type_id], self.read_type())
+        if type_id == 0x0021:
+            return ('map', self.read_type(), self.read_type())
+        if type_id == 0x0030:
+            self.read_string()  # the keyspace of the type
+            name = self.read_string()
+            fields = [(self.read_string(), self.read_type()) for index in range(self.read_short())]
+            return ('udt', name, fields)
+        if type_id == 0x0031:
+            return ('tuple', [self.read_type() for index in range(self.read_short())])
+        if type_id not in TYPE_NAMES:
+            raise NativeError('Unknown column type 0x{0:04x}'.format(type_id))
+        return (TYPE_NAMES[type_id],)
+
+
+TYPE_NAMES = {
+    0x0001: 'ascii', 0x0002: 'bigint', 0x0003: 'blob', 0x0004: 'boolean', 0x0005: 'counter', 0x0006: 'decimal',
+    0x0007: 'double', 0x0008: 'float', 0x0009: 'int', 0x000B: 'timestamp', 0x000C: 'uuid', 0x000D: 'varchar',
+    0x000E: 'varint', 0x000F: 'timeuuid', 0x0010: 'inet', 0x0011: 'date', 0x0012: 'time', 0x0013: 'smallint',
+    0x0014: 'tinyint', 0x0015: 'duration', 0x0020: 'list', 0x0022: 'set'
+}
+
+
+def decode_varint(data):
+    value = 0
+    for byte in bytearray(data):
+        value = (value << 8) | byte
+    if data and bytearray(data)[0] & 0x80:
+        value -= 1 << (len(data) * 8)
+    return value
+
+
+def decode_inet(data):
+    if len(data) == 4:
+        return socket.inet_ntop(socket.AF_INET, data)
+    return socket.inet_ntop(socket.AF_INET6, data)
+
+
+SIMPLE_DECODERS = {
+    'ascii': lambda data: data.decode('ascii'),
+    'varchar': lambda data: data.decode('utf-8'),
+    'blob': bytearray,
+    'custom': bytearray,
+    'boolean': lambda data: data != b'\x00',
+    'bigint': lambda data: struct.unpack('>q', data)[0],
+    'counter': lambda data: struct.unpack('>q', data)[0],
+    'int': lambda data: struct.unpack('>i', data)[0],
+    'smallint': lambda data: struct.unpack('>h', data)[0],
+    'tinyint': lambda data: struct.unpack('>b', data)[0],
+    'double': lambda data: struct.unpack('>d', data)[0],
+    'float': lambda data: struct.unpack('>f', data)[0],
+    'varint': decode_varint,
+    'decimal': lambda data: decimal.Decimal(decode_varint(data[4:])).scaleb(-struct.unpack('>i', data[:4])[0]),
+    'uuid': lambda data: uuid.UUID(bytes=data),
+    'timeuuid': lambda data: uuid.UUID(bytes=data),
+    'timestamp': lambda data: datetime.datetime(1970, 1, 1) + datetime.timedelta(
+        milliseconds=struct.unpack('>q', data)[0]),
+    'date': lambda data: datetime.date(1970, 1, 1) + datetime.timedelta(days=struct.unpack('>I', data)[0] - 2 ** 31),
+    'time': lambda data: struct.unpack('>q', data)[0],
+    'inet': decode_inet,
+    'duration': bytearray
+}
+
+
+def decode_value(cql_type, data):
+    if data is None:
+        return None
+    name = cql_type[0]
+    if name in SIMPLE_DECODERS:
+        return SIMPLE_DECODERS[name](data)
+    reader = Reader(data)
+    if name in ('list', 'set'):
+        items = [decode_value(cql_type[1], reader.read_bytes()) for index in range(reader.read_int())]
+        return items if name == 'list' else set(items)
+    if name == 'map':
+        return dict((decode_value(cql_type[1], reader.read_bytes()), decode_value(cql_type[2], reader.read_bytes()))
+                    for index in range(reader.read_int()))
+    if name == 'tuple':
+        return tuple(decode_value(item_type, reader.read_bytes()) if reader.position < len(data) else None
+                     for item_type in cql_type[1])
+    # a user defined type; fields added later may be missing in older values
+    values = dict((field, decode_value(field_type, reader.read_bytes()) if reader.position < len(data) else None)
+                  for field, field_type in cql_type[2])
+    return namedtuple(cql_type[1], [field for field, field_type in cql_type[2]], rename=True)(
+        *[values[field] for field, field_type in cql_type[2]])
+
+
+row_classes = {}
+
+
+def row_class(columns):
+    columns = tuple(columns)
+    if columns not in row_classes:
+        row_classes[columns] = namedtuple('Row', columns, rename=True)
+    return row_classes[columns]
+
+
+def decode_rows(reader):
+    """Returns the rows of a RESULT message and the paging state if there are more pages."""
+    flags = reader.read_int()
+    column_count = reader.read_int()
+    paging_state = reader.read_bytes() if flags & HAS_MORE_PAGES_FLAG else None
+    if flags & NO_METADATA_FLAG:
+        raise NativeError('The server sent rows without metadata.')
+    if flags & GLOBAL_TABLES_SPEC_FLAG:
+        reader.read_string()
+        reader.read_string()
+    columns = []
+    for index in range(column_count):
+        if not flags & GLOBAL_TABLES_SPEC_FLAG:
+            reader.read_string()
+            reader.read_string()
+        columns.append((reader.read_string(), reader.read_type()))
+
+    Row = row_class([name for name, cql_type in columns])
+    rows = []
+    for index in range(reader.read_int()):
+        rows.append(Row(*[decode_value(cql_type, reader.read_bytes()) for name, cql_type in columns]))
+    return rows, paging_state
+
+
+def decode_error(body):
+    reader = Reader(body)
+    code = reader.read_int()
+    message = 'Error from server: code={0:04x} [{1}] message="{2}"'.format(
+        code, ERROR_NAMES.get(code, 'Unknown error'), reader.read_string())
+    return ERROR_CLASSES.get(code, RequestError)(message, code)
+
+
+class ResultSet(object):
+    """
+    The rows of a statement. Iterating over it fetches the further pages when they are needed,
+    the rows of the page fetched last are in current_rows.
+    """
+
+    def __init__(self, session, page, rows, paging_state):
+        self.session = session
+        self.page = page
+        self.current_rows = rows
+        self.paging_state = paging_state
+
+    @property
+    def has_more_pages(self):
+        return self.paging_state is not None
+
+    def fetch_next_page(self):
+        self.current_rows, self.paging_state = self.session.fetch_page(self.page, self.paging_state)
+
+    def __iter__(self):
+        while True:
+            for row in self.current_rows:
+                yield row
+            if not self.has_more_pages:
+                break
+            self.fetch_next_page()
+
+    def __getitem__(self, index):
+        # like the driver, indexing fetches all pages first
+        if self.has_more_pages:
+            self.current_rows = list(self)
+            self.paging_state = None
+        return self.current_rows[index]
+
+    def one(self):
+        return self.current_rows[0] if self.current_rows else None
+
+
+class NativeSession(object):
+    """One connection to one host, authenticated with SASL PLAIN if the server requires it."""
+
+    def __init__(self, host, port=9042, protocol_version=4, username=None, password=None, consistency='QUORUM',
+                 connect_timeout=CONNECT_TIMEOUT, request_timeout=REQUEST_TIMEOUT, profiler=None):
+        if protocol_version not in PROTOCOL_VERSIONS:
+            raise NativeError('The native driver supports the protocol versions {0}, not {1}.'.format(
+                ' and '.join(str(version) for version in PROTOCOL_VERSIONS), protocol_version))
+        self.host = host
+        self.protocol_version = protocol_version
+        self.consistency = CONSISTENCY_LEVELS[consistency]
+        self.request_timeout = request_timeout
+        self.lock = threading.Lock()
+        self.buffer = b''
+        try:
+            self.sock = socket.create_connection((host, port), timeout=connect_timeout)
+        except (socket.error, socket.timeout) as error:
+            raise NoHostAvailable('Unable to connect to {0}:{1}: {2}'.format(host, port, error))
+        try:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.startup(username, password, profiler)
+            self.sock.settimeout(request_timeout)
+        except Exception:
+            self.sock.close()
+            raise
+
+    def startup(self, username, password, profiler):
+        opcode, body = self.request(STARTUP, encode_string_map(dict(CQL_VERSION=CQL_VERSION)))
+        if opcode == READY:
+            return
+        if opcode != AUTHENTICATE:
+            raise NativeError('Unexpected response 0x{0:02x} to STARTUP.'.format(opcode))
+        if username is None or password is None:
+            raise AuthenticationFailed('{0} requires authentication, but no credentials were given.'.format(self.host))
+
+        start = time.time()
+        token = b'\x00' + username.encode('utf-8') + b'\x00' + password.encode('utf-8')
+        opcode, body = self.request(AUTH_RESPONSE, encode_bytes(token))
+        if opcode != AUTH_SUCCESS:
+            raise AuthenticationFailed('Unexpected response 0x{0:02x} to the credentials.'.format(opcode))
+        if profiler is not None:
+            profiler.record('auth', time.time() - start)
+
+    # frames
+
+    def send(self, opcode, body, stream=0):
+        self.sock.sendall(HEADER.pack(self.protocol_version, 0, stream, opcode, len(body)) + body)
+
+    def receive_exactly(self, length):
+        while len(self.buffer) < length:
+            try:
+                data = self.sock.recv(max(65536, length - len(self.buffer)))
+            except socket.timeout:
+                raise OperationTimedOut('{0} did not respond within {1} seconds.'.format(
+                    self.host, self.request_timeout))
+            if not data:
+                raise NativeError('{0} closed the connection.'.format(self.host))
+            self.buffer += data
+        data = self.buffer[:length]
+        self.buffer = self.buffer[length:]
+        return data
+
+    def receive(self):
+        """Returns the stream, the opcode and the body of the next frame. ERROR messages are returned as exceptions."""
+        version, flags, stream, opcode, length = HEADER.unpack(self.receive_exactly(HEADER.size))
+        reader = Reader(self.receive_exactly(length))
+        if flags & TRACING_FLAG:
+            reader.read(16)
+        if flags & WARNING_FLAG:
+            reader.read_string_list()
+        if flags & CUSTOM_PAYLOAD_FLAG:
+            reader.read_bytes_map()
+        body = reader.body[reader.position:]
+        if opcode == ERROR:
+            return stream, opcode, decode_error(body)
+        return stream, opcode, body
+
+    def request(self, opcode, body):
+        self.send(opcode, body)
+        stream, opcode, body = self.receive()
+        if isinstance(body, Exception):
+            raise body
+        return opcode, body
+
+    # statements
+
+    def page(self, statement, parameters):
+        """Returns what is needed to request the pages of a statement: the query, values, consistency and page size."""
+        query, values = bind(getattr(statement, 'query_string', statement), parameters)
+        consistency = getattr(statement, 'consistency_level', None)
+        if consistency is None:
+            consistency = self.consistency
+        fetch_size = getattr(statement, 'fetch_size', None)
+        if not isinstance(fetch_size, int) or fetch_size <= 0:
+            # also the placeholder of the driver's statements for an unset fetch size
+            fetch_size = DEFAULT_FETCH_SIZE
+        return query, values, consistency, fetch_size
+
+    def result(self, page, body):
+        if isinstance(body, Exception):
+            raise body
+        reader = Reader(body)
+        if reader.read_int() != ROWS_RESULT:
+            return ResultSet(self, page, [], None)
+        rows, paging_state = decode_rows(reader)
+        return ResultSet(self, page, rows, paging_state)
+
+    def fetch_page(self, page, paging_state=None):
+        with self.lock:
+            opcode, body = self.request(QUERY, query_message(*page, paging_state=paging_state))
+        result = self.result(page, body)
+        return result.current_rows, result.paging_state
+
+    def execute(self, statement, parameters=None):
+        page = self.page(statement, parameters)
+        with self.lock:
+            opcode, body = self.request(QUERY, query_message(*page))
+        return self.result(page, body)
+
+    def execute_concurrent(self, statements_and_parameters, concurrency=100, raise_on_first_error=True):
+        """
+        Sends up to concurrency statements before reading their responses and returns (success, result) tuples.
+        Further pages of the results are fetched when the rows are iterated.
+        """
+        pages = [self.page(statement, parameters) for statement, parameters in statements_and_parameters]
+        concurrency = max(1, min(concurrency, MAX_STREAMS - 1))
+        responses = [None] * len(pages)
+        with self.lock:
+            for first in range(0, len(pages), concurrency):
+                batch = pages[first:first + concurrency]
+                self.sock.sendall(b''.join(
+                    HEADER.pack(self.protocol_version, 0, stream + 1, QUERY, len(body)) + body
+                    for stream, body in enumerate(query_message(*page) for page in batch)))
+                for index in range(len(batch)):
+                    stream, opcode, body = self.receive()
+                    responses[first + stream - 1] = body
+
+        results = []
+        for page, body in zip(pages, responses):
+            try:
+                results.append((True, self.result(page, body)))
+            except RequestError as error:
+                if raise_on_first_error:
+                    raise
+                results.append((False, error))
+        return results
+
+    def shutdown(self):
+        self.sock.close()
@@ -0,0 +1,214 @@
+# Optional profiling of module runs: how long connecting, authenticating, every statement and the schema
+# agreement took and, if requested, the server side trace of every statement.
+
+import threading
+import time
+
+TRACE_MAX_WAIT = 2.0
+
+# The auth provider of the driver that records the time of the authentication, defined once the driver is loaded
+TimingAuthProvider = None
+
+
+def seconds(value):
+    """Converts the timedelta values of traces to seconds."""
+    if value is None:
+        return None
+    if hasattr(value, 'total_seconds'):
+        return round(value.total_seconds(), 6)
+    return round(value, 6)
+
+
+class Profiler(object):
+    """Collects the timings of one module run."""
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.started = time.time()
+        self.timings = dict(connect=None, auth=None, schema_agreement=None)
+        self.statements = []
+        self.statement_types = {}
+
+    def record(self, name, duration):
+        self.timings[name] = round(duration, 6)
+
+    def count(self, query):
+        statement_type = query.split(' ')[0].upper()
+        self.statement_types[statement_type] = self.statement_types.get(statement_type, 0) + 1
+
+    def record_statement(self, query, duration, error=None, trace=None):
+        self.count(query)
+        entry = dict(statement=query, seconds=round(duration, 6))
+        if error is not None:
+            entry['error'] = error
+        if trace is not None:
+            entry['trace'] = trace
+        self.statements.append(entry)
+
+    def report(self):
+        report = dict(self.timings)
+        report['statements'] = self.statements
+        report['statement_count'] = sum(self.statement_types.values())
+        report['statement_types'] = self.statement_types
+        report['total'] = round(time.time() - self.started, 6)
+        return report
+
+
+def timing_auth_provider(username, password, profiler):
+    """Returns an auth provider for the driver that records how long the authentication took."""
+    global TimingAuthProvider
+    if TimingAuthProvider is None:
+        TimingAuthProvider = define_timing_auth_provider()
+    return TimingAuthProvider(username, password, profiler)
+
+
+def define_timing_auth_provider():
+    from cassandra.auth import PlainTextAuthenticator, PlainTextAuthProvider
+
+    class TimingAuthenticator(PlainTextAuthenticator):
+        """Measures the time from the first credentials sent to the server until it accepted them."""
+
+        def __init__(self, username, password, profiler):
+            PlainTextAuthenticator.__init__(self, username, password)
+            self.profiler = profiler
+            self.started = None
+
+        def initial_response(self):
+            self.started = time.time()
+            return PlainTextAuthenticator.initial_response(self)
+
+        def on_authentication_success(self, token):
+            if self.started is not None:
+                self.profiler.record('auth', time.time() - self.started)
+            return PlainTextAuthenticator.on_authentication_success(self, token)
+
+    class TimingAuthProvider(PlainTextAuthProvider):
+
+        def __init__(self, username, password, profiler):
+            PlainTextAuthProvider.__init__(self, username, password)
+            self.profiler = profiler
+
+        def new_authenticator(self, host):
+            return TimingAuthenticator(self.username, self.password, self.profiler)
+
+    return TimingAuthProvider
+
+
+def query_string(statement):
+    return getattr(statement, 'query_string', statement)
+
+
+def describe_trace(trace):
+    return dict(coordinator=str(trace.coordinator), duration=seconds(trace.duration),
+                request_type=trace.request_type,
+                events=[dict(source=str(event.source), elapsed=seconds(event.source_elapsed),
+                             thread=event.thread_name, description=event.description) for event in trace.events])
+
+
+class ProfilingSession(object):
+    """
+    Wraps a session and records how long every statement took.
+    The time of a statement that returns several pages only covers the first page.
+    Traces are only available with the driver's own sessions.
+    """
+
+    def __init__(self, session, profiler):
+        self.session = session
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def traceable(self):
+        return self.profiler.trace and hasattr(self.session, 'execute_async')
+
+    def execute(self, statement, parameters=None):
+        start = time.time()
+        try:
+            if self.traceable():
+                result = self.session.execute(statement, parameters, trace=True)
+            else:
+                result = self.session.execute(statement, parameters)
+        except Exception as error:
+            self.profiler.record_statement(query_string(statement), time.time() - start, error=str(error))
+            raise
+        duration = time.time() - start
+
+        trace = None
+        if self.traceable():
+            try:
+                trace = describe_trace(result.get_query_trace(max_wait=TRACE_MAX_WAIT))
+            except Exception as error:
+                trace = dict(error=str(error))
+        self.profiler.record_statement(query_string(statement), duration, trace=trace)
+        return result
+
+    def execute_concurrent(self, statements_and_parameters, concurrency=100, raise_on_first_error=True):
+        """
+        Executes the statements like the wrapped session and records every one of them. The driver's sessions
+        execute them asynchronously with at most concurrency in flight, traced if requested. Other sessions
+        cannot time single statements of a batch, so their statements are executed one after the other.
+        """
+        if not hasattr(self.session, 'execute_async'):
+            results = []
+            for statement, parameters in statements_and_parameters:
+                try:
+                    results.append((True, self.execute(statement, parameters)))
+                except Exception as error:
+                    if raise_on_first_error:
+                        raise
+                    results.append((False, error))
+            return results
+
+        slots = threading.BoundedSemaphore(concurrency)
+        started = []
+        for statement, parameters in statements_and_parameters:
+            slots.acquire()
+            timing = dict(start=time.time(), end=None)
+
+            def finished(outcome, timing=timing):
+                timing['end'] = time.time()
+                slots.release()
+
+            future = self.session.execute_async(statement, parameters, trace=self.profiler.trace)
+            future.add_callbacks(finished, finished)
+            started.append((statement, future, timing))
+
+        results = []
+        for statement, future, timing in started:
+            try:
+                result = future.result()
+            except Exception as error:
+                self.profiler.record_statement(query_string(statement),
+                                               (timing['end'] or time.time()) - timing['start'], error=str(error))
+                if raise_on_first_error:
+                    raise
+                results.append((False, error))
+                continue
+            trace = None
+            if self.profiler.trace:
+                try:
+                    trace = describe_trace(future.get_query_trace(max_wait=TRACE_MAX_WAIT))
+                except Exception as error:
+                    trace = dict(error=str(error))
+            self.profiler.record_statement(query_string(statement), (timing['end'] or time.time()) - timing['start'],
+                                           trace=trace)
+            results.append((True, result))
+        return results
+
+
+def attach_profiler(module, profiler):
+    """Adds the report of the profiler as 'timings' to every result the module returns."""
+    exit_json = module.exit_json
+    fail_json = module.fail_json
+
+    def exit_with_timings(**kwargs):
+        kwargs['timings'] = profiler.report()
+        exit_json(**kwargs)
+
+    def fail_with_timings(**kwargs):
+        kwargs['timings'] = profiler.report()
+        fail_json(**kwargs)
+
+    module.exit_json = exit_with_timings
+    module.fail_json = fail_with_timings
@@ -0,0 +1,163 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'module_utils'))
+
+import cassandra_broker
+import fake_cassandra
+from cassandra_broker import BrokerError, BrokerSession, broker_alive, broker_session, serve
+
+Row = namedtuple('Row', ['name', 'super'])
+PidRow = namedtuple('PidRow', ['pid'])
+
+
+class InvalidRequest(Exception):
+    pass
+
+
+class FakeSession(object):
+    """Stands in for a Cassandra session and remembers all statements it executed."""
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, statement, parameters=None):
+        query = getattr(statement, 'query_string', statement)
+        self.executed.append((query, parameters))
+        if query == 'LIST USERS':
+            return [Row('cassandra', True), Row('testuser', False)]
+        if query == 'PID':
+            return [PidRow(os.getpid())]
+        if query.startswith('FAIL'):
+            raise InvalidRequest('unconfigured table')
+        return []
+
+
+class CassandraBrokerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.socket_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.socket_dir, 'broker.sock')
+        self.session = FakeSession()
+
+    def tearDown(self):
+        shutil.rmtree(self.socket_dir)
+
+    def start_server(self, ttl=60):
+        ready = threading.Event()
+        server = threading.Thread(target=serve, args=(self.socket_path, self.session, ttl, ready.set))
+        server.daemon = True
+        server.start()
+        self.assertTrue(ready.wait(5), 'broker did not start')
+        return server
+
+    def test_should_return_rows_with_named_columns(self):
+        self.start_server()
+        client = BrokerSession(self.socket_path)
+        rows = client.execute('LIST USERS')
+        client.shutdown()
+        self.assertEqual([(row.name, row.super) for row in rows], [('cassandra', True), ('testuser', False)])
+        self.assertEqual(len(rows.current_rows), 2)
+
+    def test_should_keep_tuples_apart_from_lists_in_parameters(self):
+        self.start_server()
+        client = BrokerSession(self.socket_path)
+        client.execute('SELECT * FROM t WHERE a = %s AND b IN %s', ['x', ('y', 'z')])
+        client.shutdown()
+        self.assertEqual(self.session.executed, [('SELECT * FROM t WHERE a = %s AND b IN %s', ['x', ('y', 'z')])])
+
+    def test_should_raise_error_when_statement_fails(self):
+        self.start_server()
+        client = BrokerSession(self.socket_path)
+        with self.assertRaises(Exception) as context:
+            client.execute('FAIL')
+        client.shutdown()
+        self.assertIn('unconfigured table', str(context.exception))
+
+    def test_should_return_result_for_every_statement_when_executed_concurrently(self):
+        self.start_server()
+        client = BrokerSession(self.socket_path)
+        results = client.execute_concurrent([('LIST USERS', None), ('FAIL', None), ('CREATE USER %s', ['a'])])
+        client.shutdown()
+        self.assertEqual([success for success, result in results], [True, False, True])
+        self.assertIsInstance(results[1][1], BrokerError)
+
+    def test_should_execute_concurrently_with_the_driver_for_sessions_of_the_driver(self):
+        cassandra = fake_cassandra.FakeCassandra()
+        self.session = fake_cassandra.FakeSession(cassandra)
+        self.start_server()
+        client = BrokerSession(self.socket_path)
+        results = client.execute_concurrent([('CREATE USER %s WITH PASSWORD %s NOSUPERUSER', ['app', 'secret']),
+                                             ('CREATE USER %s WITH PASSWORD %s NOSUPERUSER', ['app', 'secret']),
+                                             ('SELECT role FROM system_auth.roles WHERE role = %s', ['app'])])
+        client.shutdown()
+        self.assertEqual([success for success, result in results], [True, False, True])
+        self.assertIn('already exists', str(results[1][1]))
+        self.assertEqual([row.role for row in results[2][1]], ['app'])
+        self.assertIn('app', cassandra.users)
+
+    def test_should_serve_several_clients_with_one_session(self):
+        self.start_server()
+        first = BrokerSession(self.socket_path)
+        second = BrokerSession(self.socket_path)
+        first.execute('LIST USERS')
+        second.execute('LIST USERS')
+        first.shutdown()
+        second.shutdown()
+        self.assertEqual(len(self.session.executed), 2)
+
+    def test_should_exit_and_remove_socket_when_idle_for_ttl(self):
+        server = self.start_server(ttl=0)
+        server.join(5)
+        self.assertFalse(server.is_alive(), 'broker should have exited')
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_should_start_broker_once_and_reuse_it(self):
+        options = dict(db_host='localhost', db_user='cassandra')
+        closed = []
+
+        def connect():
+            return FakeSession(), lambda: closed.append(True)
+
+        first = broker_session(self.socket_dir, options, connect, 60)
+        broker_pid = first.execute('PID')[0].pid
+        first.shutdown()
+        second = broker_session(self.socket_dir, options, connect, 60)
+        self.assertEqual(second.execute('PID')[0].pid, broker_pid)
+        second.shutdown()
+
+        self.assertNotEqual(broker_pid, os.getpid())
+        self.assertEqual(closed, [], 'the session must only be opened inside the broker')
+        os.kill(broker_pid, 15)
+
+    def test_should_derive_socket_names_from_a_private_secret(self):
+        options = dict(db_host='localhost', db_user='cassandra', db_password='secret')
+        other_dir = tempfile.mkdtemp()
+        try:
+            path = cassandra_broker.broker_socket_path(self.socket_dir, options)
+            self.assertEqual(cassandra_broker.broker_socket_path(self.socket_dir, options), path)
+            self.assertNotEqual(os.path.basename(cassandra_broker.broker_socket_path(other_dir, options)),
+                                os.path.basename(path))
+            other_password = dict(options, db_password='other')
+            self.assertNotEqual(cassandra_broker.broker_socket_path(self.socket_dir, other_password), path)
+            self.assertEqual(os.stat(os.path.join(self.socket_dir, 'broker.key')).st_mode & 0o777, 0o600)
+        finally:
+            shutil.rmtree(other_dir)
+
+    def test_should_report_error_when_broker_can_not_connect(self):
+        def connect():
+            raise RuntimeError('Bad credentials')
+
+        with self.assertRaises(BrokerError) as context:
+            broker_session(self.socket_dir, dict(db_host='localhost'), connect, 60)
+        self.assertEqual(str(context.exception), 'Bad credentials')
+        self.assertFalse(broker_alive(cassandra_broker.broker_socket_path(self.socket_dir, dict(db_host='localhost'))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -47,7 +47,7 @@ class CassandraKeyspaceTest(unittest.TestCase):
 
     def test_should_return_error_for_missing_user_argument_when_no_user_given(self):
         output = self.run_module('cassandra_user.py')
-        self.assertEqual(output['msg'], 'missing required arguments: user')
+        self.assertEqual(output['msg'], 'one of the following is required: user, users')
 
     def test_should_return_error_for_missing_password_argument_when_no_password_given(self):
         output = self.run_module('cassandra_user.py', "user={} db_host={}".format(USER_TO_CREATE, DB_HOST))
@@ -70,6 +70,13 @@ class CassandraKeyspaceTest(unittest.TestCase):
         self.assertTrue(output['changed'])
         self.assertTrue(self.can_login(USER_TO_CREATE, 'anothertest'), "Password seems not to be updated.")
 
+    def test_should_not_update_password_when_existing_user_and_same_password_given(self):
+        self.run_module('cassandra_user.py', "user={} password=test db_host={}".format(USER_TO_CREATE, DB_HOST))
+        output = self.run_module('cassandra_user.py',
+                                 "user={} password=test db_host={}".format(USER_TO_CREATE, DB_HOST))
+        self.assertFalse(output['changed'])
+        self.assertTrue(self.can_login(USER_TO_CREATE, 'test'), "Password should not have changed.")
+
     def test_should_update_password_when_existing_user_and_update_password_on_create_given(self):
         self.run_module('cassandra_user.py', "user={} password=test db_host={}".format(USER_TO_CREATE, DB_HOST))
         output = self.run_module('cassandra_user.py',
@@ -0,0 +1,153 @@
+import datetime
+import decimal
+import socket
+import unittest
+import uuid
+
+from fake_cassandra import FakeCassandra, FakeNativeServer, run_module
+
+from ansible.module_utils.cassandra_native import (AuthenticationFailed, InvalidRequest, NativeSession,
+                                                   NoHostAvailable, Statement, bind, decode_value)
+
+
+class NativeClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cassandra = FakeCassandra()
+        self.server = FakeNativeServer(self.cassandra)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def connect(self, username='cassandra', password='cassandra', **options):
+        return NativeSession('127.0.0.1', self.server.port, username=username, password=password, **options)
+
+    def test_should_authenticate_and_bind_values(self):
+        session = self.connect()
+        rows = list(session.execute('SELECT role, is_superuser FROM system_auth.roles WHERE role = %s',
+                                    ['cassandra']))
+        session.shutdown()
+        self.assertEqual([(row.role, row.is_superuser) for row in rows], [('cassandra', True)])
+        self.assertEqual(self.server.protocol_versions, [4, 4, 4])
+        self.assertEqual(self.cassandra.connections, 1)
+
+    def test_should_fail_with_wrong_password(self):
+        with self.assertRaises(AuthenticationFailed):
+            self.connect(password='wrong')
+
+    def test_should_fail_when_nothing_listens(self):
+        probe = socket.socket()
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+        probe.close()
+        with self.assertRaises(NoHostAvailable):
+            NativeSession('127.0.0.1', port)
+
+    def test_should_fetch_further_pages_while_iterating(self):
+        self.cassandra.add_users(24)
+        session = self.connect(consistency='LOCAL_ONE')
+        rows = session.execute(Statement('SELECT role, is_superuser FROM system_auth.roles', fetch_size=10))
+        self.assertEqual(len(rows.current_rows), 10)
+        self.assertEqual(len(list(rows)), 25)
+        session.shutdown()
+        self.assertEqual(len(self.cassandra.queries), 3)
+        self.assertEqual(self.server.consistency_levels, [10, 10, 10])
+
+    def test_should_raise_invalid_request_for_missing_table(self):
+        session = self.connect()
+        with self.assertRaises(InvalidRequest) as context:
+            session.execute('SELECT name FROM system_auth.users')
+        session.shutdown()
+        self.assertIn('unconfigured table', str(context.exception))
+
+    def test_should_pipeline_concurrent_statements(self):
+        session = self.connect()
+        results = session.execute_concurrent([('CREATE USER %s WITH PASSWORD %s NOSUPERUSER', ('app', "it's")),
+                                              ('CREATE USER %s WITH PASSWORD %s NOSUPERUSER', ('cassandra', 'x')),
+                                              ('SELECT keyspace_name FROM system_schema.keyspaces', None)],
+                                             concurrency=2, raise_on_first_error=False)
+        session.shutdown()
+        self.assertEqual([success for success, result in results], [True, False, True])
+        self.assertIsInstance(results[1][1], InvalidRequest)
+        self.assertEqual(self.cassandra.users['app'], dict(password="it's", superuser=False))
+
+    def test_should_bind_only_values_of_clear_type(self):
+        self.assertEqual(bind('SELECT a FROM t WHERE b IN %s', [('x', 'y')]),
+                         ('SELECT a FROM t WHERE b IN ?', [b'\x00\x00\x00\x02\x00\x00\x00\x01x\x00\x00\x00\x01y']))
+        self.assertEqual(bind('SELECT a FROM t WHERE b = %s', [1]), ('SELECT a FROM t WHERE b = 1', None))
+        self.assertEqual(bind('ALTER USER %s WITH PASSWORD %s', ['app', "it's"]),
+                         ("ALTER USER 'app' WITH PASSWORD 'it''s'", None))
+
+    def test_should_decode_column_types(self):
+        self.assertEqual(decode_value(('varint',), b'\xff\x00'), -256)
+        self.assertEqual(decode_value(('decimal',), b'\x00\x00\x00\x02\x04\xd2'), decimal.Decimal('12.34'))
+        self.assertEqual(decode_value(('date',), b'\x80\x00\x00\x01'), datetime.date(1970, 1, 2))
+        self.assertEqual(decode_value(('inet',), b'\x7f\x00\x00\x01'), '127.0.0.1')
+        self.assertEqual(decode_value(('map', ('varchar',), ('int',)),
+                                      b'\x00\x00\x00\x01\x00\x00\x00\x01a\x00\x00\x00\x04\x00\x00\x00\x07'), {'a': 7})
+        value = uuid.uuid4()
+        self.assertEqual(decode_value(('tuple', [('uuid',), ('boolean',)]),
+                                      b'\x00\x00\x00\x10' + value.bytes + b'\x00\x00\x00\x01\x01'), (value, True))
+
+
+class NativeModulesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cassandra = FakeCassandra()
+        self.server = FakeNativeServer(self.cassandra)
+        self.connection = dict(driver='native', db_host='127.0.0.1', db_port=self.server.port, protocol_version=4)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_should_manage_users_with_the_native_client(self):
+        output, cost = run_module('cassandra_user', self.cassandra,
+                                  dict(self.connection, users=[dict(user='app', password='secret'),
+                                                               dict(user='admin', password='secret', superuser=True)]))
+        self.assertTrue(output['changed'])
+        self.assertEqual(self.cassandra.users['admin'], dict(password='secret', superuser=True))
+        self.assertEqual(cost['connections'], 1)
+
+        output, cost = run_module('cassandra_user', self.cassandra,
+                                  dict(self.connection, user='app', password='secret'))
+        self.assertFalse(output['changed'])
+        self.assertEqual(cost['connections'], 2)
+
+    def test_should_read_facts_with_the_native_client(self):
+        self.cassandra.add_keyspaces(3)
+        output, cost = run_module('cassandra_facts', self.cassandra, self.connection)
+        self.assertEqual(output['ansible_facts']['cassandra_cluster']['protocol_version'], 4)
+        self.assertEqual(sorted(output['ansible_facts']['cassandra_keyspaces']),
+                         ['keyspace0', 'keyspace1', 'keyspace2'])
+        self.assertEqual(cost['connections'], 1)
+
+    def test_should_skip_hosts_that_refuse_connections(self):
+        output, cost = run_module('cassandra_facts', self.cassandra,
+                                  dict(self.connection, db_hosts=['127.0.0.2', '127.0.0.1'], gather=['cluster']))
+        self.assertEqual(output['connection']['host'], '127.0.0.1')
+        self.assertEqual(output['ansible_facts']['cassandra_cluster']['release_version'], '3.11.4')
+
+    def test_should_tune_table_options_with_the_native_client(self):
+        self.cassandra.add_keyspaces(1)
+        self.cassandra.add_tables(2, 'keyspace0')
+        args = dict(self.connection, db_user='cassandra', db_password='cassandra', keyspace='keyspace0',
+                    bloom_filter_fp_chance=0.1,
+                    tables=[dict(name='table0'), dict(name='table1', caching={'keys': 'NONE'})])
+        output, cost = run_module('cassandra_table_options', self.cassandra, args)
+        self.assertEqual(output['results'][1]['option_changes']['caching'],
+                         dict(before={'keys': 'ALL', 'rows_per_partition': 'NONE'},
+                              after={'keys': 'NONE', 'rows_per_partition': 'NONE'}))
+        self.assertEqual(self.cassandra.table_options[('keyspace0', 'table0')]['bloom_filter_fp_chance'], 0.1)
+
+        output, cost = run_module('cassandra_table_options', self.cassandra, args)
+        self.assertFalse(output['changed'])
+
+    def test_should_fail_on_speculative_executions(self):
+        output, cost = run_module('cassandra_facts', self.cassandra,
+                                  dict(self.connection, speculative_execution_delay=0.1))
+        self.assertTrue(output['failed'])
+        self.assertIn('native driver', output['msg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,558 @@
+import subprocess
+import sys
+import time
+import unittest
+
+from cassandra import ConsistencyLevel
+from cassandra.cluster import EXEC_PROFILE_DEFAULT
+from cassandra.policies import (ConstantSpeculativeExecutionPolicy, DCAwareRoundRobinPolicy,
+                                WhiteListRoundRobinPolicy)
+
+from fake_cassandra import REPO_DIR, FakeCassandra, FakeClusters, masked_values, run_module
+
+# Upper bound for the module overhead per managed object in the bulk modes, far above what a run needs today
+SECONDS_PER_OBJECT = 0.005
+
+
+class CassandraUserOfflineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cassandra = FakeCassandra()
+
+    def run_user(self, **args):
+        return run_module('cassandra_user', self.cassandra, args)
+
+    def test_should_create_user_with_one_lookup_and_one_connection(self):
+        output, cost = self.run_user(user='testuser', password='test')
+        self.assertTrue(output['changed'])
+        self.assertEqual(output['msg'], 'User created')
+        self.assertEqual(self.cassandra.users['testuser'], dict(password='test', superuser=False))
+        self.assertEqual(cost['connections'], 1)
+        self.assertEqual(cost['queries'], 2)
+
+    def test_should_read_single_partition_when_user_unchanged(self):
+        self.cassandra.add_users(1000)
+        output, cost = self.run_user(user='user1', password='other', update_password='on_create')
+        self.assertFalse(output['changed'])
+        self.assertEqual(self.cassandra.queries,
+                         ['SELECT role, is_superuser, can_login FROM system_auth.roles WHERE role = %s'])
+
+    def test_should_fall_back_to_legacy_users_table_when_no_roles_table_exists(self):
+        self.cassandra.release_version = '2.1.9'
+        output, cost = self.run_user(user='cassandra', superuser='yes', update_password='on_create')
+        self.assertFalse(output['changed'])
+        self.assertEqual(cost['queries'], 2)
+
+    def test_should_not_treat_roles_that_cannot_login_as_users(self):
+        self.cassandra.users['readers'] = dict(password=None, superuser=False, login=False)
+        output, cost = self.run_user(user='readers', state='absent')
+        self.assertFalse(output['changed'])
+        self.assertIn('readers', self.cassandra.users)
+
+    def test_should_not_alter_password_when_password_matches(self):
+        self.cassandra.add_users(1)
+        output, cost = self.run_user(user='user0', password='password')
+        self.assertFalse(output['changed'])
+        self.assertFalse(any(query.startswith('ALTER') for query in self.cassandra.queries))
+
+    def test_should_alter_password_when_password_differs(self):
+        self.cassandra.add_users(1)
+        output, cost = self.run_user(user='user0', password='changed')
+        self.assertEqual(output['msg'], 'Password updated')
+        self.assertEqual(self.cassandra.users['user0']['password'], 'changed')
+
+    def test_should_not_write_anything_in_check_mode(self):
+        output, cost = self.run_user(user='testuser', password='test', _ansible_check_mode=True)
+        self.assertTrue(output['changed'])
+        self.assertEqual(output['plan'], ["CREATE USER 'testuser' WITH PASSWORD '********' NOSUPERUSER"])
+        self.assertNotIn('testuser', self.cassandra.users)
+
+    def test_should_mask_the_passwords_of_all_users(self):
+        output, cost = self.run_user(users=[dict(user='app', password='first-secret'),
+                                            dict(user='admin', password='second-secret', superuser=True)])
+        self.assertTrue(output['changed'])
+        self.assertTrue(set(['first-secret', 'second-secret']) <= masked_values())
+
+    def test_should_use_quorum_on_db_host_by_default(self):
+        self.run_user(user='cassandra', update_password='on_create', superuser='yes')
+        profile = self.cassandra.cluster_options['execution_profiles'][EXEC_PROFILE_DEFAULT]
+        self.assertEqual(profile.consistency_level, ConsistencyLevel.QUORUM)
+        self.assertIsInstance(profile.load_balancing_policy, WhiteListRoundRobinPolicy)
+        self.assertNotIsInstance(profile.speculative_execution_policy, ConstantSpeculativeExecutionPolicy)
+
+    def test_should_configure_local_consistency_and_speculative_reads(self):
+        self.run_user(user='cassandra', update_password='on_create', superuser='yes', consistency='LOCAL_QUORUM',
+                      local_dc='dc1', request_timeout=2.5, speculative_execution_delay=0.05)
+        profile = self.cassandra.cluster_options['execution_profiles'][EXEC_PROFILE_DEFAULT]
+        self.assertEqual(profile.consistency_level, ConsistencyLevel.LOCAL_QUORUM)
+        self.assertEqual(profile.request_timeout, 2.5)
+        self.assertEqual(profile.load_balancing_policy.local_dc, 'dc1')
+        self.assertIsInstance(profile.load_balancing_policy, DCAwareRoundRobinPolicy)
+        self.assertEqual(profile.speculative_execution_policy.max_attempts, 2)
+
+    def test_should_read_users_once_in_bulk_mode_regardless_of_their_number(self):
+        for count in [10, 1000]:
+            self.setUp()
+            self.cassandra.add_users(count)
+            users = [dict(user='user{0}'.format(index), superuser=index % 2 == 0, update_password='on_create')
+                     for index in range(count)]
+            users += [dict(user='new{0}'.format(index), password='new') for index in range(count)]
+            output, cost = self.run_user(users=users)
+
+            reads = [query for query in self.cassandra.queries if query.startswith('SELECT')]
+            self.assertEqual(len(reads), 1)
+            self.assertEqual(cost['queries'], 1 + count // 2 + count)
+            self.assertEqual(cost['connections'], 1)
+            self.assertEqual(len(output['results']), 2 * count)
+            self.assertLess(cost['seconds'], SECONDS_PER_OBJECT * 2 * count + 1)
+
+    def test_should_time_and_trace_every_concurrent_statement(self):
+        self.cassandra.add_users(1)
+        output, cost = self.run_user(users=[dict(user='user0', password='changed'), dict(user='new0', password='new'),
+                                            dict(user='new1', password='new')], profile=True, trace=True)
+        statements = output['timings']['statements']
+        self.assertEqual(len(statements), cost['queries'])
+        self.assertEqual(sorted(entry['statement'].split(' ')[0] for entry in statements),
+                         ['ALTER', 'CREATE', 'CREATE', 'SELECT'])
+        for entry in statements:
+            self.assertEqual(entry['trace']['coordinator'], '127.0.0.1')
+
+
+class CassandraKeyspaceOfflineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cassandra = FakeCassandra()
+
+    def run_keyspace(self, **args):
+        return run_module('cassandra_keyspace', self.cassandra, args)
+
+    def test_should_create_keyspace_and_wait_for_schema_agreement_once(self):
+        output, cost = self.run_keyspace(name='test_keyspace', replication_factor='3')
+        self.assertEqual(output['msg'], 'Keyspace created')
+        self.assertTrue(output['schema_agreement']['agreed'])
+        self.assertEqual(self.cassandra.keyspaces['test_keyspace']['replication_factor'], '3')
+        self.assertEqual(cost['queries'], 4)
+
+    def test_should_not_change_keyspace_with_same_replication_factor(self):
+        self.cassandra.add_keyspaces(1, replication_factor=2)
+        output, cost = self.run_keyspace(name='keyspace0', replication_factor='2')
+        self.assertFalse(output['changed'])
+        self.assertEqual(cost['queries'], 1)
+
+    def test_should_read_legacy_schema_table_with_one_query(self):
+        self.cassandra.release_version = '2.1.9'
+        self.cassandra.add_keyspaces(1, replication_factor=2)
+        output, cost = self.run_keyspace(name='keyspace0', replication_factor='2')
+        self.assertFalse(output['changed'])
+        self.assertEqual(self.cassandra.queries, [
+            'SELECT keyspace_name, durable_writes, strategy_class, strategy_options FROM system.schema_keyspaces '
+            'WHERE keyspace_name IN %s'])
+
+    def test_should_create_mixed_case_keyspace_once(self):
+        output, cost = self.run_keyspace(keyspaces=[dict(name='Orders', replication_factor=3)])
+        self.assertEqual(output['results'][0]['msg'], 'Keyspace created')
+        self.assertIn('orders', self.cassandra.keyspaces)
+        output, cost = self.run_keyspace(keyspaces=[dict(name='Orders', replication_factor=3)])
+        self.assertFalse(output['changed'])
+        self.assertEqual(output['results'][0]['keyspace'], 'orders')
+
+    def test_should_reject_invalid_keyspace_names(self):
+        output, cost = self.run_keyspace(name='orders WITH durable_writes')
+        self.assertTrue(output['failed'])
+        self.assertEqual(output['msg'], 'Invalid keyspace name orders WITH durable_writes.')
+        self.assertEqual(cost['queries'], 0)
+
+    def test_should_read_keyspaces_once_and_wait_once_in_bulk_mode(self):
+        for count in [10, 1000]:
+            self.setUp()
+            self.cassandra.add_keyspaces(count)
+            keyspaces = [dict(name='keyspace{0}'.format(index), replication_factor=index % 2 + 2)
+                         for index in range(count)]
+            keyspaces += [dict(name='new{0}'.format(index)) for index in range(count)]
+            output, cost = self.run_keyspace(keyspaces=keyspaces)
+
+            self.assertEqual(cost['queries'], 1 + count // 2 + count + 2)
+            self.assertEqual(cost['connections'], 1)
+            self.assertTrue(output['schema_agreement']['agreed'])
+            self.assertLess(cost['seconds'], SECONDS_PER_OBJECT * 2 * count + 1)
+
+    def test_should_alter_only_when_a_data_center_changed(self):
+        self.cassandra.keyspaces['orders'] = {'class': 'org.apache.cassandra.locator.NetworkTopologyStrategy',
+                                              'dc1': '3', 'dc2': '2'}
+        output, cost = self.run_keyspace(name='orders', strategy='NetworkTopologyStrategy',
+                                         replication=dict(dc2=2, dc1=3))
+        self.assertFalse(output['changed'])
+        self.assertEqual(cost['queries'], 1)
+
+        output, cost = self.run_keyspace(name='orders', strategy='NetworkTopologyStrategy',
+                                         replication=dict(dc1=3, dc2=1, dc3=2))
+        self.assertEqual(output['msg'], 'Replication updated')
+        self.assertEqual(output['replication_changes'], dict(dc2=dict(before=2, after=1), dc3=dict(before=0, after=2)))
+        self.assertEqual(output['gained_replicas'], ['dc3'])
+        self.assertEqual(output['lost_replicas'], ['dc2'])
+        self.assertEqual(self.cassandra.keyspaces['orders']['dc3'], '2')
+
+    def test_should_report_whole_cluster_when_replication_factor_changed(self):
+        self.cassandra.add_keyspaces(1, replication_factor=2)
+        output, cost = self.run_keyspace(name='keyspace0', replication_factor=3)
+        self.assertEqual(output['msg'], 'Replication factor updated')
+        self.assertEqual(output['gained_replicas'], ['replication_factor'])
+
+    def test_should_report_timings_when_profiling(self):
+        self.cassandra.add_keyspaces(2)
+        output, cost = self.run_keyspace(keyspaces=[dict(name='keyspace0', replication_factor=3),
+                                                    dict(name='keyspace1', replication_factor=3),
+                                                    dict(name='new0')], profile=True)
+        timings = output['timings']
+        self.assertIsNotNone(timings['connect'])
+        self.assertIsNotNone(timings['schema_agreement'])
+        self.assertEqual(timings['statement_count'], cost['queries'])
+        self.assertEqual(timings['statement_types'], {'SELECT': 3, 'ALTER': 2, 'CREATE': 1})
+
+
+class CassandraTableOfflineTest(unittest.TestCase):
+
+    COLUMNS = dict(order_id='uuid', item_id='int', attributes='map<text, text>')
+
+    def setUp(self):
+        self.cassandra = FakeCassandra()
+        self.cassandra.add_keyspaces(1, prefix='orders')
+
+    def run_table(self, **args):
+        return run_module('cassandra_table', self.cassandra, dict(keyspace='orders0', **args))
+
+    def test_should_create_types_and_tables_and_wait_for_schema_agreement_once(self):
+        output, cost = self.run_table(
+            types=[dict(name='address', fields=dict(street='text', city='text'))],
+            tables=[dict(name='items', columns=self.COLUMNS, primary_key=['order_id', 'item_id']),
+                    dict(name='customers', columns=dict(id='uuid', home='frozen<address>'), primary_key='id')])
+        self.assertEqual([result['msg'] for result in output['results']], ['Type created'] + ['Table created'] * 2)
+        self.assertEqual(len([query for query in self.cassandra.queries if query.startswith('CREATE')]), 3)
+        self.assertEqual(len([query for query in self.cassandra.queries if 'schema_version' in query]), 2)
+
+    def test_should_only_add_missing_columns(self):
+        self.run_table(name='items', columns=self.COLUMNS, primary_key=['order_id', 'item_id'])
+        output, cost = self.run_table(name='items', columns=dict(self.COLUMNS, note='varchar'),
+                                      primary_key=['order_id', 'item_id'])
+        self.assertEqual(output['msg'], 'Column note added')
+        self.assertIn('ALTER TABLE orders0.items ADD note varchar', self.cassandra.queries)
+
+        output, cost = self.run_table(name='items', columns=self.COLUMNS, primary_key=['order_id', 'item_id'])
+        self.assertFalse(output['changed'])
+        self.assertEqual(output['extra_columns'], ['note'])
+        self.assertEqual(cost['queries'], 1)
+
+    def test_should_fail_on_changes_cassandra_cannot_make(self):
+        self.run_table(name='items', columns=self.COLUMNS, primary_key=['order_id', 'item_id'])
+        output, cost = self.run_table(name='items', columns=self.COLUMNS, primary_key=[['order_id', 'item_id']])
+        self.assertEqual(output['msg'], 'The primary key of table items cannot be changed.')
+        self.assertEqual(cost['queries'], 1)
+
+    def test_should_fail_when_clustering_order_differs(self):
+        self.run_table(name='items', columns=self.COLUMNS, primary_key=['order_id', 'item_id'],
+                       clustering_order=dict(item_id='desc'))
+        output, cost = self.run_table(name='items', columns=self.COLUMNS, primary_key=['order_id', 'item_id'],
+                                      clustering_order=dict(item_id='DESC'))
+        self.assertFalse(output['changed'])
+        output, cost = self.run_table(name='items', columns=self.COLUMNS, primary_key=['order_id', 'item_id'])
+        self.assertEqual(output['msg'],
+                         'The clustering order of column item_id of table items cannot be changed to ASC.')
+        self.assertEqual(cost['queries'], 1)
+
+
+class CassandraTableOptionsOfflineTest(unittest.TestCase):
+
+    LEVELED = {'class': 'LeveledCompactionStrategy', 'sstable_size_in_mb': 160}
+
+    def setUp(self):
+        self.cassandra = FakeCassandra()
+        self.cassandra.add_keyspaces(2, prefix='orders')
+        self.cassandra.add_tables(20, 'orders0')
+        self.cassandra.add_tables(1, 'orders1')
+
+    def run_options(self, **args):
+        return run_module('cassandra_table_options', self.cassandra, dict(keyspace='orders0', **args))
+
+    def test_should_read_once_and_only_alter_tables_that_differ(self):
+        self.run_options(name='table1', compaction=self.LEVELED)
+        output, cost = self.run_options(compaction=self.LEVELED, gc_grace_seconds=864000,
+                                        tables=[dict(name='table{0}'.format(index)) for index in range(20)] +
+                                        [dict(name='table0', keyspace='orders1', gc_grace_seconds=3600)])
+        self.assertTrue(output['changed'])
+        altered = [query for query in self.cassandra.queries if query.startswith('ALTER')]
+        self.assertEqual(len(altered), 20)
+        self.assertEqual(altered[0], "ALTER TABLE orders0.table0 WITH compaction = "
+                                     "{'class': 'LeveledCompactionStrategy', 'sstable_size_in_mb': '160'}")
+        self.assertEqual(len([query for query in self.cassandra.queries if 'system_schema.tables' in query]), 1)
+        self.assertEqual(len([query for query in self.cassandra.queries if 'schema_version' in query]), 2)
+
+        results = dict(((result['keyspace'], result['table']), result) for result in output['results'])
+        self.assertFalse(results[('orders0', 'table1')]['changed'])
+        self.assertEqual(results[('orders1', 'table0')]['msg'], 'Options updated: compaction, gc_grace_seconds')
+        self.assertEqual(results[('orders1', 'table0')]['option_changes']['gc_grace_seconds'],
+                         dict(before=864000, after=3600))
+        changes = results[('orders0', 'table0')]['option_changes']
+        self.assertEqual(list(changes), ['compaction'])
+        self.assertEqual(changes['compaction']['before']['class'],
+                         'org.apache.cassandra.db.compaction.SizeTieredCompactionStrategy')
+        self.assertEqual(changes['compaction']['after'], {'class': 'LeveledCompactionStrategy',
+                                                          'sstable_size_in_mb': '160'})
+
+    def test_should_compare_normalized_values(self):
+        output, cost = self.run_options(name='table0', bloom_filter_fp_chance='0.010', gc_grace_seconds=864000,
+                                        compaction={'class': 'SizeTieredCompactionStrategy', 'min_threshold': 4},
+                                        compression={'sstable_compression': 'LZ4Compressor', 'chunk_length_kb': 64},
+                                        caching={'keys': 'all', 'rows_per_partition': 'none'})
+        self.assertFalse(output['changed'])
+        self.assertEqual(cost['queries'], 1)
+
+    def test_should_only_plan_in_check_mode_and_report_missing_tables(self):
+        output, cost = self.run_options(tables=[dict(name='table0', caching={'rows_per_partition': 100}),
+                                                dict(name='missing', gc_grace_seconds=0)], _ansible_check_mode=True)
+        self.assertTrue(output['failed'])
+        self.assertEqual(output['results'][0]['plan'],
+                         ["ALTER TABLE orders0.table0 WITH caching = {'keys': 'ALL', 'rows_per_partition': '100'}"])
+        self.assertEqual(output['results'][1]['error'], 'Table orders0.missing does not exist.')
+        self.assertEqual(cost['queries'], 1)
+        self.assertEqual(self.cassandra.table_options[('orders0', 'table0')]['caching']['rows_per_partition'], 'NONE')
+
+    def test_should_keep_the_sub_options_that_are_not_given(self):
+        self.cassandra.table_options[('orders0', 'table0')]['compaction']['max_threshold'] = '64'
+        output, cost = self.run_options(name='table0', compaction={'class': 'SizeTieredCompactionStrategy',
+                                                                   'min_threshold': 8})
+        after = output['option_changes']['compaction']['after']
+        self.assertEqual((after['max_threshold'], after['min_threshold']), ('64', '8'))
+        self.assertEqual(self.cassandra.table_options[('orders0', 'table0')]['compaction']['max_threshold'], '64')
+
+        output, cost = self.run_options(name='table0', compression={'chunk_length_in_kb': 16})
+        self.assertEqual(output['msg'], 'Option compression of table orders0.table0 needs a class.')
+        self.assertEqual(cost['connections'], 0)
+
+    def test_should_disable_and_enable_compression_without_a_class(self):
+        output, cost = self.run_options(name='table0', compression={'enabled': True})
+        self.assertFalse(output['changed'])
+
+        output, cost = self.run_options(name='table0', compression={'enabled': False})
+        self.assertEqual(output['option_changes']['compression']['after'], {'enabled': 'false'})
+        self.assertEqual(self.cassandra.table_options[('orders0', 'table0')]['compression'], {'enabled': 'false'})
+
+        output, cost = self.run_options(name='table0', compression={'enabled': 'false'})
+        self.assertFalse(output['changed'])
+
+        output, cost = self.run_options(name='table0', compression={'enabled': True})
+        self.assertTrue(output['changed'])
+        self.assertEqual(self.cassandra.table_options[('orders0', 'table0')]['compression'], {'enabled': 'true'})
+
+        output, cost = self.run_options(name='table0', compression={'enabled': False, 'chunk_length_in_kb': 16})
+        self.assertEqual(output['msg'], 'Option compression of table orders0.table0 takes no other sub options '
+                                        'when it is disabled.')
+
+
+class CassandraGrantOfflineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cassandra = FakeCassandra()
+        self.cassandra.add_users(1, prefix='app')
+
+    def run_grant(self, **args):
+        return run_module('cassandra_grant', self.cassandra, args)
+
+    def test_should_only_grant_missing_and_revoke_extra_permissions(self):
+        self.cassandra.grant_permissions('app0', '<keyspace app>', ['SELECT', 'DROP'])
+        output, cost = self.run_grant(role='app0', permissions=[
+            dict(resource='KEYSPACE app', permissions=['SELECT', 'MODIFY']),
+            dict(resource='table Reference.Countries', permissions='select')])
+        self.assertTrue(output['changed'])
+        self.assertEqual(output['changes'], ['granted MODIFY ON KEYSPACE app',
+                                             'granted SELECT ON TABLE reference.countries',
+                                             'revoked DROP ON KEYSPACE app'])
+        self.assertEqual(self.cassandra.permissions['app0'], set([
+            ('<keyspace app>', 'SELECT'), ('<keyspace app>', 'MODIFY'), ('<table reference.countries>', 'SELECT')]))
+        self.assertEqual(cost['queries'], 4)
+
+    def test_should_only_read_when_permissions_are_in_place(self):
+        self.cassandra.grant_permissions('app0', '<all keyspaces>', ['CREATE', 'ALTER', 'DROP', 'SELECT', 'MODIFY',
+                                                                     'AUTHORIZE'])
+        output, cost = self.run_grant(role='app0', permissions=[dict(resource='ALL KEYSPACES', permissions='ALL')])
+        self.assertFalse(output['changed'])
+        self.assertEqual(cost['queries'], 1)
+
+    def test_should_not_change_anything_in_check_mode(self):
+        output, cost = self.run_grant(role='app0', permissions=[dict(resource='ROLE admin', permissions=['ALTER'])],
+                                      _ansible_check_mode=True)
+        self.assertEqual(output['plan'], ["GRANT ALTER ON ROLE admin TO 'app0'"])
+        self.assertEqual(self.cassandra.permissions['app0'], set())
+
+    def test_should_reject_invalid_resources_and_permissions_before_connecting(self):
+        output, cost = self.run_grant(role='app0', permissions=[dict(resource='KEYSPACE app; DROP', permissions=[])])
+        self.assertEqual(output['msg'], 'Invalid resource KEYSPACE app; DROP.')
+        output, cost = self.run_grant(role='app0', permissions=[dict(resource='TABLE a.b', permissions=['CREATE'])])
+        self.assertTrue(output['failed'])
+        self.assertEqual(cost['connections'], 0)
+
+
+class FingerprintOfflineTest(unittest.TestCase):
+
+    TABLE = 'ops0.fingerprints'
+
+    def setUp(self):
+        self.cassandra = FakeCassandra()
+        self.cassandra.add_keyspaces(1, prefix='ops')
+
+    def test_should_skip_users_with_one_partition_read_while_fingerprints_match(self):
+        users = [dict(user='user{0}'.format(index), password='secret') for index in range(20)]
+        output, cost = run_module('cassandra_user', self.cassandra, dict(users=users, fingerprint_table=self.TABLE))
+        self.assertTrue(output['changed'])
+        self.assertEqual(output['fingerprints']['stored'], 20)
+        self.assertEqual(len(output['fingerprints']['missing']), 20)
+        self.assertNotIn('secret', str(self.cassandra.rows))
+
+        output, cost = run_module('cassandra_user', self.cassandra, dict(users=users, fingerprint_table=self.TABLE))
+        self.assertFalse(output['changed'])
+        self.assertEqual(output['fingerprints'], dict(matched=True))
+        self.assertEqual(cost['connections'], 1)
+        self.assertEqual(len([query for query in self.cassandra.queries if self.TABLE in query]), 1)
+        self.assertEqual(cost['queries'], 2)
+
+        users[3]['password'] = 'changed'
+        output, cost = run_module('cassandra_user', self.cassandra, dict(users=users, fingerprint_table=self.TABLE))
+        self.assertEqual([result['user'] for result in output['results'] if result['changed']], ['user3'])
+        self.assertEqual(output['fingerprints']['stale'], ['user3'])
+        self.assertEqual(self.cassandra.users['user3']['password'], 'changed')
+
+    def test_should_reconcile_keyspaces_again_after_a_schema_change(self):
+        args = dict(name='orders', replication_factor=3, fingerprint_table=self.TABLE)
+        run_module('cassandra_keyspace', self.cassandra, args)
+        output, cost = run_module('cassandra_keyspace', self.cassandra, args)
+        self.assertEqual(output['fingerprints'], dict(matched=True))
+        self.assertEqual(cost['queries'], 2)
+
+        self.cassandra.keyspaces['orders']['replication_factor'] = '2'
+        self.cassandra.schema_changed()
+        output, cost = run_module('cassandra_keyspace', self.cassandra, args)
+        self.assertEqual(output['msg'], 'Replication factor updated')
+        self.assertEqual(output['fingerprints']['stale'], ['orders'])
+
+        output, cost = run_module('cassandra_keyspace', self.cassandra, args)
+        self.assertFalse(output['changed'])
+        self.assertEqual(output['fingerprints'], dict(matched=True))
+
+
+class MultipleClustersOfflineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clusters = FakeClusters(dict(('127.0.0.{0}'.format(index), FakeCassandra()) for index in range(5)))
+
+    def test_should_reconcile_every_cluster_and_report_unreachable_ones(self):
+        self.clusters.clusters['127.0.0.3'].reachable = False
+        targets = [dict(name='cluster{0}'.format(index), db_host='127.0.0.{0}'.format(index)) for index in range(5)]
+        output, cost = run_module('cassandra_user', self.clusters, dict(user='app', password='secret',
+                                                                        clusters=targets, cluster_concurrency=2))
+        self.assertTrue(output['failed'])
+        self.assertTrue(output['changed'])
+        self.assertEqual([result['cluster'] for result in output['clusters']],
+                         ['cluster0', 'cluster1', 'cluster2', 'cluster3', 'cluster4'])
+        self.assertIn('Unable to connect', output['clusters'][3]['msg'])
+        for index in [0, 1, 2, 4]:
+            self.assertEqual(output['clusters'][index]['msg'], 'User created')
+            self.assertIn('app', self.clusters.clusters['127.0.0.{0}'.format(index)].users)
+
+    def test_should_use_the_credentials_of_each_cluster(self):
+        self.clusters.clusters['127.0.0.1'].users['cassandra']['password'] = 'other'
+        targets = [dict(db_host='127.0.0.0'), dict(db_host='127.0.0.1', db_password='other')]
+        output, cost = run_module('cassandra_keyspace', self.clusters, dict(name='orders', clusters=targets,
+                                                                            db_user='cassandra',
+                                                                            db_password='cassandra'))
+        self.assertFalse(output.get('failed'))
+        self.assertEqual([result['cluster'] for result in output['clusters']], ['127.0.0.0', '127.0.0.1'])
+        self.assertEqual(cost['connections'], 2)
+        for name in ['127.0.0.0', '127.0.0.1']:
+            self.assertIn('orders', self.clusters.clusters[name].keyspaces)
+
+
+    def test_should_mask_passwords_and_report_timings_of_each_cluster(self):
+        self.clusters.clusters['127.0.0.1'].users['cassandra']['password'] = 'other-secret'
+        targets = [dict(db_host='127.0.0.0'), dict(db_host='127.0.0.1', db_password='other-secret')]
+        output, cost = run_module('cassandra_keyspace', self.clusters, dict(name='orders', clusters=targets,
+                                                                            db_user='cassandra',
+                                                                            db_password='cassandra', profile=True))
+        self.assertFalse(output.get('failed'))
+        self.assertIn('other-secret', masked_values())
+        for result in output['clusters']:
+            self.assertEqual(result['timings']['statement_types']['CREATE'], 1)
+
+
+class MultipleHostsOfflineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cassandra = FakeCassandra()
+        self.cassandra.down_hosts.add('127.0.0.1')
+        self.cassandra.host_delays['127.0.0.2'] = 1.0
+
+    def test_should_use_the_first_host_that_connects(self):
+        self.cassandra.add_users(1)
+        output, cost = run_module('cassandra_user', self.cassandra,
+                                  dict(user='user0', password='changed',
+                                       db_hosts=['127.0.0.1', '127.0.0.2', '127.0.0.3']))
+        self.assertTrue(output['changed'])
+        self.assertEqual(output['connection']['host'], '127.0.0.3')
+        self.assertLess(output['connection']['seconds'], 1.0)
+        self.assertLess(cost['seconds'], 1.0)
+        # the password check logs in to the same host
+        self.assertEqual(self.cassandra.cluster_options['contact_points'], ['127.0.0.3'])
+        self.assertEqual(self.cassandra.users['user0']['password'], 'changed')
+
+    def test_should_not_wait_for_slow_hosts_when_exiting(self):
+        script = ("import time, fake_cassandra\n"
+                  "from ansible.module_utils.cassandra_common import first_connected\n"
+                  "def open_host(host):\n"
+                  "    time.sleep(host)\n"
+                  "    return host, lambda: None\n"
+                  "print(first_connected([0, 5], open_host)[0])\n")
+        start = time.time()
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=REPO_DIR)
+        self.assertEqual(output.decode('utf-8').strip(), '0')
+        self.assertLess(time.time() - start, 5)
+
+    def test_should_fail_with_the_errors_of_all_hosts(self):
+        output, cost = run_module('cassandra_keyspace', self.cassandra,
+                                  dict(name='orders', db_hosts=['127.0.0.1', '127.0.0.2'], connect_timeout=0.1))
+        self.assertTrue(output['failed'])
+        self.assertIn('127.0.0.1: ', output['msg'])
+        self.assertIn('127.0.0.2: ', output['msg'])
+        self.assertNotIn('orders', self.cassandra.keyspaces)
+
+
+class CassandraFactsOfflineTest(unittest.TestCase):
+
+    def test_should_gather_all_facts_with_three_queries(self):
+        cassandra = FakeCassandra()
+        cassandra.add_keyspaces(100)
+        cassandra.add_users(100)
+        output, cost = run_module('cassandra_facts', cassandra, {})
+        facts = output['ansible_facts']
+        self.assertEqual(facts['cassandra_cluster']['release_version'], '3.11.4')
+        self.assertEqual(facts['cassandra_keyspaces']['keyspace0']['replication'], {'replication_factor': '2'})
+        self.assertEqual(len(facts['cassandra_users']), 101)
+        self.assertEqual(cost['queries'], 3)
+
+    def test_should_report_roles_that_cannot_login(self):
+        cassandra = FakeCassandra()
+        cassandra.users['readers'] = dict(password=None, superuser=False, login=False)
+        output, cost = run_module('cassandra_facts', cassandra, dict(gather=['users']))
+        users = output['ansible_facts']['cassandra_users']
+        self.assertEqual(users['readers'], dict(superuser=False, can_login=False))
+        self.assertEqual(users['cassandra'], dict(superuser=True, can_login=True))
+
+    def test_should_read_legacy_keyspaces_without_detection(self):
+        cassandra = FakeCassandra(release_version='2.1.9')
+        cassandra.add_keyspaces(1)
+        output, cost = run_module('cassandra_facts', cassandra, dict(gather=['keyspaces']))
+        self.assertEqual(output['ansible_facts']['cassandra_keyspaces']['keyspace0'],
+                         {'class': 'SimpleStrategy', 'replication': {'replication_factor': '2'},
+                          'durable_writes': True})
+        self.assertEqual(cost['queries'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()